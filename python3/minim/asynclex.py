@@ -0,0 +1,74 @@
+"""Lexical scanning of XML-like languages read by asyncio.
+
+``AsyncTokenScanner`` runs a ``TokenScanner`` over a fed sequence.
+When the scanner needs more characters than it has been fed, it awaits
+the next block from the reader, so other tasks run while the data
+arrives, instead of blocking a thread.
+
+This module uses ``async`` syntax, so it is not imported by the other
+modules.
+"""
+from minim import iterseq, lex
+
+
+class AsyncTokenScanner:
+
+    """Generate tokens from an asyncio stream.
+
+    Use ``async for`` to generate the tokens, and ``await get_text`` to
+    obtain the text of a token, in the same order as for a
+    ``TokenScanner``.
+    """
+
+    def __init__(self, reader, block_size=65536, encoding='utf-8', **kw):
+        self.reader = reader
+        self.block_size = block_size
+        if encoding is None:
+            buf = iterseq.FeedSequence()
+        else:
+            buf = iterseq.BytesFeedSequence(encoding)
+        self.scanner = lex.TokenScanner(buf, **kw)
+        self.generator = None
+
+    @classmethod
+    def from_stream(cls, reader, block_size=65536, encoding='utf-8', **kw):
+        """Generates tokens from an ``asyncio.StreamReader``.
+
+        The reader is read in blocks of up to ``block_size`` bytes.  If
+        ``encoding`` is None, the reader must return strings instead.
+
+        Other keyword arguments are passed to the ``TokenScanner``
+        constructor, except that only the default engine is supported.
+        """
+        if kw.get('bulk') or kw.get('interest') is not None:
+            raise ValueError('Only the default engine supports feed')
+        return cls(reader, block_size, encoding, **kw)
+
+    def __aiter__(self):
+        self.generator = iter(self.scanner)
+        return self
+
+    async def __anext__(self):
+        generator = self.generator
+        buf = self.scanner.buf
+        try:
+            token = next(generator)
+            while token is None:
+                # The scanner needs more data
+                data = await self.reader.read(self.block_size)
+                if data:
+                    buf.feed(data)
+                else:
+                    buf.close()
+                token = next(generator)
+        except StopIteration:
+            raise StopAsyncIteration
+        return token
+
+    async def get_text(self, token, text_holder=None):
+        """Return the current text in the input stream.
+
+        The text of the current token is already in the buffer, so this
+        does not wait for the reader.
+        """
+        return self.scanner.get_text(token, text_holder)
@@ -0,0 +1,129 @@
+"""Extract the elements with a tag name from a document.
+
+``iter_elements`` scans a document, and generates the text of each
+element with a given tag name, from the ``<`` of its start tag to the
+``>`` of its end tag.  Outside the matching elements, the scanner's
+``skip_to_start_tag`` passes over content, comments and other elements
+by searching the buffer, without tokenising them.  Only the markup that
+may be a matching start tag is tokenised, and its tag name is compared
+in the scanner's buffer without being sliced.  Inside a matching
+element, the full token stream is read.
+
+Only one element is held at a time.  An element with the tag name that
+is nested in a matching element is included in the text of the outer
+element, and is not generated separately.
+"""
+import itertools
+
+from minim import lex, tokens
+
+
+def scanner_for(source, **kw):
+    """Return a TokenScanner for a source.
+
+    :param source: The path of a file, a file object, or an iterable of
+        strings.
+
+    Other keyword arguments are passed to ``TokenScanner.from_file``,
+    ``TokenScanner.from_stream`` or ``TokenScanner.from_strings``.
+    """
+    if isinstance(source, str):
+        return lex.TokenScanner.from_file(source, **kw)
+    elif hasattr(source, 'read'):
+        return lex.TokenScanner.from_stream(source, **kw)
+    else:
+        return lex.TokenScanner.from_strings(source, **kw)
+
+
+def iter_elements(source, name, spans=False, **kw):
+    """Generate the elements with a tag name.
+
+    Within a matching element, the open tags are counted, so the
+    element ends at the end tag that closes its start tag.  An element
+    that is not complete at the end of the stream is not generated.
+
+    :param source: The path of a file, a file object, an iterable of
+        strings, or a ``TokenScanner`` that has not generated any
+        tokens.
+    :param str name: The tag name of the elements.
+    :param bool spans: If True, generate the (start, end) offsets of
+        each element in the stream, instead of its text.  The offsets
+        are in characters, or in bytes for an encoded source.
+
+    Other keyword arguments are passed to the ``TokenScanner``.
+    """
+    if isinstance(source, lex.TokenScanner):
+        scanner = source
+    else:
+        scanner = scanner_for(source, **kw)
+    buf = scanner.buf
+    get_text = scanner.get_text
+    # A holder for tag names, which refers to the buffer without
+    # slicing it
+    holder = tokens.SpanTextHolder()
+    while scanner.skip_to_start_tag(name):
+        start = buf.tell()
+        markup = scanner.parse_markup(buf)
+        parts = None if spans else []
+        names = []
+        matched = False
+        for token in markup:
+            if isinstance(token, tokens.TagName):
+                text = get_text(token, holder)
+                if names or not text.is_final:
+                    # A name split over buffers is generated as several
+                    # tokens
+                    names.append(text.literal())
+                    if not text.is_final:
+                        continue
+                    matched = ''.join(names) == name
+                else:
+                    matched = text == name
+                if matched and parts is not None:
+                    parts.append(name)
+                break
+            elif not isinstance(token, tokens.StartOrEmptyTagOpen):
+                break
+            if parts is not None:
+                parts.append(get_text(token).literal())
+        if not matched:
+            # Read the rest of the markup
+            for token in markup:
+                pass
+            continue
+        element = _read_element(
+            scanner, itertools.chain(
+                markup, scanner.parse_states(buf, lex.CONTENT, lex.DONE)),
+            parts, start)
+        if element is not None:
+            yield element
+
+
+def _read_element(scanner, token_iter, parts, start):
+    """Read the rest of an element after the name of its start tag.
+
+    The tokens are read until the element ends, leaving the sequence
+    after the element.
+
+    :param list parts: The text of the element so far, or None to
+        return the span of the element.
+    :return: The text or span of the element, or None if the stream
+        ends first.
+    """
+    get_text = scanner.get_text
+    # The number of open tags in the element
+    depth = 1
+    for token in token_iter:
+        if parts is not None:
+            parts.append(get_text(token).literal())
+        if isinstance(token, tokens.StartOrEmptyTagOpen):
+            depth += 1
+        elif isinstance(token, (tokens.EmptyTagClose, tokens.EndTagClose)):
+            depth -= 1
+            if not depth:
+                if parts is None:
+                    return start, scanner.buf.tell()
+                return ''.join(parts)
+        elif isinstance(token, tokens.BadlyFormedEndOfStream):
+            return None
+    return None
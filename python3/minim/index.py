@@ -0,0 +1,180 @@
+"""Sidecar index of the elements in a file.
+
+``build`` scans a file once, and writes an index file recording the
+byte offset, depth, and tag name of the start tag of every element.
+The offsets can be passed to ``TokenScanner.from_file`` as ``start``,
+to scan from any element without scanning the data before it.
+
+The index file contains a header, followed by three arrays, each with
+one item for each element in document order, and the tag names:
+
+- the offsets, as signed 64-bit integers
+- the depths, as unsigned 32-bit integers, where the root element has
+  depth 0
+- the tag name ids, as unsigned 32-bit integers, which are indexes into
+  the list of tag names
+- the distinct tag names, encoded as UTF-8 and separated by NUL bytes
+
+All integers are little-endian.  Offsets are in the decompressed data
+for a compressed file.
+"""
+import array
+import struct
+import sys
+
+from minim import lex, tokens
+
+_magic = b'minimidx'
+# Magic, number of elements, length of the tag names
+_header = struct.Struct('<8sQQ')
+
+
+def _little_endian(items):
+    """Convert an array between native and little-endian byte order."""
+    if sys.byteorder == 'big':
+        items.byteswap()
+    return items
+
+
+class ElementIndex:
+
+    """The offsets, depths, and tag names of the elements in a file.
+
+    ``offsets``, ``depths`` and ``name_ids`` are parallel arrays, with
+    one item for each element in document order.  ``names`` is the list
+    of distinct tag names, indexed by the items of ``name_ids``.
+    """
+
+    def __init__(self, offsets=None, depths=None, name_ids=None, names=None):
+        self.offsets = array.array('q') if offsets is None else offsets
+        self.depths = array.array('I') if depths is None else depths
+        self.name_ids = array.array('I') if name_ids is None else name_ids
+        self.names = [] if names is None else names
+        self._name_ids = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, offset, depth, name):
+        """Add an element to the end of the index."""
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        self.offsets.append(offset)
+        self.depths.append(depth)
+        self.name_ids.append(name_id)
+
+    def offset(self, i):
+        """Return the offset of the start tag of element ``i``."""
+        return self.offsets[i]
+
+    def depth(self, i):
+        """Return the depth of element ``i``."""
+        return self.depths[i]
+
+    def name(self, i):
+        """Return the tag name of element ``i``."""
+        return self.names[self.name_ids[i]]
+
+    def find(self, name, depth=None):
+        """Generate the numbers of the elements with a tag name.
+
+        If ``depth`` is given, only elements at that depth are found.
+        The index is searched without reading the indexed file.
+        """
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            return
+        depths = self.depths
+        for i, item in enumerate(self.name_ids):
+            if item == name_id and (depth is None or depths[i] == depth):
+                yield i
+
+    def write(self, f):
+        """Write the index to a binary file object."""
+        names = '\0'.join(self.names).encode('utf-8')
+        f.write(_header.pack(_magic, len(self), len(names)))
+        for items in (self.offsets, self.depths, self.name_ids):
+            _little_endian(array.array(items.typecode, items)).tofile(f)
+        f.write(names)
+
+    @classmethod
+    def read(cls, f):
+        """Read an index from a binary file object."""
+        magic, n, names_size = _header.unpack(f.read(_header.size))
+        if magic != _magic:
+            raise ValueError('Not an element index')
+        arrays = []
+        for typecode in ('q', 'I', 'I'):
+            items = array.array(typecode)
+            items.fromfile(f, n)
+            arrays.append(_little_endian(items))
+        names = f.read(names_size).decode('utf-8')
+        return cls(*arrays, names=names.split('\0') if names else [])
+
+
+def index_path(path):
+    """Return the default path of the index file for a file."""
+    return path + '.idx'
+
+
+def scan(scanner):
+    """Return an ElementIndex of the elements generated by a scanner.
+
+    The scanner must be created with the ``positions`` option.
+    """
+    index = ElementIndex()
+    get_text = scanner.get_text
+    depth = 0
+    offset = None
+    parts = []
+    for token in scanner:
+        if isinstance(token, tokens.StartOrEmptyTagOpen):
+            offset = scanner.span()[0]
+        elif isinstance(token, tokens.TagName):
+            if offset is not None:
+                # A name split over buffers is generated as several
+                # tokens
+                text = get_text(token)
+                parts.append(text.literal())
+                if text.is_final:
+                    index.add(offset, depth, ''.join(parts))
+                    offset = None
+                    parts = []
+        elif isinstance(token, tokens.StartTagClose):
+            depth += 1
+        elif isinstance(token, tokens.EndTagOpen):
+            depth = max(depth - 1, 0)
+    return index
+
+
+def build(path, sidecar=None, **kw):
+    """Index the elements in a file, and write the index file.
+
+    :param str sidecar: The path of the index file.  The default is
+        ``index_path(path)``.
+
+    Other keyword arguments, such as ``mmap`` and ``encoding``, are
+    passed to ``TokenScanner.from_file``.
+
+    :return ElementIndex: The index.
+    """
+    index = scan(lex.TokenScanner.from_file(path, positions=True, **kw))
+    if sidecar is None:
+        sidecar = index_path(path)
+    with open(sidecar, 'wb') as f:
+        index.write(f)
+    return index
+
+
+def load(path, sidecar=None):
+    """Load the index written by ``build`` for a file.
+
+    :param str sidecar: The path of the index file.  The default is
+        ``index_path(path)``.
+    """
+    if sidecar is None:
+        sidecar = index_path(path)
+    with open(sidecar, 'rb') as f:
+        return ElementIndex.read(f)
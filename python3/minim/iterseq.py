@@ -1,12 +1,38 @@
+import collections
+import io
+import mmap
+
+
 class IterableAsSequence:
 
-    """Make an iterable of character sequences look like a single sequence."""
+    """Make an iterable of character sequences look like a single sequence.
+
+    The chunks from the iterable are used as the buffer without copying.
+    When more characters are needed than remain in the current chunk,
+    the remaining characters are joined with only as many characters
+    from the following chunks as are needed, to form a small bridging
+    buffer.  Once the bridge has been consumed, the sequence continues
+    in the following chunk, from the first character not in the bridge.
+    """
+
+    # Encoding of the sequence, or None for a sequence of characters
+    encoding = None
+
+    # Number of characters copied to join chunks
+    copied = 0
 
-    def __init__(self, string_iter):
+    def __init__(self, string_iter, offset=0):
         self._iter = iter(string_iter)
         self._buf = None
         self._start = 0
         self._current = 0
+        # The offset of the start of the buffer in the stream
+        self._offset = offset
+        # If the buffer is a bridge, the chunk that follows it, and the
+        # number of characters at the start of the chunk that are
+        # already at the end of the bridge.
+        self._pending = None
+        self._skip = 0
 
     def ensure(self, n=1):
         """Ensure that a minimum number of characters are available.
@@ -26,26 +52,78 @@ class IterableAsSequence:
                 return -1
         current = self._current
         if len(buf) - current < n:
-            if current > 0:
-                # This may be called before we have reached the end of
-                # the current buffer.  So trim the processed data up to
-                # ``current``, and start with the small rump.
-                buf = buf[current:]
-                current = 0
-            # Read more data until at least ``n`` bytes are available.
-            while len(buf) < n:
+            return self._refill(n)
+        return current
+
+    def _bridge_end(self, chunk, end):
+        """Return where a bridge may end in a chunk, at or after ``end``."""
+        return end
+
+    def _refill(self, n):
+        buf = self._buf
+        current = self._current
+        pending = self._pending
+        skip = self._skip
+        offset = self._offset
+        if pending is not None:
+            rump = len(buf) - skip
+            if current >= rump:
+                # The remaining characters are all at the start of the
+                # pending chunk, so continue in the chunk.
+                buf = pending
+                current -= rump
+                offset += rump
+                pending = None
+        if pending is None:
+            while current == len(buf):
                 try:
-                    buf += next(self._iter)
+                    chunk = next(self._iter)
                 except StopIteration:
-                    # If we get StopIteration, we may have some stuff left
-                    # in buf, which we need to process first.
                     self._buf = buf
                     self._current = current
+                    self._offset = offset
                     return -1
-            self._buf = buf
-            self._current = current
-        assert self._buf
-        return current
+                offset += len(buf)
+                buf = chunk
+                current = 0
+            if len(buf) - current >= n:
+                self._buf = buf
+                self._current = current
+                self._offset = offset
+                self._pending = None
+                return current
+        # Join the rump of the buffer with the start of the following
+        # chunks.
+        bridge = buf[current:]
+        offset += current
+        self._offset = offset
+        copied = len(bridge)
+        while len(bridge) < n:
+            if pending is None:
+                try:
+                    pending = next(self._iter)
+                except StopIteration:
+                    # If we get StopIteration, we may have some stuff left
+                    # in the bridge, which we need to process first.
+                    self._buf = bridge
+                    self._current = 0
+                    self._pending = None
+                    self.copied += copied
+                    return -1
+                skip = 0
+            end = self._bridge_end(pending, skip + n - len(bridge))
+            part = pending[skip:end]
+            bridge += part
+            copied += len(part)
+            skip += len(part)
+            if skip == len(pending):
+                pending = None
+        self._buf = bridge
+        self._current = 0
+        self._pending = pending
+        self._skip = skip
+        self.copied += copied
+        return 0
 
     def get(self):
         """Return the character at the current location."""
@@ -70,6 +148,10 @@ class IterableAsSequence:
         self.advance()
         return self.get()
 
+    def tell(self):
+        """Return the offset of the current location in the stream."""
+        return self._offset + self._current
+
     def extract(self):
         buf = self._buf
         if buf is None:
@@ -78,6 +160,67 @@ class IterableAsSequence:
         current = self._current
         return buf[start:current]
 
+    def extent(self):
+        """Return the buffer and the extent of the ``extract`` characters.
+
+        :return tuple: (buffer, start, end), where ``buffer[start:end]``
+            is the value that ``extract`` would return, or an empty
+            value for an empty stream
+        """
+        buf = self._buf
+        if buf is None:
+            buf = '' if self.encoding is None else b''
+        return buf, self._start, self._current
+
+    def block(self):
+        """Return the current buffer and the current location in it.
+
+        This allows a caller to scan the available characters in bulk.
+        The buffer is only valid until the next call that may change
+        the buffer.
+
+        :return tuple: (buffer, current), where ``current`` is -1 if EOF
+            has been reached
+        """
+        current = self.ensure(1)
+        return self._buf, current
+
+    def lookahead(self, pat, limit):
+        """Make the characters matching a pattern available in the buffer.
+
+        The following chunks are joined to the available characters, one
+        chunk at a time, until ``pat`` matches at the current location,
+        ``limit`` characters are available, or EOF is reached.  No chunk
+        is read after the chunk that completes the match.
+
+        :return tuple: (buffer, current), as for ``block``
+        """
+        buf, current = self.block()
+        while current >= 0:
+            n = len(buf) - current
+            if n >= limit or pat.match(buf, current) is not None:
+                break
+            # Take the rest of the following chunk, if it has been read,
+            # or else read the next chunk.
+            pending = self._pending
+            if pending is None:
+                n += 1
+            else:
+                n += len(pending) - self._skip
+            if self.ensure(min(n, limit)) < 0:
+                return self.block()
+            buf, current = self.block()
+        return buf, current
+
+    def select(self, start, end):
+        """Select characters in the buffer returned by ``block``.
+
+        ``extract`` will return the selected characters, and the current
+        location is moved to ``end``.
+        """
+        self._start = start
+        self._current = end
+
     def matching(self, pat, extract=True):
         """
         :return:
@@ -153,18 +296,401 @@ class IterableAsSequence:
             self._current = loc
             return start - loc
 
-    def starts_with(self, s):
+    def starts_with(self, s, extract=True):
         """Test whether the current buffer starts with a string.
 
-        If the buffer does start with the string, the string is consumed
-        and can be retrieved using the ``extract`` method.  If the
-        buffer does not start with the string, nothing is consumed and
-        the result of ``extract`` is undefined.
+        If the buffer does start with the string, and parameter
+        ``extract`` is True (the default), the string is consumed and
+        can be retrieved using the ``extract`` method.  If the buffer
+        does not start with the string, or ``extract`` is False, nothing
+        is consumed and the result of ``extract`` is undefined.
         """
         start = self.ensure(len(s))
         if start < 0 or not self._buf.startswith(s, start):
             return False
         else:
-            self._start = start
-            self._current = start + len(s)
+            if extract:
+                self._start = start
+                self._current = start + len(s)
+            return True
+
+
+def read_blocks(stream, block_size=65536):
+    """Generate blocks read from a binary or text stream.
+
+    Each block is a new object returned by ``read``, since text holders
+    may keep undecoded slices of a block after the next block is read.
+    """
+    read = stream.read
+    block = read(block_size)
+    while block:
+        yield block
+        block = read(block_size)
+
+
+def _peek(stream, n):
+    """Return up to ``n`` bytes from a binary stream without consuming them.
+
+    If the stream can neither peek nor seek, return an empty string.
+    """
+    peek = getattr(stream, 'peek', None)
+    if peek is not None:
+        return peek(n)[:n]
+    if stream.seekable():
+        position = stream.tell()
+        head = stream.read(n)
+        stream.seek(position)
+        return head
+    return b''
+
+
+def compression(head):
+    """Identify compressed data from its initial bytes.
+
+    :param bytes head: At least the first 6 bytes of the data.
+    :return: 'gzip', 'bz2', 'xz', or None if the data is not compressed
+    """
+    if head.startswith(b'\x1f\x8b'):
+        return 'gzip'
+    elif head.startswith(b'BZh'):
+        return 'bz2'
+    elif head.startswith(b'\xfd7zXZ\x00'):
+        return 'xz'
+    return None
+
+
+def decompressed(stream):
+    """Return a binary stream of the decompressed data in a stream.
+
+    Data compressed with gzip, bzip2 or xz is decompressed.  If the data
+    is not compressed, or the start of the stream cannot be read without
+    consuming it, the stream is returned unchanged.
+    """
+    method = compression(_peek(stream, 6))
+    if method == 'gzip':
+        import gzip
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    elif method == 'bz2':
+        import bz2
+        return bz2.BZ2File(stream)
+    elif method == 'xz':
+        import lzma
+        return lzma.LZMAFile(stream)
+    return stream
+
+
+def skip(stream, n):
+    """Skip the next ``n`` characters or bytes of a stream.
+
+    A seekable binary stream is moved using ``seek``.  Otherwise, the
+    data is read and discarded.
+    """
+    if not n:
+        return
+    if not isinstance(stream.read(0), str) and stream.seekable():
+        stream.seek(n, io.SEEK_CUR)
+        return
+    while n:
+        data = stream.read(min(n, 65536))
+        if not data:
+            break
+        n -= len(data)
+
+
+def read_file(path, block_size=65536, start=0):
+    """Generate blocks of bytes read from a file.
+
+    Compressed files are decompressed.  If ``start`` is given, the
+    blocks start at that offset in the decompressed data.  The file is
+    closed when the blocks are exhausted, or the generator is closed.
+    """
+    with open(path, 'rb') as f:
+        stream = decompressed(f)
+        skip(stream, start)
+        yield from read_blocks(stream, block_size)
+
+
+def map_file(path):
+    """Return a read-only memory map of the contents of a file."""
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped
+            return b''
+
+
+def _utf8_boundary(chunk):
+    """Return the length of a chunk without any partial final character."""
+    end = len(chunk)
+    if not end or chunk[-1] < 0x80:
+        return end
+    # Find the lead byte of the final character
+    lead = end - 1
+    while lead > end - 4 and lead > 0 and chunk[lead] & 0xC0 == 0x80:
+        lead -= 1
+    first = chunk[lead]
+    if first >= 0xF0:
+        size = 4
+    elif first >= 0xE0:
+        size = 3
+    elif first >= 0xC0:
+        size = 2
+    else:
+        # Not a valid lead byte - leave it for the decoder to report
+        return end
+    if end - lead < size:
+        return lead
+    return end
+
+
+def _whole_characters(chunks):
+    """Ensure that no UTF-8 character is split between chunks."""
+    partial = b''
+    for chunk in chunks:
+        if partial:
+            chunk = partial + chunk
+        elif not isinstance(chunk, bytes):
+            chunk = bytes(chunk)
+        end = _utf8_boundary(chunk)
+        if end < len(chunk):
+            partial = chunk[end:]
+            chunk = chunk[:end]
+        else:
+            partial = b''
+        if chunk:
+            yield chunk
+    if partial:
+        yield partial
+
+
+# Characters for each byte value
+_byte_chars = tuple(chr(i) for i in range(256))
+
+
+class BytesAsSequence(IterableAsSequence):
+
+    """Make an iterable of byte sequences look like a single sequence.
+
+    The bytes must be encoded with UTF-8, or a single-byte encoding that
+    is compatible with ASCII.  The bytes are scanned without decoding.
+    ``extract`` returns bytes, which can be decoded using ``encoding``.
+
+    For compatibility with character sequences, ``get`` returns the
+    current byte as a 1-character string, and methods that look for
+    markup accept strings of ASCII characters.
+
+    The chunks may be ``bytes``, ``bytearray``, or ``memoryview``
+    objects.  Chunks that are not ``bytes`` are copied, since their
+    memory may be changed after the next chunk is read.
+    """
+
+    def __init__(self, bytes_iter, encoding='utf-8', offset=0):
+        self._utf8 = encoding.lower().replace('_', '-') in ('utf-8', 'utf8')
+        if self._utf8:
+            bytes_iter = _whole_characters(bytes_iter)
+        else:
+            bytes_iter = map(bytes, bytes_iter)
+        super().__init__(bytes_iter, offset)
+        self.encoding = encoding
+
+    def _bridge_end(self, chunk, end):
+        # Do not split a UTF-8 character between a bridge and a chunk
+        if self._utf8:
+            length = len(chunk)
+            while end < length and chunk[end] & 0xC0 == 0x80:
+                end += 1
+        return end
+
+    def get(self):
+        """Return the byte at the current location as a character."""
+        current = self.ensure(1)
+        if current < 0:
+            if self._buf is None:
+                return None
+            return ''
+        return _byte_chars[self._buf[current]]
+
+    def match_to_sentinel(self, sentinel):
+        return super().match_to_sentinel(sentinel.encode('ascii'))
+
+    def starts_with(self, s, extract=True):
+        return super().starts_with(s.encode('ascii'), extract)
+
+
+class NeedData(Exception):
+
+    """More data must be fed to a sequence before it can continue.
+
+    The sequence is unchanged by the operation that raised this.
+    """
+
+
+class _FedChunks:
+
+    """An iterator over the chunks fed to a sequence.
+
+    The iterator only stops once the sequence is closed.  Before then,
+    the sequence checks that enough data has been fed before reading.
+    """
+
+    def __init__(self):
+        self.chunks = collections.deque()
+        self.size = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = self.chunks.popleft()
+        except IndexError:
+            raise StopIteration
+        self.size -= len(chunk)
+        return chunk
+
+    def append(self, chunk):
+        if self.closed:
+            raise ValueError('Data fed after close')
+        if chunk:
+            self.chunks.append(chunk)
+            self.size += len(chunk)
+
+
+class FeedSequence(IterableAsSequence):
+
+    """Make the strings passed to ``feed`` look like a single sequence.
+
+    Until ``close`` is called, any operation that needs more characters
+    than have been fed raises ``NeedData``, without changing the
+    sequence, so the operation can be repeated after the next ``feed``.
+    Once the sequence is closed, the end of the fed data is the end of
+    the stream.
+    """
+
+    def __init__(self):
+        self._fed = _FedChunks()
+        IterableAsSequence.__init__(self, self._fed)
+
+    def feed(self, chunk):
+        """Add a chunk to the end of the sequence."""
+        self._fed.append(chunk)
+
+    def close(self):
+        """Mark the end of the sequence."""
+        self._fed.closed = True
+
+    def ensure(self, n=1):
+        buf = self._buf
+        if buf is not None and len(buf) - self._current >= n:
+            return self._current
+        if not self._fed.closed and self._available() < n:
+            raise NeedData()
+        return super().ensure(n)
+
+    def _available(self):
+        """Return the number of characters that can be read."""
+        available = self._fed.size
+        buf = self._buf
+        if buf is not None:
+            available += len(buf) - self._current
+            pending = self._pending
+            if pending is not None:
+                available += len(pending) - self._skip
+        return available
+
+    def lookahead(self, pat, limit):
+        # Only look ahead in the data already fed, so a lookahead never
+        # waits for more data.
+        if not self._fed.closed:
+            limit = min(limit, self._available())
+        return super().lookahead(pat, limit)
+
+
+class BytesFeedSequence(FeedSequence, BytesAsSequence):
+
+    """Make the bytes passed to ``feed`` look like a single sequence.
+
+    As for ``BytesAsSequence``, the bytes are scanned without decoding,
+    and a UTF-8 character split between chunks is held back until the
+    rest of the character is fed.
+    """
+
+    def __init__(self, encoding='utf-8'):
+        FeedSequence.__init__(self)
+        self.encoding = encoding
+        self._utf8 = encoding.lower().replace('_', '-') in ('utf-8', 'utf8')
+        self._partial = b''
+
+    def feed(self, chunk):
+        chunk = self._partial + chunk
+        if self._utf8:
+            end = _utf8_boundary(chunk)
+            self._partial = chunk[end:]
+            chunk = chunk[:end]
+        self._fed.append(bytes(chunk))
+
+    def close(self):
+        if self._partial:
+            self._fed.append(self._partial)
+            self._partial = b''
+        super().close()
+
+
+class BufferAsSequence(BytesAsSequence):
+
+    """Make a single buffer of bytes look like a sequence.
+
+    The buffer can be any object that supports the buffer protocol and
+    ``find``, such as ``bytes`` or an ``mmap``.  The whole buffer is
+    always available, so ``ensure`` is a bounds check, and the buffer
+    is never copied or concatenated.  The end of the buffer is the end
+    of the stream, so matches are never continued by a subsequent call.
+
+    If ``start`` is given, the sequence starts at that offset in the
+    buffer.
+    """
+
+    def __init__(self, buffer, encoding='utf-8', start=0):
+        # Do not call the superclass constructor, as there is no
+        # iterable of chunks.
+        self._buf = buffer
+        self._start = start
+        self._current = start
+        self._offset = 0
+        self.encoding = encoding
+
+    def ensure(self, n=1):
+        current = self._current
+        if len(self._buf) - current < n:
+            return -1
+        return current
+
+    def matching(self, pat, extract=True):
+        return -abs(super().matching(pat, extract))
+
+    def lookahead(self, pat, limit):
+        # The whole buffer is always available
+        return self.block()
+
+    def match_to_sentinel(self, sentinel):
+        buf = self._buf
+        start = self._current
+        self._start = start
+        loc = buf.find(sentinel.encode('ascii'), start)
+        if loc < 0:
+            loc = len(buf)
+        self._current = loc
+        return start - loc
+
+    def starts_with(self, s, extract=True):
+        s = s.encode('ascii')
+        start = self._current
+        if self._buf.find(s, start, start + len(s)) != start:
+            return False
+        else:
+            if extract:
+                self._start = start
+                self._current = start + len(s)
             return True
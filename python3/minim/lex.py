@@ -11,8 +11,18 @@ Due to the token protocol, which interleave next() calls with optional
 send() calls, this also allows us to separate these two calls (in a
 real generator, they are all in the same function).  The price to pay is
 the need to operate a state machine.
+
+``TokenScanner`` goes further, and runs the whole grammar as a single
+flat state machine in one generator, so generating a token does not
+pass through a chain of delegating iterators.  The state is an explicit
+integer, and the markup constructs are selected by a dispatch table on
+the character after the ``<``.
 """
+import array
+import collections
+import inspect
 import re
+import sys
 
 import jute
 from minim import iterseq, tokens
@@ -25,6 +35,8 @@ _stop_iteration_not_found = StopIteration(False)
 
 _StartOrEmptyTagOpenTextToken = tokens.StartOrEmptyTagOpen(
     tokens.TextHolder('<'))
+_StartTagOpenTextToken = tokens.StartTagOpen(tokens.TextHolder('<'))
+_EmptyTagOpenTextToken = tokens.EmptyTagOpen(tokens.TextHolder('<'))
 _EndTagOpenTextToken = tokens.EndTagOpen(tokens.TextHolder('</'))
 _AttributeEqualsTextToken = tokens.AttributeEquals(tokens.TextHolder('='))
 _dquote = tokens.TextHolder('"')
@@ -48,6 +60,14 @@ _CDataCloseTextToken = tokens.CDataClose(tokens.TextHolder(']]>'))
 _BadlyFormedEndOfStreamEmptyTextToken = tokens.BadlyFormedEndOfStream(
     tokens.TextHolder(''))
 
+_BadlyFormedEndOfStreamSlashTextToken = tokens.BadlyFormedEndOfStream(
+    tokens.TextHolder('/'))
+# Content following a < that is not well-formed markup
+_SlashTextToken = tokens.PCData(tokens.TextHolder('/'))
+_QuestionTextToken = tokens.PCData(tokens.TextHolder('?'))
+_BangTextToken = tokens.PCData(tokens.TextHolder('!'))
+_BangDashTextToken = tokens.PCData(tokens.TextHolder('!-'))
+
 _MarkupWhitespaceToken = tokens.MarkupWhitespace()
 _TagNameToken = tokens.TagName()
 _CDataToken = tokens.CData()
@@ -57,6 +77,41 @@ _ProcessingInstructionTargetToken = tokens.ProcessingInstructionTarget()
 _ProcessingInstructionDataToken = tokens.ProcessingInstructionData()
 _AttributeNameToken = tokens.AttributeName()
 _AttributeValueToken = tokens.AttributeValue()
+_CommentDataToken = tokens.CommentData()
+
+# Tokens that may be held in ``run_token``, in the order used to record
+# them in a checkpoint
+_run_tokens = (
+    _MarkupWhitespaceToken, _TagNameToken, _CDataToken, _PCDataToken,
+    _WhitespaceContentToken, _ProcessingInstructionTargetToken,
+    _ProcessingInstructionDataToken, _AttributeNameToken,
+    _AttributeValueToken, _CommentDataToken, _SlashTextToken,
+    _QuestionTextToken, _BangTextToken, _BangDashTextToken,
+    )
+_run_token_index = {token: i for i, token in enumerate(_run_tokens)}
+
+
+# States of the TokenScanner state machine.  The run states are first,
+# since they are the most frequent.
+#
+# Each state performs at most one operation that may need more data
+# than the buffer holds, before it changes the buffer, so that the state
+# can be repeated if a fed sequence raises ``NeedData``.  Each state
+# generates at most one token, so that the state, the run variables and
+# the buffer offset between two tokens are enough to resume scanning.
+(
+    RUN_PATTERN, RUN_SENTINEL, MARKUP, MARKUP_SELECT, CONTENT,
+    CONTENT_TEXT, CONTENT_END, START_TAG, TAG_NAME_END, TAG_SPACE_END,
+    TAG_ATTRIBUTE, ATTRIBUTE_NAME_END, ATTRIBUTE_EQUALS, ATTRIBUTE_VALUE,
+    ATTRIBUTE_VALUE_END, TAG_CLOSE, TAG_CLOSE_SLASH, END_TAG,
+    END_TAG_NAME_END, END_TAG_CLOSE, COMMENT_END, BANG, BANG_DASH,
+    BANG_BRACKET, CDATA_END, PI, PI_TARGET_END, PI_SPACE_END, PI_END,
+    LITERAL, PROLOGUE, DONE,
+) = range(32)
+
+# The state after the character following a ``<``.  Other characters
+# start a tag if they can start a name.
+_markup_states = {'/': END_TAG, '?': PI, '!': BANG}
 
 
 class SentinelParser:
@@ -113,9 +168,11 @@ class SentinelParser:
 
     def send(self, text):
         assert isinstance(text, tokens.TextHolder), text
-        text.set(
-            encoded=self.buf.extract(), is_initial=self.is_initial,
-            is_final=self.is_final)
+        buf = self.buf
+        buffer, start, end = buf.extent()
+        text.set_span(
+            buffer, start, end, buf.encoding,
+            is_initial=self.is_initial, is_final=self.is_final)
         return text
 
 
@@ -187,18 +244,21 @@ class PatternParser:
 
     def send(self, text):
         assert isinstance(text, tokens.TextHolder), text
-        text.set(
-            encoded=self.buf.extract(), is_initial=self.is_initial,
-            is_final=self.is_final)
+        buf = self.buf
+        buffer, start, end = buf.extent()
+        text.set_span(
+            buffer, start, end, buf.encoding,
+            is_initial=self.is_initial, is_final=self.is_final)
         return text
 
 
 class WhitespaceParser(PatternParser):
 
     pattern = re.compile(r'[ \t\r\n]+')
+    binary_pattern = re.compile(br'[ \t\r\n]+')
 
-    def __init__(self):
-        super().__init__(self.pattern)
+    def __init__(self, binary=False):
+        super().__init__(self.binary_pattern if binary else self.pattern)
 
 
 class NmTokenParser(PatternParser):
@@ -212,18 +272,261 @@ class NmTokenParser(PatternParser):
     NmTokens.  A helper function is provided to check whether the
     initial character is valid for a name. This should always be called
     on the initial string first when parsing a name.
+
+    If ``binary`` is True, the parser matches bytes, and every non-ASCII
+    byte is treated as a name character.  The initial character is
+    still passed as a string, as returned by ``BytesAsSequence.get``.
     """
     name_initial_pattern = re.compile(r':|[^\W\d]')
     nm_token_pattern = re.compile(r'[\w:.-]+')
+    binary_name_initial_pattern = re.compile(r'[:A-Za-z_\x80-\xff]')
+    binary_nm_token_pattern = re.compile(br'[\w:.\x80-\xff-]+')
 
-    def __init__(self):
-        super().__init__(self.nm_token_pattern)
+    def __init__(self, binary=False):
+        if binary:
+            super().__init__(self.binary_nm_token_pattern)
+            self.name_initial_pattern = self.binary_name_initial_pattern
+        else:
+            super().__init__(self.nm_token_pattern)
 
     def matches_initial(self, s):
         """Return whether the start of the string looks like a name."""
         return bool(self.name_initial_pattern.match(s))
 
 
+class ExtentResponder:
+
+    """A non-allocating responder for text selected in the buffer.
+
+    The scanner selects the extent of each token in the buffer before
+    yielding the token, so the text is the buffer extract.  The scanner
+    sets ``is_initial`` and ``is_final`` for text that is split over
+    several tokens.
+    """
+
+    is_initial = True
+    is_final = True
+
+    def __call__(self, buf):
+        self.buf = buf
+        return self
+
+    def send(self, text):
+        assert isinstance(text, tokens.TextHolder), text
+        buf = self.buf
+        buffer, start, end = buf.extent()
+        text.set_span(
+            buffer, start, end, buf.encoding,
+            is_initial=self.is_initial, is_final=self.is_final)
+        return text
+
+
+# Patterns for the bulk scanner.  A match of ``_bulk_pattern`` is a
+# complete text run or a complete markup construct.  Each name is
+# followed by a delimiter inside the match, so the tokens are the same
+# as those found by the character-based parsers.
+_name = r'(?::|[^\W\d])[\w:.-]*'
+# In bytes, any non-ASCII byte is treated as a name character
+_binary_name = r'(?::|[^\W\d]|[\x80-\xff])[\w:.\x80-\xff-]*'
+_space = r'[ \t\r\n]'
+# A complete well-formed start tag, after the ``<``
+_start_tag_source = (
+    r'(?P<start_name>{n})'
+    r'(?:{s}+{n}(?:{s}*={s}*(?:"[^"]*"|\'[^\']*\'))?)*'
+    r'{s}*(?P<start_close>/?>)'
+    )
+_start_tag_pattern = re.compile(
+    _start_tag_source.format(n=_name, s=_space))
+_binary_start_tag_pattern = re.compile(
+    _start_tag_source.format(n=_binary_name, s=_space).encode('ascii'))
+_bulk_source = (
+    r'(?P<text>(?=[^<])(?P<text_space>{s}*)[^<]*)'
+    r'|(?P<start_tag><' + _start_tag_source + r')'
+    r'|(?P<end_tag></(?P<end_name>{n}){s}*>)'
+    r'|(?P<comment><!--.*?-->)'
+    r'|(?P<cdata><!\[CDATA\[.*?\]\]>)'
+    r'|(?P<pi><\?(?P<pi_target>{n})(?:(?P<pi_space>{s}+).*?)?\?>)'
+    )
+_bulk_pattern = re.compile(
+    _bulk_source.format(n=_name, s=_space), re.DOTALL)
+_binary_bulk_pattern = re.compile(
+    _bulk_source.format(n=_binary_name, s=_space).encode('ascii'), re.DOTALL)
+# Components of the attribute section of a start tag
+_tag_part_source = (
+    r'(?P<space>{s}+)|(?P<name>{n})|(?P<equals>=)'
+    r'|(?P<double>"[^"]*")|(?P<single>\'[^\']*\')'
+    )
+_tag_part_pattern = re.compile(
+    _tag_part_source.format(n=_name, s=_space))
+_binary_tag_part_pattern = re.compile(
+    _tag_part_source.format(n=_binary_name, s=_space).encode('ascii'))
+
+# Patterns for ``iter_tags``.  An attribute without a value has no
+# ``double`` or ``single`` group.
+_attribute_source = (
+    r'(?P<name>{n})'
+    r'(?:{s}*={s}*(?:"(?P<double>[^"]*)"|\'(?P<single>[^\']*)\'))?'
+    )
+_attribute_pattern = re.compile(
+    _attribute_source.format(n=_name, s=_space))
+_binary_attribute_pattern = re.compile(
+    _attribute_source.format(n=_binary_name, s=_space).encode('ascii'))
+_end_tag_source = r'</(?P<name>{n}){s}*>'
+_end_tag_pattern = re.compile(_end_tag_source.format(n=_name, s=_space))
+_binary_end_tag_pattern = re.compile(
+    _end_tag_source.format(n=_binary_name, s=_space).encode('ascii'))
+
+
+# Patterns and token classes for scanning with an interest.  A markup
+# construct is identified from its initial characters in the current
+# buffer.  If it cannot be identified, it is parsed in full.
+_interest_source = (
+    r'<(?:(?P<start_tag>{i})|(?P<end_tag>/{i})|(?P<comment>!--)'
+    r'|(?P<cdata>!\[CDATA\[)|(?P<pi>\?{i}))'
+    )
+# The number of characters at the start of each construct identified by
+# ``_interest_source`` that is skipped, and the sentinel that ends the
+# construct
+_interest_sentinels = {
+    'end_tag': (2, '>'),
+    'comment': (4, '-->'),
+    'cdata': (9, ']]>'),
+    'pi': (2, '?>'),
+    }
+_initial = r'(?::|[^\W\d])'
+_binary_initial = r'(?::|[^\W\d]|[\x80-\xff])'
+_interest_pattern = re.compile(_interest_source.format(i=_initial))
+_binary_interest_pattern = re.compile(
+    _interest_source.format(i=_binary_initial).encode('ascii'))
+# Characters in a tag that do not start a quoted value or end the tag
+_tag_skip_pattern = re.compile(r'[^"\'/>]+')
+_binary_tag_skip_pattern = re.compile(br'[^"\'/>]+')
+# The remainder of a start tag after the name
+_tag_rest_source = (
+    r'[^"\'/>]*(?:(?:"[^"]*"|\'[^\']*\'|/(?!>))[^"\'/>]*)*(?P<close>/?>)')
+_tag_rest_pattern = re.compile(_tag_rest_source)
+_binary_tag_rest_pattern = re.compile(_tag_rest_source.encode('ascii'))
+_end_tag_rest_pattern = re.compile(_space + '*>')
+_binary_end_tag_rest_pattern = re.compile((_space + '*>').encode('ascii'))
+
+# Token classes whose content decodes references
+_reference_classes = frozenset((tokens.PCData, tokens.AttributeValue))
+# The longest reference that is held back when split between buffers
+_max_reference = 32
+# Token classes whose split text is joined by the ``coalesce`` option
+_coalesce_classes = frozenset(token.__class__ for token in _run_tokens)
+# Characters that end content text, as returned by ``get``
+_text_ends = frozenset(('<', '', None))
+# Token classes whose text is taken from the name cache
+_name_classes = (
+    tokens.TagName, tokens.AttributeName, tokens.ProcessingInstructionTarget)
+_content_classes = (tokens.PCData, tokens.WhitespaceContent)
+_prologue_classes = (tokens.PCData, tokens.MarkupWhitespace)
+# The outline of a start tag is the tokens that can be generated
+# without tokenising the attributes.
+_start_tag_outline_classes = (
+    tokens.StartOrEmptyTagOpen, tokens.StartTagOpen, tokens.EmptyTagOpen,
+    tokens.TagName, tokens.StartTagClose, tokens.EmptyTagClose)
+_start_tag_classes = _start_tag_outline_classes + (
+    tokens.MarkupWhitespace, tokens.AttributeName, tokens.AttributeEquals,
+    tokens.AttributeValueOpen, tokens.AttributeValue,
+    tokens.AttributeValueClose)
+_end_tag_classes = (
+    tokens.EndTagOpen, tokens.TagName, tokens.MarkupWhitespace,
+    tokens.EndTagClose)
+_comment_classes = (
+    tokens.CommentOpen, tokens.CommentData, tokens.CommentClose)
+_cdata_classes = (tokens.CDataOpen, tokens.CData, tokens.CDataClose)
+_pi_classes = (
+    tokens.ProcessingInstructionOpen, tokens.ProcessingInstructionTarget,
+    tokens.MarkupWhitespace, tokens.ProcessingInstructionData,
+    tokens.ProcessingInstructionClose)
+
+
+def _skip_past(buf, sentinel):
+    """Skip characters up to and including a sentinel.
+
+    :return bool: False if the end of stream was reached first
+    """
+    while buf.match_to_sentinel(sentinel) > 0:
+        pass
+    return buf.starts_with(sentinel)
+
+
+def _skip_tag(buf, pattern):
+    """Skip the remainder of a start tag, including any attributes.
+
+    A ``>`` inside a quoted attribute value does not end the tag.
+
+    :return: '>' or '/>' for the end of the tag, '/' if the end of
+        stream was reached after a ``/``, or an empty string if the end
+        of stream was reached first
+    """
+    while True:
+        while buf.matching(pattern) > 0:
+            pass
+        ch = buf.get()
+        if ch == '>':
+            buf.advance()
+            return ch
+        elif ch == '/':
+            ch = buf.next()
+            if ch == '>':
+                buf.advance()
+                return '/>'
+            elif not ch:
+                return '/'
+        elif ch == '"' or ch == "'":
+            buf.advance()
+            if not _skip_past(buf, ch):
+                return ''
+        else:
+            return ''
+
+
+class TokenBatch:
+
+    """A batch of tokens stored in compact parallel arrays.
+
+    ``kinds`` contains the ``kind`` of each token class, which is an
+    index into ``tokens.kinds``, so a table built by
+    ``tokens.dispatch_table`` can be indexed by the kinds.  ``starts``
+    and ``ends`` contain the offsets of the text of each token in
+    ``buffer``.  Tokens with fixed text, such as ``<``, are not read
+    from the buffer.  They have offsets of
+    -1, and their text holder is stored in ``literals``, keyed by the
+    index of the token in the batch.
+
+    Text split over buffers, as shown by the ``is_initial`` and
+    ``is_final`` attributes of a TextHolder, appears as a token at the
+    end of one batch, and a token of the same kind at the start of the
+    next batch.
+
+    For a bytes buffer, ``encoding`` is the encoding of the buffer.
+    """
+
+    def __init__(self, buffer=None, encoding=None):
+        self.buffer = buffer
+        self.encoding = encoding
+        self.kinds = array.array('B')
+        self.starts = array.array('q')
+        self.ends = array.array('q')
+        self.literals = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def text(self, i):
+        """Return the literal text of the token at index ``i``."""
+        start = self.starts[i]
+        if start < 0:
+            return self.literals[i].literal()
+        text = self.buffer[start:self.ends[i]]
+        if self.encoding is not None:
+            text = text.decode(self.encoding)
+        return text
+
+
 class TokenSequence(jute.Interface):
 
     """An iterable that yields token types, and provides a method to
@@ -348,15 +651,319 @@ class BufferBasedTokenScanner(AbstractTokenScanner):
             return self.current_parser.send(text_holder)
 
 
+class NameCache:
+
+    """A bounded cache of interned strings, keyed by their source text.
+
+    The key is the text as sliced from the buffer, which is bytes for
+    an encoded buffer, so a name that is already in the cache is not
+    decoded again.  The slice is still made for each lookup, so the
+    cache saves the decode and a new string, not the copy from the
+    buffer.  Once the cache holds ``size`` entries, new text is still
+    decoded and interned, but not added.
+    """
+
+    def __init__(self, size, encoding=None):
+        self.size = size
+        self.encoding = encoding
+        self.entries = {}
+
+    def get(self, key):
+        """Return the shared string for some source text."""
+        entries = self.entries
+        value = entries.get(key)
+        if value is None:
+            value = key if self.encoding is None else key.decode(
+                self.encoding)
+            value = sys.intern(value)
+            if len(entries) < self.size:
+                entries[key] = value
+        return value
+
+
+class ValueCache(NameCache):
+
+    """A cache of strings that keeps the ``size`` most recently used.
+
+    This suits attribute values with few distinct values, where the
+    values in use may change through the document.  The strings are
+    not interned.
+    """
+
+    def __init__(self, size, encoding=None):
+        super().__init__(size, encoding)
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        entries = self.entries
+        value = entries.get(key)
+        if value is None:
+            value = key if self.encoding is None else key.decode(
+                self.encoding)
+            entries[key] = value
+            if len(entries) > self.size:
+                entries.popitem(last=False)
+        else:
+            entries.move_to_end(key)
+        return value
+
+
+class LineCounter:
+
+    """Count the lines in the text of the dynamic tokens.
+
+    Static tokens contain no newlines, so the lines are counted in the
+    extents of the dynamic tokens.  The extents in the same buffer are
+    counted together, from the start of the first extent to the end of
+    the last.
+    """
+
+    def __init__(self, offset, newline):
+        self.newline = newline
+        # Line number, and offset of the start of the line, at the end
+        # of the counted text
+        self.line = 1
+        self.line_start = offset
+        # The buffer of the latest extent, the offset in the stream of
+        # its start, and the range of the extents not yet counted
+        self.buffer = None
+        self.base = 0
+        self.start = self.end = 0
+
+    def add_buffer(self, buffer, start, base):
+        """Count the previous buffer, and start counting a new buffer."""
+        self.count(self.end)
+        self.buffer = buffer
+        self.base = base
+        self.start = self.end = start
+
+    def count(self, end):
+        """Count the lines in the current buffer up to ``end``."""
+        start = self.start
+        if end <= start:
+            return
+        buffer = self.buffer
+        newline = self.newline
+        try:
+            n = buffer.count(newline, start, end)
+        except AttributeError:
+            # A memory map has no ``count``
+            n = buffer[start:end].count(newline)
+        if n:
+            self.line += n
+            self.line_start = self.base + buffer.rfind(
+                newline, start, end) + 1
+        self.start = end
+
+    def location(self, offset):
+        """Return the line and column of an offset in the stream.
+
+        The offset must not be before the start of the current extent.
+        """
+        if self.buffer is not None:
+            self.count(min(offset - self.base, self.end))
+        return self.line, offset - self.line_start
+
+
 class TokenScanner(BufferBasedTokenScanner):
 
-    def __init__(self, buf):
+    """Generate tokens from a character sequence.
+
+    The default engine parses the sequence character by character,
+    except that a start tag that is complete in the current buffer is
+    matched with a single regular expression.  Its open token is then
+    refined to a ``StartTagOpen`` or ``EmptyTagOpen``.  A start tag that
+    crosses the end of the buffer, or is not well-formed, generates an
+    ambiguous ``StartOrEmptyTagOpen``.
+
+    If ``bulk`` is True, an engine that matches whole constructs in the
+    current buffer with a single regular expression is used instead.
+    It falls back to the character-based parsers for constructs that
+    cross a buffer boundary or are not well-formed, and generates the
+    same token stream.
+
+    If the sequence has an ``encoding``, such as a ``BytesAsSequence``,
+    the bytes are scanned without decoding them.  The text holders
+    returned by ``get_text`` are decoded when their text is used.
+
+    If ``interest`` is an iterable of token classes, only tokens that
+    are instances of those classes are generated.  Content and markup
+    that cannot generate any tokens of interest is skipped using
+    ``find`` without being tokenised.  Start tags are only tokenised as
+    far as needed, so if no attribute tokens are of interest, the
+    attributes are skipped.
+
+    A scanner created using ``from_feed`` is pushed data using ``feed``
+    and ``close``, instead of pulling it from an iterator.  When the
+    fed data runs out, the sequence raises ``iterseq.NeedData`` and the
+    generator yields None, to be resumed in the same state after the
+    next ``feed``.
+
+    If ``positions`` is True, the position of each token is recorded,
+    and can be obtained using ``span`` and ``location``.  Otherwise,
+    the tokens are generated directly by the engine, at no extra cost.
+
+    The ``content`` of the text returned by ``get_text`` for PCData and
+    attribute values decodes character and entity references.  A
+    reference split between buffers is decoded in the content of the
+    holder for the last part, as long as ``get_text`` is called for
+    every part of the text.  ``get_text`` can be called more than once
+    for a part.
+
+    If ``coalesce`` is a positive number, text that would be split over
+    several tokens, such as a text node that crosses the end of a
+    buffer, is joined into one token, with its own text holder, up to
+    ``coalesce`` characters.  Whitespace content followed by other text
+    is joined with it into one ``PCData`` token.  Longer text is still
+    generated in several tokens, using the ``is_initial`` and
+    ``is_final`` flags.  Text that is not split is generated directly.
+
+    A start tag that crosses the end of the buffer generates an
+    ambiguous ``StartOrEmptyTagOpen``, unless ``tag_lookahead`` is a
+    positive number.  Then the following chunks are joined to the tag,
+    one at a time, until the tag ends, or ``tag_lookahead`` characters
+    from the start of the tag are joined, and the tag is refined if it
+    ends in them.  A ``>`` in a quoted attribute value does not end the
+    tag.  A fed scanner only looks ahead in the data already
+    fed, so it never waits for more data to refine a tag.
+
+    If ``name_cache`` is a positive number, the text of tag names,
+    attribute names and processing instruction targets returned by
+    ``get_text`` and ``iter_tags`` is taken from a ``NameCache`` of
+    that size, so each distinct name is one shared string.  If
+    ``value_cache`` is a positive number, attribute values are taken
+    from a ``ValueCache`` of that size.  Text split between buffers is
+    not cached.  The text is still sliced from the buffer to look it up,
+    so a cache saves decoding it and allocating a new string for it.
+    """
+
+    def __init__(
+            self, buf, bulk=False, interest=None, positions=False,
+            name_cache=0, value_cache=0, coalesce=0, tag_lookahead=0):
         super().__init__()
+        if positions and interest is not None:
+            raise ValueError('Cannot record positions with an interest')
+        if coalesce and positions:
+            raise ValueError('Cannot record positions of joined text')
+        if coalesce and isinstance(buf, iterseq.FeedSequence):
+            raise ValueError('Cannot join text in a fed sequence')
+        self.coalesce = coalesce
+        self.tag_lookahead = tag_lookahead
         self.buf = buf
+        self.bulk = bulk
+        self.interest = None if interest is None else tuple(interest)
+        self.positions = positions
+        self.scan_generator = None
+        self.lines = None
+        self._wanted = {}
         self.generator = None
-        self.name_parser = NmTokenParser()
-        self.space_parser = WhitespaceParser()
+        self.binary = binary = getattr(buf, 'encoding', None) is not None
+        self.name_parser = NmTokenParser(binary)
+        self.space_parser = WhitespaceParser(binary)
         self.sentinel_parser = SentinelParser()
+        self.extent_responder = ExtentResponder()
+        self.state_responder = ExtentResponder()
+        self.pending_token = None
+        self.resume_point = None
+        encoding = getattr(buf, 'encoding', None)
+        self.name_cache = self.value_cache = None
+        self.text_caches = {}
+        if name_cache:
+            self.name_cache = NameCache(name_cache, encoding)
+            for cls in _name_classes:
+                self.text_caches[cls] = self.name_cache
+        if value_cache:
+            self.value_cache = ValueCache(value_cache, encoding)
+            self.text_caches[tokens.AttributeValue] = self.value_cache
+        if self.text_caches:
+            # Only look for a cache if there is one
+            self.token_to_text = self.cached_token_to_text
+        # The offset of the end of the latest part of split text, and the
+        # start of a reference held back from it
+        self.reference_prefix = 0, ''
+        # The offsets, prefix and hold of the latest part marked
+        self.reference_part = None
+        if self.binary:
+            self.reference_chars = b'&', b';'
+        else:
+            self.reference_chars = '&', ';'
+
+    def get_text(self, token, text_holder=None):
+        """Return the current text in the input stream.
+
+        The content of PCData and attribute value text decodes
+        references.
+        """
+        if token.text is not None:
+            return token.text
+        text = super().get_text(token, text_holder)
+        if token.__class__ in _reference_classes:
+            self.mark_references(text)
+        return text
+
+    def mark_references(self, text):
+        """Set a text holder to decode references in its content.
+
+        If the text is split, and the current part may end in the middle
+        of a reference, the start of the reference is found in the
+        buffer without slicing the rest of the text, and held back for
+        the next part.
+
+        The held text is recorded with the offset of the end of the
+        part, and only added to a part that starts at that offset, so
+        getting the text of a part again, or not getting the text of a
+        part, does not change the content of the other parts.
+        """
+        buf = self.buf
+        buffer, start, end = buf.extent()
+        end_offset = buf.tell()
+        start_offset = end_offset - (end - start)
+        part = self.reference_part
+        if part is not None and part[:2] == (start_offset, end_offset):
+            # The text of this part has already been marked
+            text.set_references(part[2], part[3])
+            return
+        prefix = ''
+        if not text.is_initial:
+            held_offset, held = self.reference_prefix
+            if held_offset == start_offset:
+                prefix = held
+        held = ''
+        hold = 0
+        if not text.is_final:
+            amp, semicolon = self.reference_chars
+            i = buffer.rfind(amp, max(start, end - _max_reference), end)
+            if i >= 0:
+                if buffer.find(semicolon, i, end) < 0:
+                    held = buffer[i:end]
+            elif (prefix and buffer.find(semicolon, start, end) < 0 and
+                    len(prefix) + end - start <= _max_reference):
+                # The whole part continues the reference
+                held = buffer[start:end]
+            if held:
+                if self.binary:
+                    held = held.decode(buf.encoding)
+                if i < 0:
+                    held = prefix + held
+                hold = len(held)
+        self.reference_prefix = end_offset, held
+        self.reference_part = start_offset, end_offset, prefix, hold
+        text.set_references(prefix, hold)
+
+    def cached_token_to_text(self, token, text_holder):
+        """Obtain the text for the current token, using the caches.
+
+        The text is sliced from the buffer as the key, so only its
+        decoding and the string are saved for a name in the cache.
+        """
+        cache = self.text_caches.get(token.__class__)
+        if cache is not None:
+            parser = self.current_parser
+            if parser.is_initial and parser.is_final:
+                buffer, start, end = self.buf.extent()
+                text_holder.set(cache.get(buffer[start:end]))
+                return text_holder
+        return super().token_to_text(token, text_holder)
 
     def parse_name(self, buf, token):
         self.current_parser = self.name_parser
@@ -371,169 +978,1389 @@ class TokenScanner(BufferBasedTokenScanner):
         return self.sentinel_parser(buf, token, sentinel)
 
     @classmethod
-    def from_strings(cls, string_iter):
-        """Generates tokens from the supplied iterator."""
-        return cls(iterseq.IterableAsSequence(string_iter))
+    def from_strings(cls, string_iter, **kw):
+        """Generates tokens from the supplied iterator.
 
-    def create_generator(self):
-        return self.parse(self.buf)
+        Keyword arguments are passed to the constructor.
+        """
+        return cls(iterseq.IterableAsSequence(string_iter), **kw)
 
-    def parse(self, buf):
-        # Whitespace before initial non-ws is not considered to be content
-        yield from self.parse_space(buf, _MarkupWhitespaceToken)
-        yield from self.parse_until(buf, _PCDataToken, '<')
-        while buf.get() == '<':
-            ch = buf.next()
-            if ch == '/':
-                ch = buf.next()
-                if self.name_parser.matches_initial(ch):
-                    yield _EndTagOpenTextToken
-                    yield from self.parse_name(buf, _TagNameToken)
-                    yield from self.parse_space(buf, _MarkupWhitespaceToken)
-                    ch = buf.get()
-                    if not ch:
-                        yield _BadlyFormedEndOfStreamEmptyTextToken
-                        return
-                    elif ch != '>':
-                        raise RuntimeError('extra data in close tag')
-                    yield _EndTagCloseTextToken
-                    buf.advance()
-                else:
-                    yield tokens.BadlyFormedLessThanToken
-                    yield tokens.PCData(tokens.TextHolder('/'))
-            elif ch == '?':
-                ch = buf.next()
-                if self.name_parser.matches_initial(ch):
-                    yield _ProcessingInstructionOpenTextToken
-                    yield from self.parse_name(
-                        buf, _ProcessingInstructionTargetToken)
-                    ws_found = yield from self.parse_space(
-                        buf, _MarkupWhitespaceToken)
-                    if ws_found:
-                        found = yield from self.parse_until(
-                            buf, _ProcessingInstructionDataToken, '?>')
-                        if buf.starts_with('?>'):
-                            # `starts_with` is redundant, since `found`
-                            # indicates whether the sentinel was found.
-                            # `starts_with` consumes the characters
-                            assert found, found
-                        else:
-                            # must be EOS
-                            assert not found, found
-                            yield _BadlyFormedEndOfStreamEmptyTextToken
-                            return
+    @classmethod
+    def from_bytes(cls, source, encoding='utf-8', **kw):
+        """Generates tokens from encoded bytes.
+
+        :param source: An iterable of bytes-like objects, or a binary
+            file object, which is read in blocks.
+        :param str encoding: UTF-8, or a single-byte encoding that is
+            compatible with ASCII.
+
+        Other keyword arguments are passed to the constructor.
+        """
+        if hasattr(source, 'read'):
+            source = iterseq.read_blocks(source)
+        return cls(iterseq.BytesAsSequence(source, encoding), **kw)
+
+    @classmethod
+    def from_file(
+            cls, path, mmap=False, block_size=65536, encoding='utf-8',
+            start=0, **kw):
+        """Generates tokens from the bytes of a file.
+
+        If ``mmap`` is True, the file is memory-mapped and scanned as a
+        single buffer, so data is not copied into the scanner's buffer.
+        Otherwise, the file is read in blocks of ``block_size`` bytes.
+        Files compressed with gzip, bzip2, or xz are decompressed, and
+        are always read in blocks.
+
+        If ``start`` is given, scanning starts at that offset in the
+        (decompressed) data.  It should be the offset of a ``<``, such
+        as an element offset from ``minim.index``.  Offsets reported by
+        the scanner are still offsets in the whole file.
+
+        Other keyword arguments are passed to the constructor.
+        """
+        if mmap:
+            buffer = iterseq.map_file(path)
+            if iterseq.compression(buffer[:6]) is None:
+                return cls(
+                    iterseq.BufferAsSequence(buffer, encoding, start), **kw)
+        blocks = iterseq.read_file(path, block_size, start)
+        return cls(iterseq.BytesAsSequence(blocks, encoding, start), **kw)
+
+    @classmethod
+    def from_stream(cls, stream, block_size=65536, encoding='utf-8', **kw):
+        """Generates tokens from a file object.
+
+        The stream is read in blocks of ``block_size`` characters for a
+        text stream, or bytes for a binary stream.  A binary stream
+        compressed with gzip, bzip2, or xz is decompressed, if the start
+        of the stream can be read without consuming it.
+
+        Other keyword arguments are passed to the constructor.
+        """
+        if isinstance(stream.read(0), str):
+            buf = iterseq.IterableAsSequence(
+                iterseq.read_blocks(stream, block_size))
+        else:
+            blocks = iterseq.read_blocks(
+                iterseq.decompressed(stream), block_size)
+            buf = iterseq.BytesAsSequence(blocks, encoding)
+        return cls(buf, **kw)
+
+    @classmethod
+    def from_feed(cls, encoding=None, **kw):
+        """Generates tokens from data passed to ``feed``.
+
+        If ``encoding`` is None, ``feed`` accepts strings.  Otherwise,
+        ``feed`` accepts bytes in the encoding.  Only the default engine
+        can be fed, so ``bulk`` and ``interest`` cannot be used.
+
+        Other keyword arguments are passed to the constructor.
+        """
+        if kw.get('bulk') or kw.get('interest') is not None:
+            raise ValueError('Only the default engine supports feed')
+        if encoding is None:
+            buf = iterseq.FeedSequence()
+        else:
+            buf = iterseq.BytesFeedSequence(encoding)
+        return cls(buf, **kw)
+
+    def feed(self, data):
+        """Add data to a scanner created using ``from_feed``.
+
+        The scanner keeps its state between calls, so a construct may
+        be split anywhere between two chunks of data.  Text that crosses
+        a split may be returned as several tokens, using the
+        ``is_initial`` and ``is_final`` flags of the text holders.
+
+        :return: A list of the tokens completed by the data.  Each token
+            holds its text, so ``get_text`` is not needed.
+        """
+        self.buf.feed(data)
+        return self.fed_tokens()
+
+    def close(self):
+        """Mark the end of the data passed to ``feed``.
+
+        :return: A list of the remaining tokens.
+        """
+        self.buf.close()
+        return self.fed_tokens()
+
+    def fed_tokens(self):
+        """Return the tokens that can be scanned from the fed data."""
+        generator = self.generator
+        if generator is None:
+            generator = iter(self)
+        get_text = self.get_text
+        result = []
+        for token in generator:
+            if token is None:
+                # The scanner needs more data
+                break
+            result.append(token.clone(get_text(token)))
+        return result
+
+    def read_batch(self, n):
+        """Read up to ``n`` tokens into a TokenBatch.
+
+        A batch ends early if the buffer changes, so all offsets in a
+        batch refer to the same buffer.  The tokens are taken from the
+        same generator as ``next``, but iterating over the scanner
+        starts a new generator, so do not mix ``read_batch`` with a
+        ``for`` loop over the scanner.
+
+        :return: A TokenBatch, which is empty at the end of the tokens.
+        """
+        generator = self.generator
+        if generator is None:
+            generator = iter(self)
+        extent = self.buf.extent
+        batch = TokenBatch(encoding=self.buf.encoding)
+        kinds = batch.kinds
+        starts = batch.starts
+        ends = batch.ends
+        token = self.pending_token
+        self.pending_token = None
+        if token is None:
+            token = next(generator, None)
+        while token is not None:
+            if token.text is None:
+                buffer, start, end = extent()
+                if buffer is not batch.buffer:
+                    if batch.buffer is not None:
+                        # Keep the token for the next batch.  The extent
+                        # does not change until the generator resumes.
+                        self.pending_token = token
+                        break
+                    batch.buffer = buffer
+            else:
+                batch.literals[len(kinds)] = token.text
+                start = end = -1
+            kinds.append(token.kind)
+            starts.append(start)
+            ends.append(end)
+            if len(kinds) >= n:
+                break
+            token = next(generator, None)
+        return batch
+
+    def iter_batches(self, n=1024):
+        """Generate TokenBatch instances of up to ``n`` tokens."""
+        batch = self.read_batch(n)
+        while batch:
+            yield batch
+            batch = self.read_batch(n)
+
+    def iter_tags(self):
+        """Generate an event for each tag.
+
+        Each event is a tuple (kind, name, attrs), where ``kind`` is
+        'start', 'empty' or 'end', ``name`` is the tag name, and
+        ``attrs`` is a dict of the literal attribute values by name, or
+        None for an end tag.  An attribute without a value has the value
+        None.
+
+        A tag that is complete in the buffer is matched with a regular
+        expression, and its attributes are collected in a single pass
+        over the tag, without generating tokens.  Content, comments,
+        CDATA sections and processing instructions in the buffer are
+        skipped using ``find``.  Constructs that cross the end of the
+        buffer are tokenised, and the text of names and values split
+        between buffers is joined once the text is complete.  A tag that
+        is not complete at the end of the stream is not generated.
+
+        This reads the tokens from the sequence, so do not mix it with
+        other ways of reading tokens from the scanner.
+        """
+        buf = self.buf
+        select = buf.select
+        encoding = buf.encoding
+        name_cache = self.name_cache
+        value_cache = self.value_cache
+        if self.binary:
+            start_tag_pattern = _binary_start_tag_pattern
+            attribute_pattern = _binary_attribute_pattern
+            end_tag_pattern = _binary_end_tag_pattern
+            interest_pattern = _binary_interest_pattern
+            sentinels = {
+                kind: (n, sentinel.encode('ascii'))
+                for kind, (n, sentinel) in _interest_sentinels.items()}
+            lt = b'<'
+        else:
+            start_tag_pattern = _start_tag_pattern
+            attribute_pattern = _attribute_pattern
+            end_tag_pattern = _end_tag_pattern
+            interest_pattern = _interest_pattern
+            sentinels = _interest_sentinels
+            lt = '<'
+        while buf.match_to_sentinel('<') > 0:
+            pass
+        while True:
+            s, pos = buf.block()
+            if pos < 0:
+                return
+            end = len(s)
+            # Break to continue with the sequence at ``pos``.
+            while pos < end:
+                if s[pos] != lt[0]:
+                    pos = s.find(lt, pos)
+                    if pos < 0:
+                        pos = end
+                    continue
+                m = start_tag_pattern.match(s, pos + 1)
+                if m is not None:
+                    close = m.start('start_close')
+                    name_end = m.end('start_name')
+                    attrs = {}
+                    for a in attribute_pattern.finditer(s, name_end, close):
+                        attribute = a.group('name')
+                        if name_cache is not None:
+                            attribute = name_cache.get(attribute)
+                        elif encoding is not None:
+                            attribute = attribute.decode(encoding)
+                        value = a.group('double')
+                        if value is None:
+                            value = a.group('single')
+                        if value is not None:
+                            if value_cache is not None:
+                                value = value_cache.get(value)
+                            elif encoding is not None:
+                                value = value.decode(encoding)
+                        attrs[attribute] = value
+                    name = s[pos + 1:name_end]
+                    if name_cache is not None:
+                        name = name_cache.get(name)
+                    elif encoding is not None:
+                        name = name.decode(encoding)
+                    pos = m.end()
+                    if pos - close == 1:
+                        yield 'start', name, attrs
                     else:
-                        if not buf.get():
-                            yield _BadlyFormedEndOfStreamEmptyTextToken
-                            return
-                        if not buf.starts_with('?>'):
-                            raise RuntimeError(
-                                'Expected ?>, got %r' % buf.get())
-                    yield _ProcessingInstructionCloseTextToken
+                        yield 'empty', name, attrs
+                    continue
+                m = end_tag_pattern.match(s, pos)
+                if m is not None:
+                    name = m.group('name')
+                    if name_cache is not None:
+                        name = name_cache.get(name)
+                    elif encoding is not None:
+                        name = name.decode(encoding)
+                    pos = m.end()
+                    yield 'end', name, None
+                    continue
+                # Only ``<?`` followed by a name starts a processing
+                # instruction, as for the tokeniser
+                m = interest_pattern.match(s, pos)
+                kind = m and m.lastgroup
+                if kind not in ('comment', 'cdata', 'pi'):
+                    # Not markup that can be skipped, or crossing the
+                    # end of the buffer
+                    break
+                n, sentinel = sentinels[kind]
+                found = s.find(sentinel, pos + n)
+                if found < 0:
+                    break
+                pos = found + len(sentinel)
+            select(pos, pos)
+            if pos == end:
+                continue
+            if buf.get() != '<':
+                while buf.match_to_sentinel('<') > 0:
+                    pass
+                continue
+            event = self.markup_event(self.parse_markup(buf))
+            if event is not None:
+                yield event
+
+    def markup_event(self, token_iter):
+        """Return the ``iter_tags`` event for the tokens of some markup.
+
+        :return: The event, or None if the markup is not a complete tag.
+        """
+        get_text = self.get_text
+        holder = tokens.TextHolder()
+        kind = name = attrs = attribute = None
+        parts = []
+        for token in token_iter:
+            if isinstance(token, (
+                    tokens.TagName, tokens.AttributeName,
+                    tokens.AttributeValue)):
+                # Text split between buffers is generated as several
+                # tokens
+                text = get_text(token, holder)
+                parts.append(text.literal())
+                if not text.is_final:
+                    continue
+                value = ''.join(parts)
+                parts = []
+                if isinstance(token, tokens.TagName):
+                    name = value
+                elif isinstance(token, tokens.AttributeName):
+                    attribute = value
+                    attrs[attribute] = None
                 else:
-                    yield tokens.BadlyFormedLessThanToken
-                    yield tokens.PCData(tokens.TextHolder('?'))
-            elif ch == '!':
-                ch = buf.next()
-                if ch == '-':
-                    ch = buf.next()
-                    if ch == '-':
-                        yield _CommentOpenTextToken
-                        buf.advance()
-                        yield from self.parse_until(
-                            buf, tokens.CommentData(), '-->')
-                        if not buf.starts_with('-->'):
-                            yield _BadlyFormedEndOfStreamEmptyTextToken
-                            return
-                        yield _CommentCloseTextToken
-                    else:
-                        # < does not appear to be well-formed markup - emit a
-                        # literal <
-                        yield tokens.BadlyFormedLessThanToken
-                        yield tokens.PCData(tokens.TextHolder('!-'))
-                elif ch == '[':
-                    buf.advance()
-                    if buf.starts_with('CDATA['):
-                        yield _CDataOpenTextToken
-                        found = yield from self.parse_until(
-                            buf, _CDataToken, ']]>')
-                        if not buf.starts_with(']]>'):
-                            assert not found, found
-                            assert not buf.get(), buf.get()
-                            yield _BadlyFormedEndOfStreamEmptyTextToken
-                            return
-                        yield _CDataCloseTextToken
-                    else:
-                        # declaration
-                        raise NotImplementedError(
-                            'Declarations not implemented')
+                    attrs[attribute] = value
+            elif isinstance(token, tokens.StartOrEmptyTagOpen):
+                kind = 'start'
+                attrs = {}
+            elif isinstance(token, tokens.EndTagOpen):
+                kind = 'end'
+            elif isinstance(token, tokens.AttributeValueOpen):
+                attrs[attribute] = ''
+            elif isinstance(token, tokens.EmptyTagClose):
+                kind = 'empty'
+            elif isinstance(token, tokens.BadlyFormedEndOfStream):
+                return None
+        if kind is None:
+            return None
+        return kind, name, attrs
+
+    def skip_to_start_tag(self, name):
+        """Skip to the next markup that may be a start tag with a name.
+
+        Content, comments, CDATA sections, processing instructions and
+        other tags in the buffer are skipped using a regular expression
+        search and ``find``, without being tokenised.  The sequence is
+        left at the ``<`` of a start tag with the name, or of markup
+        that crosses the end of the buffer.  Use ``parse_markup`` to
+        read the markup, and find out whether it is a start tag with
+        the name.
+
+        This reads from the sequence, so do not mix it with other ways
+        of reading tokens from the scanner.
+
+        :return bool: True, or False at the end of the stream
+        """
+        buf = self.buf
+        select = buf.select
+        # The start of a candidate tag, or of markup that may hide one
+        if self.binary:
+            name = name.encode(buf.encoding)
+            candidate_pattern = re.compile(
+                b'<(?:(?P<tag>' + re.escape(name) + b')|[!?])')
+            lt = b'<'
+            tag_ends = b' \t\r\n/>'
+            interest_pattern = _binary_interest_pattern
+            sentinels = {
+                kind: (n, sentinel.encode('ascii'))
+                for kind, (n, sentinel) in _interest_sentinels.items()}
+        else:
+            candidate_pattern = re.compile(
+                '<(?:(?P<tag>' + re.escape(name) + ')|[!?])')
+            lt = '<'
+            tag_ends = ' \t\r\n/>'
+            interest_pattern = _interest_pattern
+            sentinels = _interest_sentinels
+        # Markup starting this close to the end of the buffer may not
+        # be identified
+        tail = max(len(name) + 1, 9)
+        while True:
+            s, pos = buf.block()
+            if pos < 0:
+                return False
+            end = len(s)
+            while True:
+                m = candidate_pattern.search(s, pos)
+                if m is None:
+                    break
+                first = m.start()
+                if m.lastgroup == 'tag':
+                    pos = m.end()
+                    if pos == end or s[pos:pos + 1] in tag_ends:
+                        select(first, first)
+                        return True
+                    continue
+                m = interest_pattern.match(s, first)
+                kind = m and m.lastgroup
+                if kind in ('comment', 'cdata', 'pi'):
+                    n, sentinel = sentinels[kind]
+                    close = s.find(sentinel, first + n)
+                    if close < 0:
+                        select(first, first)
+                        return True
+                    pos = close + len(sentinel)
+                elif end - first < tail:
+                    select(first, first)
+                    return True
+                else:
+                    # Not markup, and parsed as content
+                    pos = first + 2
+            # A candidate tag may cross the end of the buffer
+            last = s.rfind(lt, max(pos, end - tail), end)
+            if last >= 0:
+                select(last, last)
+                return True
+            select(end, end)
+
+    def checkpoint(self):
+        """Return the state of the scanner after the current token.
+
+        The state is a dict of numbers, strings and booleans, so it can
+        be serialised, for example as JSON.  It holds the offset of the
+        end of the current token in the stream, the state of the lexer,
+        and whether text is split at that point.  Pass it to ``resume``
+        to continue scanning after the current token.
+
+        Only the default engine can be checkpointed.  A start tag that
+        is complete in the buffer is generated in one step, so it cannot
+        be checkpointed until its close token.
+        """
+        if self.bulk or self.interest is not None:
+            raise ValueError('Only the default engine supports checkpoint')
+        generator = self.scan_generator
+        offset = self.buf.tell()
+        if generator is not None and generator.gi_frame is None:
+            return {'offset': offset, 'state': DONE}
+        if generator is not None and generator.gi_yieldfrom is not None:
+            raise ValueError('Cannot checkpoint inside a start tag')
+        if generator is not None:
+            variables = inspect.getgeneratorlocals(generator)
+        if generator is None or 'quote' not in variables:
+            # The generator has not started
+            if self.resume_point is not None:
+                return dict(self.resume_point)
+            return {'offset': offset, 'state': PROLOGUE}
+        run_pattern = variables['run_pattern']
+        if run_pattern is None:
+            run_pattern_name = None
+        elif run_pattern is self.name_parser.pat:
+            run_pattern_name = 'name'
+        else:
+            run_pattern_name = 'space'
+        return {
+            'offset': offset,
+            'state': variables['state'],
+            'run_pattern': run_pattern_name,
+            'run_sentinel': variables['run_sentinel'],
+            'run_token': _run_token_index.get(variables['run_token']),
+            'run_next': variables['run_next'],
+            'initial': variables['initial'],
+            'found': variables['found'],
+            'ws_found': variables['ws_found'],
+            'quote': variables['quote'],
+            }
+
+    @classmethod
+    def resume(
+            cls, source, checkpoint, block_size=65536, encoding='utf-8',
+            **kw):
+        """Continue scanning from a checkpoint.
+
+        :param source: The path of a file, or a file object at the start
+            of the data that was scanned when the checkpoint was taken.
+            A file is moved to the offset using ``seek``, if it is a
+            seekable binary file that is not compressed.  Otherwise, the
+            data before the offset is read and discarded.
+        :param dict checkpoint: A value returned by ``checkpoint``.
+
+        Other keyword arguments are passed to the constructor.
+        """
+        offset = checkpoint['offset']
+        if isinstance(source, str):
+            blocks = iterseq.read_file(source, block_size, offset)
+            buf = iterseq.BytesAsSequence(blocks, encoding, offset)
+        elif isinstance(source.read(0), str):
+            iterseq.skip(source, offset)
+            buf = iterseq.IterableAsSequence(
+                iterseq.read_blocks(source, block_size), offset)
+        else:
+            stream = iterseq.decompressed(source)
+            iterseq.skip(stream, offset)
+            buf = iterseq.BytesAsSequence(
+                iterseq.read_blocks(stream, block_size), encoding, offset)
+        scanner = cls(buf, **kw)
+        scanner.resume_point = checkpoint
+        return scanner
+
+    def create_generator(self):
+        if self.resume_point is not None:
+            generator = self.parse_states(
+                self.buf, PROLOGUE, DONE, self.resume_point)
+        elif self.interest is not None:
+            generator = self.parse_interest(self.buf)
+        elif self.bulk:
+            generator = self.parse_bulk(self.buf)
+        else:
+            generator = self.parse(self.buf)
+        self.scan_generator = generator
+        if self.positions:
+            return self.positioned(generator)
+        if self.coalesce:
+            return self.coalesced(generator)
+        return generator
+
+    def coalesced(self, token_iter):
+        """Generate tokens, joining text that is split over tokens.
+
+        Whether a token is split is read from the current parser, so a
+        token that holds all of its text is generated without getting
+        its text.  The text of a split token is joined into new tokens
+        of at most ``coalesce`` characters, and the rest of the text is
+        carried to the next token.
+        """
+        limit = self.coalesce
+        get_text = self.get_text
+        joined = self.joined
+        peek = self.buf.get
+        node = None
+        for token in token_iter:
+            if node is None:
+                cls = token.__class__
+                if cls not in _coalesce_classes or token.text is not None:
+                    yield token
+                    continue
+                parser = self.current_parser
+                if parser.is_final and (
+                        cls is not tokens.WhitespaceContent or
+                        peek() in _text_ends):
+                    # The token holds all of the text
+                    yield token
+                    continue
+                node = cls
+                initial = parser.is_initial
+                parts = []
+                size = 0
+                # The start of a reference held back from the previous
+                # joined token
+                prefix = ''
+            literal = get_text(token).literal()
+            parts.append(literal)
+            size += len(literal)
+            final = self.current_parser.is_final
+            if (final and node is tokens.WhitespaceContent and
+                    peek() not in _text_ends):
+                # Join the whitespace to the following text
+                node = tokens.PCData
+                final = False
+            if size <= limit and not final:
+                continue
+            literal = ''.join(parts)
+            while len(literal) > limit:
+                text, prefix = joined(
+                    node, literal[:limit], initial, False, prefix)
+                yield node(text)
+                initial = False
+                literal = literal[limit:]
+            if final:
+                text, prefix = joined(node, literal, initial, True, prefix)
+                yield node(text)
+                node = None
+            else:
+                parts = [literal]
+                size = len(literal)
+
+    def joined(self, token_class, literal, initial, final, prefix=''):
+        """Return a text holder for joined text, for ``coalesced``.
+
+        :param str prefix: The start of a reference held back from the
+            previous part of the text.
+        :return tuple: The text holder, and the start of a reference at
+            the end of the text, to be held back for the next part.  A
+            reference is only held back if the content of the text is
+            decoded, and the text is not final.
+        """
+        text = tokens.TextHolder(
+            literal, is_initial=initial, is_final=final)
+        held = ''
+        if token_class in _reference_classes:
+            if not final:
+                whole = prefix + literal
+                i = whole.rfind('&', max(len(whole) - _max_reference, 0))
+                if i >= 0 and whole.find(';', i) < 0:
+                    held = whole[i:]
+            text.set_references(prefix, len(held))
+        return text, held
+
+    def positioned(self, token_iter):
+        """Generate tokens, recording the position of each token.
+
+        The tokens cover the whole stream, so each token starts where
+        the previous token ends.  The length of a token is the length
+        of its extent in the buffer, or of its literal text, so the
+        text is not sliced.  The newlines are counted by ``lines`` when
+        a location is requested, or when the buffer changes.
+        """
+        extent = self.buf.extent
+        self.lines = lines = LineCounter(
+            self.buf.tell(), '\n' if self.buf.encoding is None else b'\n')
+        self.token_start = self.token_end = position = self.buf.tell()
+        lengths = {}
+        for token in token_iter:
+            if token is not None:
+                text = token.text
+                if text is None:
+                    buffer, start, end = extent()
+                    # Consecutive chunks may be the same object, such as
+                    # a shared 1-character string, so a new buffer is
+                    # also found from the offset of its start
+                    base = position - start
+                    if buffer is not lines.buffer or base != lines.base:
+                        lines.add_buffer(buffer, start, base)
+                    lines.end = end
+                    length = end - start
                 else:
-                    yield tokens.BadlyFormedLessThanToken
-                    yield tokens.PCData('!')
-            elif self.name_parser.matches_initial(ch):
-                yield _StartOrEmptyTagOpenTextToken
-                if not (yield from self.parse_name(buf, _TagNameToken)):
-                    raise RuntimeError('Expected tag name')
-                ws_found = yield from self.parse_space(
-                    buf, _MarkupWhitespaceToken)
-                ch = buf.get()
-                while ws_found and self.name_parser.matches_initial(ch):
-                    yield from self.parse_name(buf, _AttributeNameToken)
-                    yield from self.parse_space(buf, _MarkupWhitespaceToken)
-                    ch = buf.get()
-                    if ch == '=':
-                        yield _AttributeEqualsTextToken
+                    length = lengths.get(token)
+                    if length is None:
+                        length = lengths[token] = len(text.literal())
+                self.token_start = position
+                position += length
+                self.token_end = position
+            yield token
+
+    def span(self):
+        """Return the extent of the current token in the stream.
+
+        This requires the ``positions`` option.
+
+        :return tuple: (start, end), the offsets of the start and end of
+            the current token, in characters, or bytes for an encoded
+            sequence.
+        """
+        if self.lines is None:
+            raise ValueError('Positions are not recorded')
+        return self.token_start, self.token_end
+
+    def location(self):
+        """Return the line and column of the start of the current token.
+
+        This requires the ``positions`` option.  Lines are counted from
+        1, and columns from 0, in characters, or bytes for an encoded
+        sequence.  After ``resume``, lines are counted from the
+        checkpoint.
+        """
+        if self.lines is None:
+            raise ValueError('Positions are not recorded')
+        return self.lines.location(self.token_start)
+
+    def wanted(self, token_class):
+        """Return whether tokens of a class are of interest."""
+        try:
+            return self._wanted[token_class]
+        except KeyError:
+            interest = self.interest
+            result = interest is None or issubclass(token_class, interest)
+            self._wanted[token_class] = result
+            return result
+
+    def wants_any(self, token_classes):
+        """Return whether tokens of any of the classes are of interest."""
+        return any(self.wanted(cls) for cls in token_classes)
+
+    def filtered(self, token_iter):
+        """Generate the tokens of interest from a token iterator."""
+        wanted = self.wanted
+        for token in token_iter:
+            if wanted(token.__class__):
+                yield token
+
+    def parse(self, buf):
+        return self.parse_states(buf, PROLOGUE, DONE)
+
+    def parse_prologue(self, buf):
+        """Parse the prologue up to the first markup."""
+        return self.parse_states(buf, PROLOGUE, MARKUP)
+
+    def parse_content(self, buf):
+        """Parse content up to the next markup or the end of stream."""
+        return self.parse_states(buf, CONTENT, MARKUP)
+
+    def parse_markup(self, buf):
+        """Parse markup starting at the current ``<`` character.
+
+        On return, the buffer is positioned after the markup, or at the
+        end of the stream.
+        """
+        return self.parse_states(buf, MARKUP, CONTENT)
+
+    def parse_states(self, buf, state, stop, checkpoint=None):
+        """Generate tokens by running the state machine.
+
+        The machine starts in ``state``, and finishes on reaching the
+        ``stop`` state, or the end of the stream.  Each state performs
+        its buffer operations before yielding any tokens, so the buffer
+        position at the start of a state is a restart point.  If a fed
+        sequence raises ``iterseq.NeedData``, the generator yields None,
+        and repeats the state when resumed.
+
+        Text that may continue in the next buffer is scanned by the
+        ``RUN_PATTERN`` and ``RUN_SENTINEL`` states.  These yield
+        ``run_token`` until the text ends, and then move to
+        ``run_next``.  ``found`` records whether any text was found.
+
+        If ``checkpoint`` is a dict returned by ``checkpoint``, the
+        state and the run variables are restored from it.
+        """
+        responder = self.state_responder(buf)
+        self.current_parser = responder
+        matches_initial = self.name_parser.matches_initial
+        name_pattern = self.name_parser.pat
+        space_pattern = self.space_parser.pat
+        matching = buf.matching
+        match_to_sentinel = buf.match_to_sentinel
+        tag_lookahead = self.tag_lookahead
+        if self.binary:
+            start_tag_pattern = _binary_start_tag_pattern
+            tag_part_pattern = _binary_tag_part_pattern
+        else:
+            start_tag_pattern = _start_tag_pattern
+            tag_part_pattern = _tag_part_pattern
+        run_pattern = run_sentinel = run_token = None
+        run_next = DONE
+        initial = found = ws_found = False
+        quote = None
+        if checkpoint is not None:
+            state = checkpoint['state']
+            run_pattern = {'name': name_pattern, 'space': space_pattern}.get(
+                checkpoint.get('run_pattern'))
+            run_sentinel = checkpoint.get('run_sentinel')
+            if checkpoint.get('run_token') is not None:
+                run_token = _run_tokens[checkpoint['run_token']]
+            run_next = checkpoint.get('run_next', DONE)
+            initial = checkpoint.get('initial', False)
+            found = checkpoint.get('found', False)
+            ws_found = checkpoint.get('ws_found', False)
+            quote = checkpoint.get('quote')
+        while True:
+            try:
+                while state != stop:
+                    if state == RUN_PATTERN:
+                        matched = matching(run_pattern)
+                        if matched == 0:
+                            if not initial:
+                                # Emit an empty final token for split text
+                                responder.is_initial = False
+                                responder.is_final = True
+                                state = run_next
+                                yield run_token
+                            else:
+                                state = run_next
+                        else:
+                            responder.is_initial = initial
+                            if matched < 0:
+                                responder.is_final = True
+                                state = run_next
+                            else:
+                                responder.is_final = False
+                            initial = False
+                            found = True
+                            yield run_token
+                    elif state == RUN_SENTINEL:
+                        matched = match_to_sentinel(run_sentinel)
+                        if matched == 0:
+                            if not initial:
+                                responder.is_initial = False
+                                responder.is_final = True
+                                state = run_next
+                                yield run_token
+                            else:
+                                state = run_next
+                        else:
+                            responder.is_initial = initial
+                            if matched < 0:
+                                responder.is_final = True
+                                state = run_next
+                            else:
+                                responder.is_final = False
+                            initial = False
+                            found = True
+                            yield run_token
+                    elif state == MARKUP:
+                        # At ``<``
                         buf.advance()
-                        yield from self.parse_space(
-                            buf, _MarkupWhitespaceToken)
+                        state = MARKUP_SELECT
+                    elif state == MARKUP_SELECT:
+                        # Select the construct from the character after ``<``
                         ch = buf.get()
-                        if not ch:
+                        state = _markup_states.get(ch)
+                        if state is not None:
+                            buf.advance()
+                        elif matches_initial(ch):
+                            state = START_TAG
+                        else:
+                            # < does not appear to be well-formed markup -
+                            # treat it as a content character
+                            state = CONTENT
+                            yield tokens.BadlyFormedLessThanToken
+                    elif state == CONTENT:
+                        if buf.get() == '<':
+                            state = MARKUP
+                        elif buf.get():
+                            run_pattern = space_pattern
+                            run_token = _WhitespaceContentToken
+                            run_next = CONTENT_TEXT
+                            initial = True
+                            found = False
+                            state = RUN_PATTERN
+                        else:
+                            state = DONE
+                    elif state == CONTENT_TEXT:
+                        run_sentinel = '<'
+                        run_token = _PCDataToken
+                        run_next = CONTENT_END
+                        initial = True
+                        state = RUN_SENTINEL
+                    elif state == CONTENT_END:
+                        state = MARKUP if buf.get() == '<' else DONE
+                    elif state == START_TAG:
+                        s, pos = buf.block()
+                        m = start_tag_pattern.match(s, pos)
+                        if m is None and tag_lookahead:
+                            # The tag may end in the following chunks
+                            block = buf.lookahead(
+                                start_tag_pattern, tag_lookahead)
+                            if block[0] is not s:
+                                s, pos = block
+                                m = start_tag_pattern.match(s, pos)
+                        if m is not None:
+                            # The whole tag is in the buffer
+                            responder.is_initial = True
+                            responder.is_final = True
+                            state = CONTENT
+                            yield (yield from self.start_tag_tokens(
+                                s, m, tag_part_pattern))
+                            continue
+                        run_pattern = name_pattern
+                        run_token = _TagNameToken
+                        run_next = TAG_NAME_END
+                        initial = True
+                        found = False
+                        state = RUN_PATTERN
+                        yield _StartOrEmptyTagOpenTextToken
+                    elif state == TAG_NAME_END:
+                        if not found:
+                            raise RuntimeError('Expected tag name')
+                        run_pattern = space_pattern
+                        run_token = _MarkupWhitespaceToken
+                        run_next = TAG_SPACE_END
+                        initial = True
+                        found = False
+                        state = RUN_PATTERN
+                    elif state == TAG_SPACE_END:
+                        ws_found = found
+                        state = TAG_ATTRIBUTE
+                    elif state == TAG_ATTRIBUTE:
+                        # The sequence has no buffer if it is resumed at
+                        # the end of the stream
+                        ch = buf.get()
+                        if ws_found and ch and matches_initial(ch):
+                            run_pattern = name_pattern
+                            run_token = _AttributeNameToken
+                            run_next = ATTRIBUTE_NAME_END
+                            initial = True
+                            found = False
+                            state = RUN_PATTERN
+                        else:
+                            state = TAG_CLOSE
+                    elif state == ATTRIBUTE_NAME_END:
+                        run_pattern = space_pattern
+                        run_token = _MarkupWhitespaceToken
+                        run_next = ATTRIBUTE_EQUALS
+                        initial = True
+                        found = False
+                        state = RUN_PATTERN
+                    elif state == ATTRIBUTE_EQUALS:
+                        if buf.get() == '=':
+                            buf.advance()
+                            run_pattern = space_pattern
+                            run_token = _MarkupWhitespaceToken
+                            run_next = ATTRIBUTE_VALUE
+                            initial = True
+                            found = False
+                            state = RUN_PATTERN
+                            yield _AttributeEqualsTextToken
+                        else:
+                            # An attribute without a value
+                            state = TAG_ATTRIBUTE
+                    elif state == ATTRIBUTE_VALUE:
+                        quote = buf.get()
+                        if not quote:
+                            state = CONTENT
                             yield _BadlyFormedEndOfStreamEmptyTextToken
-                            return
-                        if ch in ('"', "'"):
-                            if ch == '"':
+                        elif quote == '"' or quote == "'":
+                            buf.advance()
+                            run_sentinel = quote
+                            run_token = _AttributeValueToken
+                            run_next = ATTRIBUTE_VALUE_END
+                            initial = True
+                            state = RUN_SENTINEL
+                            if quote == '"':
                                 yield _AttributeValueDoubleOpenTextToken
                             else:
                                 yield _AttributeValueSingleOpenTextToken
-                            buf.advance()
-                            yield from self.parse_until(
-                                buf, _AttributeValueToken, ch)
-                            if not buf.starts_with(ch):
-                                yield _BadlyFormedEndOfStreamEmptyTextToken
-                                return
-                            if ch == '"':
-                                yield _AttributeValueDoubleCloseTextToken
-                            else:
-                                yield _AttributeValueSingleCloseTextToken
                         else:
                             # HTML fallback - need a parser to read un-quoted
                             # attribute
                             raise RuntimeError()
-                        ws_found = yield from self.parse_space(
-                            buf, _MarkupWhitespaceToken)
+                    elif state == ATTRIBUTE_VALUE_END:
+                        if not buf.starts_with(quote):
+                            state = CONTENT
+                            yield _BadlyFormedEndOfStreamEmptyTextToken
+                        else:
+                            run_pattern = space_pattern
+                            run_token = _MarkupWhitespaceToken
+                            run_next = TAG_SPACE_END
+                            initial = True
+                            found = False
+                            state = RUN_PATTERN
+                            if quote == '"':
+                                yield _AttributeValueDoubleCloseTextToken
+                            else:
+                                yield _AttributeValueSingleCloseTextToken
+                    elif state == TAG_CLOSE:
                         ch = buf.get()
-                if not ch:
-                    yield _BadlyFormedEndOfStreamEmptyTextToken
-                    return
-                elif ch == '>':
-                    yield _StartTagCloseTextToken
-                    buf.advance()
-                elif ch == '/':
-                    ch = buf.next()
-                    if not ch:
-                        yield tokens.BadlyFormedEndOfStream(
-                            tokens.TextHolder('/'))
+                        state = CONTENT
+                        if not ch:
+                            yield _BadlyFormedEndOfStreamEmptyTextToken
+                        elif ch == '>':
+                            buf.advance()
+                            yield _StartTagCloseTextToken
+                        elif ch == '/':
+                            buf.advance()
+                            state = TAG_CLOSE_SLASH
+                        else:
+                            raise RuntimeError(
+                                'Expected whitespace, >, or />, found %r' % ch)
+                    elif state == TAG_CLOSE_SLASH:
+                        ch = buf.get()
+                        state = CONTENT
+                        if not ch:
+                            yield _BadlyFormedEndOfStreamSlashTextToken
+                        elif ch != '>':
+                            raise RuntimeError('Expected />')
+                        else:
+                            buf.advance()
+                            yield _EmptyTagCloseTextToken
+                    elif state == END_TAG:
+                        if matches_initial(buf.get()):
+                            run_pattern = name_pattern
+                            run_token = _TagNameToken
+                            run_next = END_TAG_NAME_END
+                            initial = True
+                            found = False
+                            state = RUN_PATTERN
+                            yield _EndTagOpenTextToken
+                        else:
+                            run_token = _SlashTextToken
+                            state = LITERAL
+                            yield tokens.BadlyFormedLessThanToken
+                    elif state == END_TAG_NAME_END:
+                        run_pattern = space_pattern
+                        run_token = _MarkupWhitespaceToken
+                        run_next = END_TAG_CLOSE
+                        initial = True
+                        found = False
+                        state = RUN_PATTERN
+                    elif state == END_TAG_CLOSE:
+                        ch = buf.get()
+                        state = CONTENT
+                        if not ch:
+                            yield _BadlyFormedEndOfStreamEmptyTextToken
+                        elif ch != '>':
+                            raise RuntimeError('extra data in close tag')
+                        else:
+                            buf.advance()
+                            yield _EndTagCloseTextToken
+                    elif state == COMMENT_END:
+                        state = CONTENT
+                        if buf.starts_with('-->'):
+                            yield _CommentCloseTextToken
+                        else:
+                            yield _BadlyFormedEndOfStreamEmptyTextToken
+                    elif state == BANG:
+                        ch = buf.get()
+                        if ch == '-':
+                            buf.advance()
+                            state = BANG_DASH
+                        elif ch == '[':
+                            buf.advance()
+                            state = BANG_BRACKET
+                        else:
+                            run_token = _BangTextToken
+                            state = LITERAL
+                            yield tokens.BadlyFormedLessThanToken
+                    elif state == BANG_DASH:
+                        if buf.get() == '-':
+                            buf.advance()
+                            run_sentinel = '-->'
+                            run_token = _CommentDataToken
+                            run_next = COMMENT_END
+                            initial = True
+                            state = RUN_SENTINEL
+                            yield _CommentOpenTextToken
+                        else:
+                            # < does not appear to be well-formed markup -
+                            # emit a literal <
+                            run_token = _BangDashTextToken
+                            state = LITERAL
+                            yield tokens.BadlyFormedLessThanToken
+                    elif state == BANG_BRACKET:
+                        if buf.starts_with('CDATA['):
+                            run_sentinel = ']]>'
+                            run_token = _CDataToken
+                            run_next = CDATA_END
+                            initial = True
+                            state = RUN_SENTINEL
+                            yield _CDataOpenTextToken
+                        else:
+                            # declaration
+                            raise NotImplementedError(
+                                'Declarations not implemented')
+                    elif state == CDATA_END:
+                        state = CONTENT
+                        if buf.starts_with(']]>'):
+                            yield _CDataCloseTextToken
+                        else:
+                            yield _BadlyFormedEndOfStreamEmptyTextToken
+                    elif state == PI:
+                        if matches_initial(buf.get()):
+                            run_pattern = name_pattern
+                            run_token = _ProcessingInstructionTargetToken
+                            run_next = PI_TARGET_END
+                            initial = True
+                            found = False
+                            state = RUN_PATTERN
+                            yield _ProcessingInstructionOpenTextToken
+                        else:
+                            run_token = _QuestionTextToken
+                            state = LITERAL
+                            yield tokens.BadlyFormedLessThanToken
+                    elif state == PI_TARGET_END:
+                        run_pattern = space_pattern
+                        run_token = _MarkupWhitespaceToken
+                        run_next = PI_SPACE_END
+                        initial = True
+                        found = False
+                        state = RUN_PATTERN
+                    elif state == PI_SPACE_END:
+                        if found:
+                            run_sentinel = '?>'
+                            run_token = _ProcessingInstructionDataToken
+                            run_next = PI_END
+                            initial = True
+                            state = RUN_SENTINEL
+                        elif not buf.get():
+                            state = CONTENT
+                            yield _BadlyFormedEndOfStreamEmptyTextToken
+                        elif not buf.starts_with('?>'):
+                            raise RuntimeError(
+                                'Expected ?>, got %r' % buf.get())
+                        else:
+                            state = CONTENT
+                            yield _ProcessingInstructionCloseTextToken
+                    elif state == PI_END:
+                        state = CONTENT
+                        if buf.starts_with('?>'):
+                            yield _ProcessingInstructionCloseTextToken
+                        else:
+                            yield _BadlyFormedEndOfStreamEmptyTextToken
+                    elif state == LITERAL:
+                        # The text following a < that is not well-formed
+                        # markup
+                        state = CONTENT
+                        yield run_token
+                    elif state == PROLOGUE:
+                        # Whitespace before initial non-ws is not considered to
+                        # be content
+                        run_pattern = space_pattern
+                        run_token = _MarkupWhitespaceToken
+                        run_next = CONTENT_TEXT
+                        initial = True
+                        found = False
+                        state = RUN_PATTERN
+                    else:
+                        assert state == DONE, state
                         return
-                    elif ch != '>':
-                        raise RuntimeError('Expected />')
-                    yield _EmptyTagCloseTextToken
-                    buf.advance()
+                return
+            except iterseq.NeedData:
+                # Wait for more data, then repeat the current state
+                yield None
+
+    def start_tag_tokens(self, s, m, tag_part_pattern):
+        """Generate the tokens of a start tag matched in a buffer.
+
+        ``m`` is a match of ``_start_tag_source`` in the buffer ``s``.
+        Since the whole tag has been matched, the open token is refined
+        to a StartTagOpen or EmptyTagOpen.  The text of each token is
+        selected in the buffer before the token is generated.
+
+        The close token is returned rather than generated, so that the
+        caller generates it once the tag has been consumed.
+        """
+        select = self.buf.select
+        close = m.start('start_close')
+        end = m.end()
+        if end - close == 1:
+            yield _StartTagOpenTextToken
+        else:
+            yield _EmptyTagOpenTextToken
+        name_end = m.end('start_name')
+        select(m.start('start_name'), name_end)
+        yield _TagNameToken
+        for part in tag_part_pattern.finditer(s, name_end, close):
+            part_kind = part.lastgroup
+            if part_kind == 'space':
+                select(part.start(), part.end())
+                yield _MarkupWhitespaceToken
+            elif part_kind == 'name':
+                select(part.start(), part.end())
+                yield _AttributeNameToken
+            elif part_kind == 'equals':
+                yield _AttributeEqualsTextToken
+            elif part_kind == 'double':
+                yield _AttributeValueDoubleOpenTextToken
+                if part.end() - part.start() > 2:
+                    select(part.start() + 1, part.end() - 1)
+                    yield _AttributeValueToken
+                yield _AttributeValueDoubleCloseTextToken
+            else:
+                yield _AttributeValueSingleOpenTextToken
+                if part.end() - part.start() > 2:
+                    select(part.start() + 1, part.end() - 1)
+                    yield _AttributeValueToken
+                yield _AttributeValueSingleCloseTextToken
+        select(end, end)
+        if end - close == 1:
+            return _StartTagCloseTextToken
+        else:
+            return _EmptyTagCloseTextToken
+
+    def parse_bulk(self, buf):
+        # The prologue has a different token for leading whitespace, so
+        # leave it to the character-based parsers.
+        yield from self.parse_prologue(buf)
+        responder = self.extent_responder(buf)
+        select = buf.select
+        if self.binary:
+            bulk_pattern = _binary_bulk_pattern
+            tag_part_pattern = _binary_tag_part_pattern
+        else:
+            bulk_pattern = _bulk_pattern
+            tag_part_pattern = _tag_part_pattern
+        while True:
+            s, pos = buf.block()
+            if pos < 0:
+                return
+            self.current_parser = responder
+            end = len(s)
+            for m in bulk_pattern.finditer(s, pos):
+                if m.start() != pos:
+                    # Markup that does not match at ``pos``
+                    break
+                kind = m.lastgroup
+                if kind == 'text':
+                    if m.end() == end:
+                        # Text may continue in the next buffer
+                        break
+                    space_end = m.end('text_space')
+                    if space_end > pos:
+                        select(pos, space_end)
+                        yield _WhitespaceContentToken
+                    if m.end() > space_end:
+                        select(space_end, m.end())
+                        yield _PCDataToken
+                elif kind == 'start_tag':
+                    yield (yield from self.start_tag_tokens(
+                        s, m, tag_part_pattern))
+                elif kind == 'end_tag':
+                    yield _EndTagOpenTextToken
+                    select(pos + 2, m.end('end_name'))
+                    yield _TagNameToken
+                    if m.end() - m.end('end_name') > 1:
+                        select(m.end('end_name'), m.end() - 1)
+                        yield _MarkupWhitespaceToken
+                    yield _EndTagCloseTextToken
+                elif kind == 'comment':
+                    yield _CommentOpenTextToken
+                    if m.end() - pos > 7:
+                        select(pos + 4, m.end() - 3)
+                        yield _CommentDataToken
+                    yield _CommentCloseTextToken
+                elif kind == 'cdata':
+                    yield _CDataOpenTextToken
+                    if m.end() - pos > 12:
+                        select(pos + 9, m.end() - 3)
+                        yield _CDataToken
+                    yield _CDataCloseTextToken
                 else:
-                    raise RuntimeError(
-                        'Expected whitespace, >, or />, found %r' % ch)
+                    yield _ProcessingInstructionOpenTextToken
+                    select(pos + 2, m.end('pi_target'))
+                    yield _ProcessingInstructionTargetToken
+                    if m.start('pi_space') >= 0:
+                        select(m.start('pi_space'), m.end('pi_space'))
+                        yield _MarkupWhitespaceToken
+                        if m.end() - m.end('pi_space') > 2:
+                            select(m.end('pi_space'), m.end() - 2)
+                            yield _ProcessingInstructionDataToken
+                    yield _ProcessingInstructionCloseTextToken
+                pos = m.end()
+            select(pos, pos)
+            if pos < end:
+                # Use the character-based parsers for constructs that
+                # may cross the end of the buffer, or are not handled
+                # above.
+                if buf.get() == '<':
+                    yield from self.parse_markup(buf)
+                else:
+                    yield from self.parse_content(buf)
+
+    def parse_interest(self, buf):
+        wanted = self.wanted
+        wants_any = self.wants_any
+        filtered = self.filtered
+        want_content = wants_any(_content_classes)
+        want_start_tag = wants_any(_start_tag_classes)
+        want_attributes = wants_any(
+            _start_tag_classes[len(_start_tag_outline_classes):])
+        want_end_tag = wants_any(_end_tag_classes)
+        want_comment = wants_any(_comment_classes)
+        want_cdata = wants_any(_cdata_classes)
+        want_pi = wants_any(_pi_classes)
+        skip = {
+            'start_tag': not want_start_tag,
+            'end_tag': not want_end_tag,
+            'comment': not want_comment,
+            'cdata': not want_cdata,
+            'pi': not want_pi,
+            None: False,
+            }
+        sentinels = _interest_sentinels
+        if self.binary:
+            interest_pattern = _binary_interest_pattern
+            tag_rest_pattern = _binary_tag_rest_pattern
+            tag_skip_pattern = _binary_tag_skip_pattern
+            end_tag_rest_pattern = _binary_end_tag_rest_pattern
+            encoded = {
+                kind: (n, sentinel.encode('ascii'))
+                for kind, (n, sentinel) in sentinels.items()}
+            lt = b'<'
+        else:
+            interest_pattern = _interest_pattern
+            tag_rest_pattern = _tag_rest_pattern
+            tag_skip_pattern = _tag_skip_pattern
+            end_tag_rest_pattern = _end_tag_rest_pattern
+            encoded = sentinels
+            lt = '<'
+        want_open = wanted(tokens.StartOrEmptyTagOpen)
+        want_start_open = wanted(tokens.StartTagOpen)
+        want_empty_open = wanted(tokens.EmptyTagOpen)
+        want_name = wanted(tokens.TagName)
+        want_close = wanted(tokens.StartTagClose)
+        want_empty_close = wanted(tokens.EmptyTagClose)
+        want_end_open = wanted(tokens.EndTagOpen)
+        want_end_close = wanted(tokens.EndTagClose)
+        want_space = wanted(tokens.MarkupWhitespace)
+        want_eos = wanted(tokens.BadlyFormedEndOfStream)
+        name_pattern = self.name_parser.pat
+        responder = self.extent_responder(buf)
+        select = buf.select
+        if wants_any(_prologue_classes):
+            yield from filtered(self.parse_prologue(buf))
+        else:
+            while buf.match_to_sentinel('<') > 0:
+                pass
+        while True:
+            s, pos = buf.block()
+            if pos < 0:
+                return
+            self.current_parser = responder
+            end = len(s)
+            # Skip or outline the constructs in the current buffer.
+            # Break to continue with the sequence at ``pos``.
+            while pos < end:
+                if s[pos] != lt[0]:
+                    if want_content:
+                        break
+                    pos = s.find(lt, pos)
+                    if pos < 0:
+                        pos = end
+                    continue
+                m = interest_pattern.match(s, pos)
+                kind = m and m.lastgroup
+                if kind == 'start_tag' and not want_attributes:
+                    name = name_pattern.match(s, pos + 1)
+                    rest = tag_rest_pattern.match(s, name.end())
+                    if rest is None:
+                        # The tag may continue in the next buffer
+                        break
+                    if want_start_tag:
+                        # The whole tag is in the buffer, so the open
+                        # token is refined.
+                        if rest.end() - rest.start('close') == 1:
+                            if want_start_open:
+                                yield _StartTagOpenTextToken
+                            if want_name:
+                                select(pos + 1, name.end())
+                                yield _TagNameToken
+                            if want_close:
+                                yield _StartTagCloseTextToken
+                        else:
+                            if want_empty_open:
+                                yield _EmptyTagOpenTextToken
+                            if want_name:
+                                select(pos + 1, name.end())
+                                yield _TagNameToken
+                            if want_empty_close:
+                                yield _EmptyTagCloseTextToken
+                    pos = rest.end()
+                elif kind == 'end_tag' and not want_space:
+                    name = name_pattern.match(s, pos + 2)
+                    rest = end_tag_rest_pattern.match(s, name.end())
+                    if rest is None:
+                        break
+                    if want_end_tag:
+                        if want_end_open:
+                            yield _EndTagOpenTextToken
+                        if want_name:
+                            select(pos + 2, name.end())
+                            yield _TagNameToken
+                        if want_end_close:
+                            yield _EndTagCloseTextToken
+                    pos = rest.end()
+                elif skip[kind]:
+                    n, sentinel = encoded[kind]
+                    found = s.find(sentinel, pos + n)
+                    if found < 0:
+                        break
+                    pos = found + len(sentinel)
+                else:
+                    break
+            select(pos, pos)
+            if pos == end:
+                continue
+            # Use the sequence for content of interest, and for markup
+            # that is of interest, or that crosses the end of the buffer.
+            if buf.get() != '<':
+                yield from filtered(self.parse_content(buf))
+                continue
+            m = interest_pattern.match(s, pos)
+            kind = m and m.lastgroup
+            if kind == 'start_tag' and not want_attributes:
+                # The tag crosses the end of the buffer
+                if want_open:
+                    yield _StartOrEmptyTagOpenTextToken
+                select(pos + 1, pos + 1)
+                if want_name:
+                    yield from self.parse_name(buf, _TagNameToken)
+                else:
+                    while buf.matching(name_pattern) > 0:
+                        pass
+                close = _skip_tag(buf, tag_skip_pattern)
+                if close == '>':
+                    if want_close and want_start_tag:
+                        yield _StartTagCloseTextToken
+                elif close == '/>':
+                    if want_empty_close and want_start_tag:
+                        yield _EmptyTagCloseTextToken
+                elif close == '/':
+                    if want_eos:
+                        yield _BadlyFormedEndOfStreamSlashTextToken
+                elif want_eos:
+                    yield _BadlyFormedEndOfStreamEmptyTextToken
+            elif skip[kind]:
+                n, sentinel = sentinels[kind]
+                select(pos + n, pos + n)
+                if not _skip_past(buf, sentinel) and want_eos:
+                    yield _BadlyFormedEndOfStreamEmptyTextToken
             else:
-                # < does not appear to be well-formed markup - treat it
-                # as a content character
-                yield tokens.BadlyFormedLessThanToken
-            yield from self.parse_space(buf, _WhitespaceContentToken)
-            yield from self.parse_until(buf, _PCDataToken, '<')
+                yield from filtered(self.parse_markup(buf))
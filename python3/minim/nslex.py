@@ -4,19 +4,19 @@ empty_text = tokens.TextHolder('')
 
 
 class NamespaceIdentifier(tokens.WellFormed, tokens.Token):
-    pass
+    __slots__ = ()
 
 
 class NamespacePrefix(NamespaceIdentifier):
-    pass
+    __slots__ = ()
 
 
 class NamespaceDefault(NamespaceIdentifier):
-    pass
+    __slots__ = ()
 
 
 class NamespaceUri(tokens.WellFormed, tokens.Token):
-    pass
+    __slots__ = ()
 
 
 _NamespacePrefixToken = NamespacePrefix()
@@ -36,17 +36,56 @@ class NamespaceTokenScanner(lex.SendBasedTokenScanner):
 
     def __init__(self, token_generator):
         super().__init__()
+        self.token_scanner = token_generator
         if __debug__:
             token_generator = lex.TokenSequence(token_generator)
         self.token_generator = token_generator
         self.xmlns_name_limit = 512
         self.xmlns_url_limit = 2048
+        # True while generating the tokens of a tag that has already
+        # been read from the token generator
+        self.replaying = False
 
     @classmethod
     def from_strings(cls, string_iter):
         """Generates tokens from the supplied iterator."""
         return cls(lex.TokenScanner.from_strings(string_iter))
 
+    @classmethod
+    def from_bytes(cls, source, encoding='utf-8'):
+        """Generates tokens from encoded bytes."""
+        return cls(lex.TokenScanner.from_bytes(source, encoding))
+
+    @classmethod
+    def from_file(cls, path, **kw):
+        """Generates tokens from the bytes of a file."""
+        return cls(lex.TokenScanner.from_file(path, **kw))
+
+    @classmethod
+    def from_stream(cls, stream, **kw):
+        """Generates tokens from a file object."""
+        return cls(lex.TokenScanner.from_stream(stream, **kw))
+
+    @classmethod
+    def resume(cls, source, checkpoint, **kw):
+        """Continue scanning from a checkpoint.
+
+        See ``lex.TokenScanner.resume``.
+        """
+        return cls(lex.TokenScanner.resume(source, checkpoint, **kw))
+
+    def checkpoint(self):
+        """Return the state of the scanner after the current token.
+
+        Namespace tokens are generated from the tag that declares them,
+        and no namespace scope is kept between tags, so the state is
+        that of the underlying scanner.  A tag is read ahead of its
+        tokens, so it cannot be checkpointed until its close token.
+        """
+        if self.replaying:
+            raise ValueError('Cannot checkpoint inside a start tag')
+        return self.token_scanner.checkpoint()
+
     def create_generator(self):
         return self.insert_namespace_tokens(self.token_generator)
 
@@ -56,6 +95,7 @@ class NamespaceTokenScanner(lex.SendBasedTokenScanner):
             if isinstance(token, tokens.StartOrEmptyTagOpen):
                 start_token = token.clone(token_stream.get_text(token))
                 cached_tokens = []
+                self.replaying = True
                 token = token_stream.next()
                 while not isinstance(token, tokens.StartOrEmptyTagClose):
                     if isinstance(token, tokens.AttributeName):
@@ -131,6 +171,7 @@ class NamespaceTokenScanner(lex.SendBasedTokenScanner):
                         token = token_stream.next()
                 yield start_token.refine(token)
                 yield from cached_tokens
+                self.replaying = False
             # Standard way to pass tokens through:
             text = yield token
             if text is not None:
@@ -0,0 +1,186 @@
+"""Scan a single file using several processes.
+
+The file is split into byte ranges, one for each worker.  The start of
+each range is moved forward to a ``<`` that looks like the start of a
+start or end tag, and each range is scanned by a ``TokenScanner`` in a
+separate process.
+
+A ``<`` found this way may still be inside a comment, CDATA section,
+processing instruction, or attribute value.  In that case, the scan of
+the previous range ends in the middle of the construct, and generates
+a ``BadlyFormedEndOfStream`` token.  Such ranges are joined to the
+following range and scanned again, until every range ends cleanly.
+"""
+import concurrent.futures
+import functools
+import os
+import re
+
+from minim import iterseq, lex, tokens
+
+# A ``<`` followed by a character that can start a tag
+_tag_start_pattern = re.compile(b'</?[A-Za-z_:\x80-\xff]')
+
+
+def resync(f, offset, block_size=65536):
+    """Return the offset of the first tag start at or after ``offset``.
+
+    :param f: A binary file object that supports ``seek``.
+    :return int: The offset of the ``<``, or the size of the file if no
+        tag starts after ``offset``.
+    """
+    if offset == 0:
+        return 0
+    f.seek(offset)
+    # Keep the last byte of each block, in case it is a ``<``
+    data = f.read(block_size)
+    while data:
+        m = _tag_start_pattern.search(data)
+        if m is not None:
+            return offset + m.start()
+        block = f.read(block_size)
+        if not block:
+            break
+        offset += len(data) - 1
+        data = data[-1:] + block
+    return offset + len(data)
+
+
+class RangeTokenScanner(lex.TokenScanner):
+
+    """Generate tokens for a range of a file.
+
+    Sets ``truncated`` to True if the range ends in the middle of a
+    construct.  Tokens of the class ``hidden`` are not generated, but
+    still set ``truncated``.
+    """
+
+    truncated = None
+    hidden = None
+
+    def create_generator(self):
+        hidden = self.hidden
+        token = None
+        for token in super().create_generator():
+            if token.__class__ is not hidden:
+                yield token
+        self.truncated = token.__class__ is tokens.BadlyFormedEndOfStream
+
+
+def read_range(path, start, end, block_size=65536):
+    """Generate blocks of the bytes in a range of a file.
+
+    The file is closed when the blocks are exhausted, or the generator
+    is closed.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def scan_range(
+        path, start, end, function, encoding='utf-8', block_size=65536,
+        **kw):
+    """Apply a function to a scanner for a range of a file.
+
+    The range is read in blocks, so a worker holds one block of the
+    range at a time, however large the range.  Offsets in the stream
+    are offsets in the file.
+
+    :return tuple: The result of ``function(scanner)``, and whether the
+        range ended in the middle of a construct.
+    """
+    end_class = tokens.BadlyFormedEndOfStream
+    interest = kw.get('interest')
+    hidden = None
+    if interest is not None and not issubclass(end_class, tuple(interest)):
+        # The end of the range is scanned for, but not passed to the
+        # function
+        kw['interest'] = set(interest) | {end_class}
+        hidden = end_class
+    buf = iterseq.BytesAsSequence(
+        read_range(path, start, end, block_size), encoding, start)
+    scanner = RangeTokenScanner(buf, **kw)
+    scanner.hidden = hidden
+    result = function(scanner)
+    # Scan any tokens not read by the function, to find how the range
+    # ends.
+    generator = scanner.generator
+    if generator is None:
+        generator = iter(scanner)
+    for token in generator:
+        pass
+    return result, scanner.truncated
+
+
+def scan_file(
+        path, function, workers=None, reducer=None, encoding='utf-8', **kw):
+    """Apply a function to scanners for ranges of a file in parallel.
+
+    ``function`` is called with a ``TokenScanner`` for each range, in a
+    separate process, so it must be picklable, such as a module-level
+    function.  It should read the tokens of the range, and return a
+    result, such as a count of tags.  If a range must be scanned again,
+    the function is called for the joined range, and the results for
+    the separate ranges are discarded.  A joined range is scanned from
+    its start, so each join scans the earlier ranges again.  In the
+    worst case, where every range ends inside one long construct, the
+    file is scanned about ``workers`` times.
+
+    :param int workers: The number of processes and ranges.  The
+        default is the number of CPUs.
+    :param reducer: A function of two results, used to merge the
+        results of the ranges in order.  If None, a list of the results
+        is returned.
+
+    Other keyword arguments, except ``block_size``, which is the size
+    of the blocks that each range is read in, are passed to the
+    ``TokenScanner`` constructor.  Compressed files cannot be split,
+    and raise ValueError.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with open(path, 'rb') as f:
+        if iterseq.compression(f.read(6)) is not None:
+            raise ValueError('Cannot split a compressed file')
+        size = f.seek(0, os.SEEK_END)
+        starts = sorted({
+            resync(f, size * i // workers) for i in range(workers)})
+    bounds = [start for start in starts if start < size] or [0]
+    bounds.append(size)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        def submit(i):
+            return executor.submit(
+                scan_range, path, bounds[i], bounds[i + 1], function,
+                encoding, **kw)
+        futures = [submit(i) for i in range(len(bounds) - 1)]
+        results = [future.result() for future in futures]
+        while True:
+            # Join each truncated range to the following range
+            bad = {
+                i + 1 for i in range(len(results) - 1) if results[i][1]}
+            if not bad:
+                break
+            joined = []
+            kept = []
+            for i, result in enumerate(results):
+                if i in bad:
+                    if i - 1 not in bad:
+                        joined.append(len(kept) - 1)
+                else:
+                    kept.append(i)
+            bounds = [bounds[i] for i in kept] + [bounds[-1]]
+            results = [results[i] for i in kept]
+            futures = [(i, submit(i)) for i in joined]
+            for i, future in futures:
+                results[i] = future.result()
+    results = [result for result, truncated in results]
+    if reducer is None:
+        return results
+    return functools.reduce(reducer, results)
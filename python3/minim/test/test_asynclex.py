@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+
+from minim import asynclex, lex
+from minim.test import test_lex
+
+
+class AsyncTokenScannerTests(unittest.TestCase):
+
+    xml = test_lex.BytesTokenScannerTests.xml
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def scan(self, scanner):
+        async def token_texts():
+            result = []
+            async for token in scanner:
+                result.append((token, await scanner.get_text(token)))
+            return result
+        return test_lex.merged_texts(
+            self.loop.run_until_complete(token_texts()))
+
+    def test_same_as_sync(self):
+        expected = test_lex.merged_texts(
+            (token, scanner.get_text(token))
+            for scanner in [lex.TokenScanner.from_strings([self.xml])]
+            for token in scanner)
+        for size in (1, 3, 7, 1024):
+            reader = asyncio.StreamReader(loop=self.loop)
+            reader.feed_data(self.xml.encode('utf-8'))
+            reader.feed_eof()
+            scanner = asynclex.AsyncTokenScanner.from_stream(reader, size)
+            self.assertEqual(self.scan(scanner), expected, size)
+
+    def test_waits_for_data(self):
+        reader = asyncio.StreamReader(loop=self.loop)
+        data = self.xml.encode('utf-8')
+
+        def feed(i):
+            if i < len(data):
+                reader.feed_data(data[i:i + 5])
+                self.loop.call_soon(feed, i + 5)
+            else:
+                reader.feed_eof()
+        self.loop.call_soon(feed, 0)
+        scanner = asynclex.AsyncTokenScanner.from_stream(reader)
+        literal = ''.join(literal for cls, literal in self.scan(scanner))
+        self.assertEqual(literal, self.xml)
+
+    def test_bulk_not_supported(self):
+        reader = asyncio.StreamReader(loop=self.loop)
+        with self.assertRaises(ValueError):
+            asynclex.AsyncTokenScanner.from_stream(reader, bulk=True)
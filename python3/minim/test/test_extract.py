@@ -0,0 +1,87 @@
+import io
+import os
+import tempfile
+import unittest
+
+from minim import extract, lex
+
+
+class IterElementsTests(unittest.TestCase):
+
+    records = [
+        '<record n="%d"><name>caf\xe9 %d</name><empty/></record>' % (i, i)
+        for i in range(20)]
+
+    xml = (
+        '<?xml version="1.0"?>\n<doc>\n'
+        '<!-- <record>not a record</record> -->\n'
+        '<records><record/></records>\n' +
+        '\n'.join(records) +
+        '\n<recorder>x</recorder><![CDATA[<record>]]>\n'
+        '<record><record>nested</record></record>\n'
+        '</doc>\n')
+
+    expected = (
+        ['<record/>'] + records +
+        ['<record><record>nested</record></record>'])
+
+    def test_strings(self):
+        for size in (1, 4, 7, len(self.xml)):
+            chunks = [
+                self.xml[i:i + size] for i in range(0, len(self.xml), size)]
+            self.assertEqual(
+                list(extract.iter_elements(chunks, 'record')),
+                self.expected, size)
+
+    def test_bulk(self):
+        self.assertEqual(
+            list(extract.iter_elements([self.xml], 'record', bulk=True)),
+            self.expected)
+
+    def test_stream(self):
+        f = io.BytesIO(self.xml.encode('utf-8'))
+        self.assertEqual(
+            list(extract.iter_elements(f, 'record', block_size=5)),
+            self.expected)
+
+    def test_file_spans(self):
+        data = self.xml.encode('utf-8')
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            for mmap in (False, True):
+                spans = list(extract.iter_elements(
+                    path, 'record', spans=True, mmap=mmap))
+                self.assertEqual(
+                    [data[start:end].decode('utf-8') for start, end in spans],
+                    self.expected)
+        finally:
+            os.unlink(path)
+
+    def test_scanner(self):
+        scanner = lex.TokenScanner.from_strings([self.xml])
+        self.assertEqual(
+            list(extract.iter_elements(scanner, 'name')),
+            ['<name>caf\xe9 %d</name>' % i for i in range(20)])
+        scanner = lex.TokenScanner.from_strings([self.xml])
+        self.assertEqual(
+            [self.xml[start:end] for start, end in extract.iter_elements(
+                scanner, 'name', spans=True)],
+            ['<name>caf\xe9 %d</name>' % i for i in range(20)])
+
+    def test_incomplete(self):
+        self.assertEqual(
+            list(extract.iter_elements(
+                ['<a><record>1</record><record>2</rec'], 'record')),
+            ['<record>1</record>'])
+
+    def test_markup_like_content(self):
+        # ``<?`` without a target and ``<!`` without a comment or CDATA
+        # section are content, so the records in them are found
+        xml = '<r><? <record/> ?><!x <record>1</record>><!-- <record/> --></r>'
+        for size in (1, 2, 3, len(xml)):
+            chunks = [xml[i:i + size] for i in range(0, len(xml), size)]
+            self.assertEqual(
+                list(extract.iter_elements(chunks, 'record')),
+                ['<record/>', '<record>1</record>'], size)
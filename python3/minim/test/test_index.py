@@ -0,0 +1,97 @@
+import io
+import os
+import tempfile
+import unittest
+
+from minim import index, lex, tokens
+
+
+def first_tag(scanner):
+    """Return the name of the first tag generated by a scanner."""
+    for token in scanner:
+        if isinstance(token, tokens.TagName):
+            return scanner.get_text(token).literal()
+
+
+class ElementIndexTests(unittest.TestCase):
+
+    def test_write_read(self):
+        elements = index.ElementIndex()
+        elements.add(0, 0, 'doc')
+        elements.add(5, 1, 'caf\xe9')
+        elements.add(17, 1, 'caf\xe9')
+        f = io.BytesIO()
+        elements.write(f)
+        f.seek(0)
+        loaded = index.ElementIndex.read(f)
+        self.assertEqual(len(loaded), 3)
+        self.assertEqual(list(loaded.offsets), [0, 5, 17])
+        self.assertEqual(list(loaded.depths), [0, 1, 1])
+        self.assertEqual(loaded.name(2), 'caf\xe9')
+        self.assertEqual(list(loaded.find('caf\xe9')), [1, 2])
+        self.assertEqual(list(loaded.find('x')), [])
+
+    def test_empty(self):
+        f = io.BytesIO()
+        index.ElementIndex().write(f)
+        f.seek(0)
+        self.assertEqual(len(index.ElementIndex.read(f)), 0)
+
+    def test_bad_magic(self):
+        with self.assertRaises(ValueError):
+            index.ElementIndex.read(io.BytesIO(b'x' * 24))
+
+
+class BuildTests(unittest.TestCase):
+
+    xml = (
+        '<?xml version="1.0"?>\n<doc>\n' +
+        ''.join(
+            '  <record n="%d"><!-- <skip/> --><name>caf\xe9</name>'
+            '<empty/></record>\n' % i
+            for i in range(30)) +
+        '</doc>\n')
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.xml.encode('utf-8'))
+
+    def tearDown(self):
+        os.unlink(self.path)
+        if os.path.exists(index.index_path(self.path)):
+            os.unlink(index.index_path(self.path))
+
+    def test_build(self):
+        data = self.xml.encode('utf-8')
+        for mmap in (False, True):
+            built = index.build(self.path, mmap=mmap, block_size=7)
+            self.assertEqual(len(built), 1 + 30 * 3)
+            self.assertEqual(built.name(0), 'doc')
+            self.assertEqual(built.depth(0), 0)
+            records = list(built.find('record'))
+            self.assertEqual(len(records), 30)
+            self.assertEqual(list(built.find('empty', depth=1)), [])
+            self.assertEqual(len(list(built.find('empty', depth=2))), 30)
+            for i in range(len(built)):
+                offset = built.offset(i)
+                name = built.name(i).encode('utf-8')
+                self.assertEqual(
+                    data[offset:offset + len(name) + 1], b'<' + name)
+
+    def test_load(self):
+        built = index.build(self.path)
+        loaded = index.load(self.path)
+        self.assertEqual(loaded.offsets, built.offsets)
+        self.assertEqual(loaded.depths, built.depths)
+        self.assertEqual(loaded.name_ids, built.name_ids)
+        self.assertEqual(loaded.names, built.names)
+
+    def test_start(self):
+        built = index.build(self.path)
+        i = list(built.find('record'))[20]
+        for mmap in (False, True):
+            scanner = lex.TokenScanner.from_file(
+                self.path, mmap=mmap, start=built.offset(i), positions=True)
+            self.assertEqual(first_tag(scanner), 'record')
+            self.assertEqual(scanner.span()[0], built.offset(i) + 1)
@@ -153,3 +153,241 @@ class IterableAsSequenceTest(unittest.TestCase):
     def test_starts_with_no_match(self):
         self.assertIs(self.buf.starts_with('ABC'), False)
         self.assertEqual(self.buf.get(), 'H')
+
+
+class SegmentedSequenceTest(unittest.TestCase):
+
+    def test_bridge_copies_only_straddle(self):
+        chunks = ['a' * 1000 + '-', '->' + 'b' * 1000]
+        buf = iterseq.IterableAsSequence(chunks)
+        self.assertEqual(buf.match_to_sentinel('-->'), 1000)
+        self.assertEqual(buf.extract(), 'a' * 1000)
+        self.assertEqual(buf.match_to_sentinel('-->'), 0)
+        self.assertIs(buf.starts_with('-->'), True)
+        self.assertEqual(buf.extract(), '-->')
+        self.assertEqual(buf.match_to_sentinel('<'), 1000)
+        self.assertEqual(buf.extract(), 'b' * 1000)
+        self.assertEqual(buf.copied, 3)
+
+    def test_tell(self):
+        s = 'abc<!--de-->fgh'
+        for size in range(1, len(s)):
+            chunks = [s[i:i + size] for i in range(0, len(s), size)]
+            buf = iterseq.IterableAsSequence(chunks, 10)
+            self.assertEqual(buf.tell(), 10)
+            buf.advance(3)
+            self.assertEqual(buf.tell(), 13)
+            self.assertIs(buf.starts_with('<!--'), True)
+            self.assertEqual(buf.tell(), 17)
+            buf.advance(5)
+            self.assertEqual(buf.tell(), 22)
+            self.assertEqual(buf.get(), 'f')
+            self.assertEqual(buf.next(), 'g')
+            self.assertEqual(buf.tell(), 23)
+
+    def test_chunk_reused(self):
+        chunks = ['<!-', '-abc-->']
+        buf = iterseq.IterableAsSequence(chunks)
+        self.assertIs(buf.starts_with('<!--'), True)
+        self.assertEqual(buf.get(), 'a')
+        self.assertIs(buf.extent()[0], chunks[1])
+
+    def test_bridge_over_small_chunks(self):
+        s = '<![CDATA[x]]>'
+        for size in range(1, len(s)):
+            chunks = [s[i:i + size] for i in range(0, len(s), size)]
+            buf = iterseq.IterableAsSequence(chunks)
+            self.assertIs(buf.starts_with('<![CDATA['), True)
+            self.assertEqual(buf.extract(), '<![CDATA[')
+            content = ''
+            while True:
+                result = buf.match_to_sentinel(']]>')
+                content += buf.extract()
+                if result <= 0:
+                    break
+            self.assertEqual(content, 'x')
+            self.assertIs(buf.starts_with(']]>'), True)
+            self.assertEqual(buf.get(), '')
+            self.assertLess(buf.copied, 2 * len(s))
+
+    def test_lookahead(self):
+        tag = re.compile(r'<a x="[^"]*">')
+        chunks = iter(['<a', ' x="1', '>', '"', '>b', 'cd>'])
+        buf = iterseq.IterableAsSequence(chunks)
+        self.assertEqual(buf.lookahead(tag, 100), ('<a x="1>">', 0))
+        # No chunk is read after the chunk that completes the match
+        self.assertEqual(next(chunks), 'cd>')
+        buf = iterseq.IterableAsSequence(['<a', ' x="1', '">'])
+        self.assertEqual(buf.lookahead(tag, 4), ('<a x', 0))
+        buf = iterseq.IterableAsSequence(['<a', ' x'])
+        self.assertEqual(buf.lookahead(tag, 100), ('<a x', 0))
+
+
+class BytesAsSequenceTest(unittest.TestCase):
+
+    def test_get_is_character(self):
+        buf = iterseq.BytesAsSequence([b'<a', b'>'])
+        self.assertEqual(buf.get(), '<')
+        self.assertEqual(buf.next(), 'a')
+        self.assertEqual(buf.next(), '>')
+        self.assertEqual(buf.next(), '')
+
+    def test_empty_get(self):
+        buf = iterseq.BytesAsSequence([])
+        self.assertIs(buf.get(), None)
+
+    def test_extract_is_bytes(self):
+        buf = iterseq.BytesAsSequence([b'Hello, ', b'World!'])
+        self.assertLess(buf.match_to_sentinel(','), 0)
+        self.assertEqual(buf.extract(), b'Hello')
+        self.assertIs(buf.starts_with(', W'), True)
+        self.assertEqual(buf.extract(), b', W')
+
+    def test_encoding(self):
+        self.assertIs(iterseq.IterableAsSequence(['a']).encoding, None)
+        buf = iterseq.BytesAsSequence([b'a'], encoding='latin-1')
+        self.assertEqual(buf.encoding, 'latin-1')
+
+    def test_characters_not_split(self):
+        data = 'aé€\U0001f600b'.encode('utf-8')
+        for size in range(1, len(data)):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            buf = iterseq.BytesAsSequence(chunks)
+            buf.matching(re.compile(b'a'))
+            while buf.match_to_sentinel('b') > 0:
+                # Every chunk of content can be decoded separately
+                buf.extract().decode('utf-8')
+            buf.extract().decode('utf-8')
+            self.assertEqual(buf.get(), 'b')
+
+    def test_memoryview_chunks(self):
+        data = bytearray(b'<tag>')
+        buf = iterseq.BytesAsSequence([memoryview(data)])
+        self.assertIs(buf.starts_with('<tag'), True)
+        data[:] = b'xxxxx'
+        self.assertEqual(buf.extract(), b'<tag')
+
+
+class ReadBlocksTest(unittest.TestCase):
+
+    def test_read_blocks(self):
+        with tempfile.TemporaryFile('w+b') as f:
+            f.write(b'0123456789')
+            f.seek(0)
+            blocks = list(iterseq.read_blocks(f, 4))
+        self.assertEqual(blocks, [b'0123', b'4567', b'89'])
+
+    def test_read_text_blocks(self):
+        with tempfile.TemporaryFile('w+t') as f:
+            f.write('01234\n6789')
+            f.seek(0)
+            blocks = list(iterseq.read_blocks(f, 4))
+        self.assertEqual(blocks, ['0123', '4\n67', '89'])
+
+    def test_compression(self):
+        import bz2
+        import gzip
+        import lzma
+        data = b'<doc>' + b'<a/>' * 1000 + b'</doc>'
+        self.assertIs(iterseq.compression(data), None)
+        for module, name in ((gzip, 'gzip'), (bz2, 'bz2'), (lzma, 'xz')):
+            compressed = module.compress(data)
+            self.assertEqual(iterseq.compression(compressed[:6]), name)
+            with tempfile.NamedTemporaryFile('w+b') as f:
+                f.write(compressed)
+                f.flush()
+                blocks = list(iterseq.read_file(f.name, 1000))
+            self.assertEqual(b''.join(blocks), data)
+            self.assertEqual(len(blocks[0]), 1000)
+
+    def test_decompressed_unchanged(self):
+        import io
+        f = io.BytesIO(b'<doc/>')
+        self.assertIs(iterseq.decompressed(f), f)
+        self.assertEqual(f.read(), b'<doc/>')
+
+
+class FeedSequenceTest(unittest.TestCase):
+
+    def test_need_data(self):
+        buf = iterseq.FeedSequence()
+        with self.assertRaises(iterseq.NeedData):
+            buf.get()
+        buf.feed('<!-')
+        self.assertEqual(buf.get(), '<')
+        with self.assertRaises(iterseq.NeedData):
+            buf.starts_with('<!--')
+        self.assertEqual(buf.get(), '<')
+        buf.feed('-x')
+        self.assertIs(buf.starts_with('<!--'), True)
+        self.assertEqual(buf.get(), 'x')
+        buf.advance()
+        with self.assertRaises(iterseq.NeedData):
+            buf.get()
+
+    def test_close(self):
+        buf = iterseq.FeedSequence()
+        buf.feed('a-')
+        with self.assertRaises(iterseq.NeedData):
+            buf.match_to_sentinel('-->')
+        buf.feed('b-')
+        self.assertEqual(buf.match_to_sentinel('-->'), 3)
+        self.assertEqual(buf.extract(), 'a-b')
+        with self.assertRaises(iterseq.NeedData):
+            buf.match_to_sentinel('-->')
+        self.assertEqual(
+            buf.lookahead(re.compile('.*-->'), 100), ('b-', 1))
+        buf.close()
+        self.assertEqual(buf.match_to_sentinel('-->'), -1)
+        self.assertEqual(buf.extract(), '-')
+        self.assertEqual(buf.get(), '')
+        with self.assertRaises(ValueError):
+            buf.feed('b')
+
+    def test_bytes_split_character(self):
+        buf = iterseq.BytesFeedSequence()
+        buf.feed(b'\xc3')
+        with self.assertRaises(iterseq.NeedData):
+            buf.get()
+        buf.feed(b'\xa9<')
+        self.assertEqual(buf.match_to_sentinel('<'), -2)
+        self.assertEqual(buf.extract(), b'\xc3\xa9')
+
+
+class BufferAsSequenceTest(unittest.TestCase):
+
+    def test_matching_is_final(self):
+        buf = iterseq.BufferAsSequence(b'name')
+        self.assertEqual(buf.matching(re.compile(b'[a-z]+')), -4)
+        self.assertEqual(buf.extract(), b'name')
+        self.assertEqual(buf.get(), '')
+
+    def test_match_to_sentinel(self):
+        buf = iterseq.BufferAsSequence(b'text<tag>more')
+        self.assertEqual(buf.match_to_sentinel('<'), -4)
+        self.assertEqual(buf.extract(), b'text')
+        self.assertEqual(buf.match_to_sentinel('<'), 0)
+        self.assertIs(buf.starts_with('<tag>'), True)
+        self.assertEqual(buf.extract(), b'<tag>')
+        self.assertEqual(buf.match_to_sentinel('<'), -4)
+        self.assertEqual(buf.extract(), b'more')
+        self.assertEqual(buf.match_to_sentinel('<'), 0)
+
+    def test_starts_with_past_end(self):
+        buf = iterseq.BufferAsSequence(b'<!-')
+        self.assertIs(buf.starts_with('<!--'), False)
+        self.assertEqual(buf.get(), '<')
+
+    def test_map_file(self):
+        with tempfile.NamedTemporaryFile('w+b') as f:
+            f.write(b'<a>b</a>')
+            f.flush()
+            buf = iterseq.BufferAsSequence(iterseq.map_file(f.name))
+            self.assertIs(buf.starts_with('<a>'), True)
+            self.assertEqual(buf.match_to_sentinel('<'), -1)
+            self.assertEqual(buf.extract(), b'b')
+
+    def test_map_empty_file(self):
+        with tempfile.NamedTemporaryFile('w+b') as f:
+            buf = iterseq.BufferAsSequence(iterseq.map_file(f.name))
+            self.assertEqual(buf.get(), '')
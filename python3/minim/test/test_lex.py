@@ -1,3 +1,4 @@
+import io
 import unittest
 
 from minim import iterseq, lex, tokens
@@ -691,3 +692,1020 @@ class TestRead(unittest.TestCase):
                 text = token_stream.get_text(token, holder)
                 result.append(text.content())
         self.assertEqual(''.join(string_iter), ''.join(result))
+
+
+class BulkTokenScannerTests(unittest.TestCase):
+
+    """Test that the bulk engine generates the same tokens as the
+    character-based engine."""
+
+    documents = [
+        '',
+        '   ',
+        'no markup',
+        '  <?xml version="1.0"?>\n<doc>\n  <a x="1" y = \'2\'/>\n</doc>\n',
+        '<tag foo="bar" baz=\'\' flag  other>text &amp; more</tag >',
+        '<tag\tfoo="bar"\n\t/>',
+        '<a>\n  <b>one</b>\n  <c attr="a>b"/>\n</a>',
+        "<!-- Lot's of text, including technically invalid -- -->",
+        '<!----><![CDATA[]]><![CDATA[Some <non-markup> text]]>',
+        '<?pi?><?pi  data?><?pi ?>',
+        '</ns:tag>',
+        '<-- hello --><??>',
+        '</',
+        '<tag',
+        '<tag foo="bar" /',
+        '<![CDATA[Some <non-markup> text & []',
+        '<!-- comment ',
+        '<?xml vers?',
+        'text<',
+        '<tag foo="value"bar="value">',
+        '<tag foo=>',
+        ]
+
+    def tokens(self, xml, chunk_size, bulk):
+        chunks = [
+            xml[i:i + chunk_size] for i in range(0, len(xml), chunk_size)]
+        scanner = lex.TokenScanner.from_strings(chunks, bulk=bulk)
+        result = []
+        try:
+            for token in scanner:
+                text = scanner.get_text(token)
+                result.append((
+                    token.__class__, text.literal(), text.is_initial,
+                    text.is_final))
+        except Exception as e:
+            result.append(e.__class__)
+        return result
+
+    def test_same_tokens(self):
+        for xml in self.documents:
+            for chunk_size in (1, 2, 3, 5, 7, 13, len(xml) or 1):
+                self.assertEqual(
+                    self.tokens(xml, chunk_size, True),
+                    self.tokens(xml, chunk_size, False),
+                    (xml, chunk_size))
+
+    def test_literal_ok(self):
+        xml = [
+            '<?xml version="1.0"?><some tags="',
+            'foo">This <!-- a comment -->is',
+            'some </s',
+            'ome>text'
+            ]
+        scanner = lex.TokenScanner.from_strings(xml, bulk=True)
+        literal = ''
+        for token in scanner:
+            literal += scanner.get_text(token).literal()
+        self.assertEqual(literal, ''.join(xml))
+
+
+class TokenBatchTests(unittest.TestCase):
+
+    xml = [
+        '<?xml version="1.0"?><some tags="',
+        'foo">This <!-- a comment -->is',
+        'some </s',
+        'ome>text<!x'
+        ]
+
+    def test_batches_match_tokens(self):
+        expected = []
+        scanner = lex.TokenScanner.from_strings(self.xml)
+        for token in scanner:
+            text = scanner.get_text(token)
+            expected.append((token.kind, text.literal()))
+        for bulk in (False, True):
+            scanner = lex.TokenScanner.from_strings(self.xml, bulk=bulk)
+            result = []
+            for batch in scanner.iter_batches(3):
+                self.assertLessEqual(len(batch), 3)
+                for i in range(len(batch)):
+                    result.append((batch.kinds[i], batch.text(i)))
+            self.assertEqual(result, expected)
+
+    def test_batch_offsets_share_buffer(self):
+        scanner = lex.TokenScanner.from_strings(self.xml)
+        for batch in scanner.iter_batches():
+            for i in range(len(batch)):
+                if batch.starts[i] >= 0:
+                    self.assertLessEqual(batch.ends[i], len(batch.buffer))
+                else:
+                    self.assertIn(i, batch.literals)
+
+    def test_count_kind(self):
+        xml = ['<a><b/>', '<c x="1">', 'text</c></a>']
+        scanner = lex.TokenScanner.from_strings(xml, bulk=True)
+        start = tokens.StartTagOpen.kind
+        empty = tokens.EmptyTagOpen.kind
+        starts = empties = 0
+        for batch in scanner.iter_batches():
+            starts += batch.kinds.count(start)
+            empties += batch.kinds.count(empty)
+        self.assertEqual((starts, empties), (2, 1))
+
+    def test_read_batch_empty_at_end(self):
+        scanner = lex.TokenScanner.from_strings(['<a/>'])
+        self.assertEqual(len(scanner.read_batch(10)), 3)
+        self.assertEqual(len(scanner.read_batch(10)), 0)
+
+    def test_dispatch_kinds(self):
+        table = tokens.dispatch_table(
+            {tokens.StartOrEmptyTagOpen: 'open'}, default='other')
+        scanner = lex.TokenScanner.from_strings(['<a><b/>text</a>'])
+        handlers = []
+        for batch in scanner.iter_batches():
+            handlers.extend(table[kind] for kind in batch.kinds)
+        self.assertEqual(handlers.count('open'), 2)
+        self.assertEqual(len(handlers), 10)
+
+
+def merged_tokens(scanner):
+    """Return token classes and literals, joining split text.
+
+    Whether a start tag is refined depends on where the buffers end, so
+    ambiguous start tags are refined using their close token.
+    """
+    return merged_texts(
+        (token, scanner.get_text(token)) for token in scanner)
+
+
+def merged_texts(token_texts, result=None):
+    """Return token classes and literals for (token, text) pairs."""
+    if result is None:
+        result = []
+    literal = None
+    tag_open = None
+    for token, text in token_texts:
+        if text.is_initial:
+            literal = text.literal()
+        else:
+            literal += text.literal()
+        if text.is_final:
+            if token.__class__ is tokens.StartOrEmptyTagOpen:
+                tag_open = len(result)
+            elif (isinstance(token, tokens.StartOrEmptyTagClose) and
+                    tag_open is not None):
+                result[tag_open] = (
+                    token.get_tag_open_class(), result[tag_open][1])
+                tag_open = None
+            result.append((token.__class__, literal))
+    return result
+
+
+class BytesTokenScannerTests(unittest.TestCase):
+
+    xml = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<café näme="€1" x=\'\U0001f600\'>\n'
+        '  <!-- été --><![CDATA[<é>]]>text &amp; é'
+        '</café>'
+        )
+
+    def test_same_as_text(self):
+        expected = merged_tokens(
+            lex.TokenScanner.from_strings([self.xml]))
+        data = self.xml.encode('utf-8')
+        for bulk in (False, True):
+            for size in (1, 2, 3, 7, len(data)):
+                chunks = [
+                    data[i:i + size] for i in range(0, len(data), size)]
+                scanner = lex.TokenScanner.from_bytes(chunks, bulk=bulk)
+                self.assertEqual(
+                    merged_tokens(scanner), expected, (bulk, size))
+
+    def test_text_is_lazily_decoded(self):
+        scanner = lex.TokenScanner.from_bytes([b'<a>\xc3\xa9</a>'])
+        for token in scanner:
+            if isinstance(token, tokens.PCData):
+                text = scanner.get_text(token)
+                self.assertEqual(text.encoded, b'\xc3\xa9')
+                self.assertEqual(text.encoding, 'utf-8')
+                self.assertEqual(text.literal_bytes('utf-8'), b'\xc3\xa9')
+                self.assertEqual(text.literal(), 'é')
+
+    def test_binary_stream(self):
+        import io
+        f = io.BytesIO(self.xml.encode('utf-8'))
+        scanner = lex.TokenScanner.from_bytes(f, bulk=True)
+        literal = ''.join(
+            scanner.get_text(token).literal() for token in scanner)
+        self.assertEqual(literal, self.xml)
+
+    def test_batch_text_is_decoded(self):
+        scanner = lex.TokenScanner.from_bytes([b'<a>\xc3\xa9</a>'])
+        batch = scanner.read_batch(10)
+        self.assertEqual(batch.encoding, 'utf-8')
+        self.assertEqual(
+            [batch.text(i) for i in range(len(batch))],
+            ['<', 'a', '>', 'é', '</', 'a', '>'])
+
+
+class FileTokenScannerTests(unittest.TestCase):
+
+    xml = BytesTokenScannerTests.xml
+
+    def test_from_file(self):
+        import tempfile
+        expected = merged_tokens(lex.TokenScanner.from_strings([self.xml]))
+        with tempfile.NamedTemporaryFile('w+b') as f:
+            f.write(self.xml.encode('utf-8'))
+            f.flush()
+            for mmap in (False, True):
+                for bulk in (False, True):
+                    scanner = lex.TokenScanner.from_file(
+                        f.name, mmap=mmap, bulk=bulk)
+                    self.assertEqual(
+                        merged_tokens(scanner), expected, (mmap, bulk))
+
+    def test_mmap_tokens_are_whole(self):
+        import tempfile
+        with tempfile.NamedTemporaryFile('w+b') as f:
+            f.write(self.xml.encode('utf-8'))
+            f.flush()
+            scanner = lex.TokenScanner.from_file(f.name, mmap=True)
+            for token in scanner:
+                text = scanner.get_text(token)
+                self.assertIs(text.is_initial, True)
+                self.assertIs(text.is_final, True)
+
+
+class StreamTokenScannerTests(unittest.TestCase):
+
+    xml = BytesTokenScannerTests.xml
+
+    def test_text_stream(self):
+        import io
+        expected = merged_tokens(lex.TokenScanner.from_strings([self.xml]))
+        scanner = lex.TokenScanner.from_stream(io.StringIO(self.xml), 16)
+        self.assertEqual(merged_tokens(scanner), expected)
+
+    def test_binary_stream(self):
+        import io
+        expected = merged_tokens(lex.TokenScanner.from_strings([self.xml]))
+        data = self.xml.encode('utf-8')
+        scanner = lex.TokenScanner.from_stream(io.BytesIO(data), 16)
+        self.assertEqual(merged_tokens(scanner), expected)
+
+    def test_compressed_stream(self):
+        import gzip
+        import io
+        expected = merged_tokens(lex.TokenScanner.from_strings([self.xml]))
+        data = gzip.compress(self.xml.encode('utf-8'))
+        scanner = lex.TokenScanner.from_stream(io.BytesIO(data), bulk=True)
+        self.assertEqual(merged_tokens(scanner), expected)
+
+    def test_compressed_file(self):
+        import bz2
+        import tempfile
+        expected = merged_tokens(lex.TokenScanner.from_strings([self.xml]))
+        with tempfile.NamedTemporaryFile('w+b') as f:
+            f.write(bz2.compress(self.xml.encode('utf-8')))
+            f.flush()
+            for mmap in (False, True):
+                scanner = lex.TokenScanner.from_file(
+                    f.name, mmap=mmap, block_size=16)
+                self.assertEqual(merged_tokens(scanner), expected)
+
+
+class FeedTokenScannerTests(unittest.TestCase):
+
+    documents = BulkTokenScannerTests.documents + [
+        BytesTokenScannerTests.xml]
+
+    def pulled(self, xml):
+        result = []
+        try:
+            merged_texts(
+                ((token, scanner.get_text(token))
+                    for scanner in [lex.TokenScanner.from_strings([xml])]
+                    for token in scanner),
+                result)
+        except Exception as e:
+            result.append(e.__class__)
+        return result
+
+    def fed(self, chunks, encoding=None):
+        scanner = lex.TokenScanner.from_feed(encoding)
+        fed = []
+        try:
+            for chunk in chunks:
+                fed.extend(scanner.feed(chunk))
+            fed.extend(scanner.close())
+        except Exception as e:
+            return merged_texts(
+                (token, token.text) for token in fed) + [e.__class__]
+        return merged_texts((token, token.text) for token in fed)
+
+    def test_same_as_pulled(self):
+        for xml in self.documents:
+            expected = self.pulled(xml)
+            for size in (1, 2, 3, 7, len(xml) or 1):
+                chunks = [xml[i:i + size] for i in range(0, len(xml), size)]
+                fed = self.fed(chunks)
+                if expected and isinstance(expected[-1], type):
+                    # The tokens of the failing feed are not returned
+                    self.assertEqual(fed[-1], expected[-1], (xml, size))
+                else:
+                    self.assertEqual(fed, expected, (xml, size))
+
+    def test_bytes(self):
+        xml = BytesTokenScannerTests.xml
+        expected = self.pulled(xml)
+        data = xml.encode('utf-8')
+        for size in (1, 2, 3, 7):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertEqual(self.fed(chunks, 'utf-8'), expected, size)
+
+    def test_tokens_before_close(self):
+        scanner = lex.TokenScanner.from_feed()
+        fed = scanner.feed('<a x')
+        self.assertEqual(
+            [token.__class__ for token in fed], [
+                tokens.StartOrEmptyTagOpen, tokens.TagName,
+                tokens.MarkupWhitespace, tokens.AttributeName,
+                ])
+        self.assertIs(fed[-1].text.is_final, False)
+        fed = scanner.feed('="1">te')
+        self.assertEqual(
+            [token.__class__ for token in fed], [
+                tokens.AttributeName,
+                tokens.AttributeEquals, tokens.AttributeValueDoubleOpen,
+                tokens.AttributeValue, tokens.AttributeValueDoubleClose,
+                tokens.StartTagClose, tokens.PCData,
+                ])
+        self.assertEqual(fed[-1].text.literal(), 'te')
+        self.assertIs(fed[-1].text.is_final, False)
+        fed = scanner.feed('xt</a>')
+        self.assertEqual(
+            [token.__class__ for token in fed], [
+                tokens.PCData, tokens.EndTagOpen, tokens.TagName,
+                tokens.EndTagClose,
+                ])
+        self.assertEqual(fed[0].text.literal(), 'xt')
+        self.assertIs(fed[0].text.is_initial, False)
+        self.assertEqual(scanner.close(), [])
+
+    def test_feed_after_close(self):
+        scanner = lex.TokenScanner.from_feed()
+        scanner.feed('<a/>')
+        scanner.close()
+        with self.assertRaises(ValueError):
+            scanner.feed('<b/>')
+
+    def test_bulk_not_fed(self):
+        with self.assertRaises(ValueError):
+            lex.TokenScanner.from_feed(bulk=True)
+
+
+class CheckpointTests(unittest.TestCase):
+
+    documents = [
+        xml for xml in BulkTokenScannerTests.documents
+        if not xml.startswith(('<tag foo=', '</'))] + [
+        BytesTokenScannerTests.xml]
+
+    def remaining(self, scanner):
+        """Return token classes and literals, joining split text."""
+        result = []
+        for token in scanner:
+            text = scanner.get_text(token)
+            if text.is_initial or not result:
+                result.append([token.__class__, text.literal()])
+            else:
+                result[-1][1] += text.literal()
+        # Whether a start tag is refined depends on the buffers
+        return [
+            (tokens.StartOrEmptyTagOpen if issubclass(
+                cls, tokens.StartOrEmptyTagOpen) else cls, literal)
+            for cls, literal in result]
+
+    def test_resume_after_each_token(self):
+        import io
+        import json
+        for xml in self.documents:
+            full = self.remaining(lex.TokenScanner.from_strings([xml]))
+            for size in (2, 7):
+                chunks = [xml[i:i + size] for i in range(0, len(xml), size)]
+                scanner = lex.TokenScanner.from_strings(chunks)
+                literal = ''
+                count = 0
+                for token in scanner:
+                    text = scanner.get_text(token)
+                    literal += text.literal()
+                    count += text.is_final
+                    try:
+                        checkpoint = scanner.checkpoint()
+                    except ValueError:
+                        continue
+                    checkpoint = json.loads(json.dumps(checkpoint))
+                    if checkpoint['state'] != lex.LITERAL:
+                        self.assertEqual(checkpoint['offset'], len(literal))
+                    resumed = lex.TokenScanner.resume(
+                        io.StringIO(xml), checkpoint)
+                    rest = self.remaining(resumed)
+                    self.assertEqual(
+                        ''.join(literal for cls, literal in rest),
+                        xml[len(literal):], (xml, size, checkpoint))
+                    split = checkpoint['state'] in (
+                        lex.RUN_PATTERN, lex.RUN_SENTINEL) and not (
+                        checkpoint['initial'])
+                    if not split:
+                        self.assertEqual(rest, full[count:], (xml, checkpoint))
+
+    def test_resume_file(self):
+        import tempfile
+        data = BytesTokenScannerTests.xml.encode('utf-8')
+        with tempfile.NamedTemporaryFile('w+b') as f:
+            f.write(data)
+            f.flush()
+            scanner = lex.TokenScanner.from_file(f.name, block_size=5)
+            checkpoints = []
+            for token in scanner:
+                if isinstance(token, tokens.StartOrEmptyTagClose):
+                    checkpoints.append(scanner.checkpoint())
+            self.assertEqual(len(checkpoints), 1)
+            checkpoint = checkpoints[0]
+            resumed = lex.TokenScanner.resume(f.name, checkpoint)
+            literal = b''.join(
+                resumed.get_text(token).literal_bytes('utf-8')
+                for token in resumed)
+            self.assertEqual(literal, data[checkpoint['offset']:])
+            self.assertEqual(resumed.checkpoint()['offset'], len(data))
+
+    def test_resume_at_end_inside_tag(self):
+        import io
+        xml = '<a b="1" '
+        scanner = lex.TokenScanner.from_strings([xml[:3], xml[3:]])
+        for token in scanner:
+            if isinstance(token, tokens.MarkupWhitespace):
+                checkpoint = scanner.checkpoint()
+                if checkpoint['offset'] == len(xml):
+                    break
+        self.assertEqual(checkpoint['state'], lex.RUN_PATTERN)
+        self.assertEqual(checkpoint['run_next'], lex.TAG_SPACE_END)
+        resumed = lex.TokenScanner.resume(io.StringIO(xml), checkpoint)
+        self.assertEqual(
+            [token.__class__ for token in resumed],
+            [tokens.MarkupWhitespace, tokens.BadlyFormedEndOfStream])
+
+    def test_inside_whole_start_tag(self):
+        scanner = lex.TokenScanner.from_strings(['<a x="1"/>'])
+        tokens_iter = iter(scanner)
+        next(tokens_iter)
+        with self.assertRaises(ValueError):
+            scanner.checkpoint()
+
+    def test_bulk(self):
+        scanner = lex.TokenScanner.from_strings(['<a/>'], bulk=True)
+        with self.assertRaises(ValueError):
+            scanner.checkpoint()
+
+
+class PositionTests(unittest.TestCase):
+
+    documents = CheckpointTests.documents + [
+        '<a>\n<b x="1\n2"\n/>\n<!--\n\n-->\r\n</a>\n']
+
+    def expected_location(self, xml, offset):
+        line_start = xml.rfind('\n', 0, offset) + 1
+        return xml.count('\n', 0, offset) + 1, offset - line_start
+
+    def check(self, scanner, xml):
+        end = 0
+        for token in scanner:
+            start, end = scanner.span()
+            self.assertEqual(
+                scanner.get_text(token).literal(), xml[start:end])
+            self.assertEqual(
+                scanner.location(), self.expected_location(xml, start))
+        self.assertEqual(end, len(xml))
+
+    def test_positions(self):
+        for xml in self.documents:
+            for bulk in (False, True):
+                for size in (1, 3, 7, len(xml) or 1):
+                    chunks = [
+                        xml[i:i + size] for i in range(0, len(xml), size)]
+                    self.check(
+                        lex.TokenScanner.from_strings(
+                            chunks, bulk=bulk, positions=True),
+                        xml)
+
+    def test_shared_chunks(self):
+        # Blank lines are read as the same 1-character string
+        xml = '<a>\n\n\n\n<b/>\n</a>'
+        self.check(
+            lex.TokenScanner.from_strings(io.StringIO(xml), positions=True),
+            xml)
+
+    def test_sparse_locations(self):
+        xml = self.documents[-1] * 20
+        scanner = lex.TokenScanner.from_strings(
+            [xml[i:i + 5] for i in range(0, len(xml), 5)], positions=True)
+        for token in scanner:
+            if isinstance(token, tokens.EndTagClose):
+                start, end = scanner.span()
+                self.assertEqual(
+                    scanner.location(), self.expected_location(xml, start))
+
+    def test_bytes_offsets(self):
+        import tempfile
+        xml = BytesTokenScannerTests.xml
+        data = xml.encode('utf-8')
+        with tempfile.NamedTemporaryFile('w+b') as f:
+            f.write(data)
+            f.flush()
+            for mmap in (False, True):
+                scanner = lex.TokenScanner.from_file(
+                    f.name, mmap=mmap, block_size=5, positions=True)
+                for token in scanner:
+                    start, end = scanner.span()
+                    self.assertEqual(
+                        scanner.get_text(token).literal_bytes('utf-8'),
+                        data[start:end])
+                    line, column = scanner.location()
+                    self.assertEqual(line, data.count(b'\n', 0, start) + 1)
+                self.assertEqual(end, len(data))
+
+    def test_positions_off(self):
+        scanner = lex.TokenScanner.from_strings(['<a/>'])
+        for token in scanner:
+            with self.assertRaises(ValueError):
+                scanner.span()
+
+
+class SpanTextHolderTests(unittest.TestCase):
+
+    def test_span_holder(self):
+        xml = '<a x="1">hello<!--c--></a>'
+        scanner = lex.TokenScanner.from_strings([xml])
+        expected = [scanner.get_text(token).literal() for token in scanner]
+        for bulk in (False, True):
+            scanner = lex.TokenScanner.from_strings([xml], bulk=bulk)
+            holder = tokens.SpanTextHolder()
+            literals = []
+            for token in scanner:
+                text = scanner.get_text(token, holder)
+                if text is holder:
+                    self.assertIsNotNone(holder.buffer)
+                literals.append(text.literal())
+            self.assertEqual(literals, expected)
+
+
+class InterestTokenScannerTests(unittest.TestCase):
+
+    """Test that scanning with an interest generates the tokens of
+    interest from the full token stream."""
+
+    documents = [
+        '',
+        'no markup',
+        '  <?xml version="1.0"?>\n<doc>\n  <a x="1" y = \'2\'/>\n</doc >\n',
+        '<a>\n  <b>one</b>\n  <c attr="a>b" other=\'/>\'/>\n</a>',
+        '<a><!-- <b> --> --><!----><b/></a>',
+        '<a><![CDATA[<b attr="x">]]><b/></a>',
+        '<a><?pi <b>?><?pi?>text<b/>more</a>',
+        '<a><b',
+        '<a x="1><b/>',
+        '<a><!-- <b/>',
+        '<a x="1"/',
+        '<a><b/',
+        ]
+
+    interests = [
+        {tokens.StartOrEmptyTagOpen},
+        {tokens.StartOrEmptyTagOpen, tokens.TagName},
+        {tokens.TagName},
+        {tokens.EndTagOpen, tokens.TagName, tokens.EndTagClose},
+        {tokens.StartTagClose, tokens.EmptyTagClose},
+        {tokens.AttributeValue},
+        {tokens.PCData},
+        {tokens.CommentData, tokens.CData},
+        {tokens.ProcessingInstructionData},
+        {tokens.MarkupWhitespace},
+        {tokens.BadlyFormedEndOfStream},
+        ]
+
+    def check(self, source, interest):
+        # Without the close tokens, an ambiguous start tag cannot be
+        # refined, so compare all start tags as ambiguous.
+        def unrefined(token_list):
+            return [
+                (tokens.StartOrEmptyTagOpen, literal)
+                if issubclass(cls, tokens.StartOrEmptyTagOpen) else
+                (cls, literal) for cls, literal in token_list]
+        interest = tuple(interest)
+        expected = [
+            token for token in merged_tokens(source(None))
+            if issubclass(token[0], interest)]
+        self.assertEqual(
+            unrefined(merged_tokens(source(interest))), unrefined(expected))
+
+    def test_refined(self):
+        xml = '<a><b/></a>'
+        interest = {tokens.StartTagOpen, tokens.EmptyTagOpen}
+        scanner = lex.TokenScanner.from_strings([xml], interest=interest)
+        self.assertEqual(
+            [token.__class__ for token in scanner],
+            [tokens.StartTagOpen, tokens.EmptyTagOpen])
+
+    def test_same_tokens(self):
+        for xml in self.documents:
+            for chunk_size in (1, 2, 3, 5, 7, 13, len(xml) or 1):
+                chunks = [
+                    xml[i:i + chunk_size]
+                    for i in range(0, len(xml), chunk_size)]
+                for interest in self.interests:
+                    with self.subTest(
+                            xml=xml, chunk_size=chunk_size,
+                            interest=interest):
+                        self.check(
+                            lambda interest: lex.TokenScanner.from_strings(
+                                chunks, interest=interest),
+                            interest)
+
+    def test_bytes(self):
+        xml = BytesTokenScannerTests.xml.encode('utf-8')
+        for chunk_size in (5, 64):
+            chunks = [
+                xml[i:i + chunk_size] for i in range(0, len(xml), chunk_size)]
+            for interest in self.interests:
+                self.check(
+                    lambda interest: lex.TokenScanner.from_bytes(
+                        chunks, interest=interest),
+                    interest)
+
+
+class StartTagSpeculationTests(unittest.TestCase):
+
+    def classes(self, chunks):
+        scanner = lex.TokenScanner.from_strings(chunks)
+        return [token.__class__ for token in scanner]
+
+    def test_whole_tag_refined(self):
+        self.assertEqual(
+            self.classes(['<a x="1" y=\'>\'>', '<b/>']), [
+                tokens.StartTagOpen, tokens.TagName, tokens.MarkupWhitespace,
+                tokens.AttributeName, tokens.AttributeEquals,
+                tokens.AttributeValueDoubleOpen, tokens.AttributeValue,
+                tokens.AttributeValueDoubleClose, tokens.MarkupWhitespace,
+                tokens.AttributeName, tokens.AttributeEquals,
+                tokens.AttributeValueSingleOpen, tokens.AttributeValue,
+                tokens.AttributeValueSingleClose, tokens.StartTagClose,
+                tokens.EmptyTagOpen, tokens.TagName, tokens.EmptyTagClose,
+                ])
+
+    def test_split_tag_ambiguous(self):
+        self.assertEqual(
+            self.classes(['<a x=', '"1">']), [
+                tokens.StartOrEmptyTagOpen, tokens.TagName,
+                tokens.MarkupWhitespace, tokens.AttributeName,
+                tokens.AttributeEquals, tokens.AttributeValueDoubleOpen,
+                tokens.AttributeValue, tokens.AttributeValueDoubleClose,
+                tokens.StartTagClose,
+                ])
+
+    def test_malformed_tag_falls_back(self):
+        with self.assertRaises(RuntimeError):
+            self.classes(['<a x=>'])
+
+
+class IterTagsTests(unittest.TestCase):
+
+    xml = (
+        '<?xml version="1.0"?>\n<doc a="1" b=\'x > y\' c d = "">\n'
+        '<!-- <no/> --><![CDATA[<no/>]]>caf\xe9 &amp; <?pi <no/>?>\n'
+        '<r n="caf\xe9"/><long-name-here attr-name="long value here">'
+        'text</long-name-here >\n</doc>\n')
+
+    expected = [
+        ('start', 'doc', {'a': '1', 'b': 'x > y', 'c': None, 'd': ''}),
+        ('empty', 'r', {'n': 'caf\xe9'}),
+        ('start', 'long-name-here', {'attr-name': 'long value here'}),
+        ('end', 'long-name-here', None),
+        ('end', 'doc', None),
+        ]
+
+    def test_strings(self):
+        for size in (1, 2, 5, 13, len(self.xml)):
+            chunks = [
+                self.xml[i:i + size] for i in range(0, len(self.xml), size)]
+            scanner = lex.TokenScanner.from_strings(chunks)
+            self.assertEqual(list(scanner.iter_tags()), self.expected, size)
+
+    def test_bytes(self):
+        data = self.xml.encode('utf-8')
+        for size in (1, 3, len(data)):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            scanner = lex.TokenScanner.from_bytes(chunks)
+            self.assertEqual(list(scanner.iter_tags()), self.expected, size)
+
+    def test_mmap(self):
+        import tempfile
+        with tempfile.NamedTemporaryFile('w+b') as f:
+            f.write(self.xml.encode('utf-8'))
+            f.flush()
+            scanner = lex.TokenScanner.from_file(f.name, mmap=True)
+            self.assertEqual(list(scanner.iter_tags()), self.expected)
+
+    def test_not_processing_instruction(self):
+        # ``<?`` without a target is content, whatever the buffering
+        xml = '<r><? <a/> ?></r>'
+        for size in (1, 2, len(xml)):
+            chunks = [xml[i:i + size] for i in range(0, len(xml), size)]
+            scanner = lex.TokenScanner.from_strings(chunks)
+            self.assertEqual(
+                list(scanner.iter_tags()),
+                [('start', 'r', {}), ('empty', 'a', {}), ('end', 'r', None)],
+                size)
+
+    def test_incomplete(self):
+        for xml in ('<a><b x="1', '<a><b', '<a></b'):
+            scanner = lex.TokenScanner.from_strings([xml])
+            self.assertEqual(
+                list(scanner.iter_tags()), [('start', 'a', {})], xml)
+
+
+class TextCacheTests(unittest.TestCase):
+
+    xml = '<a x="v" y="w"><a x="v"/><a x="u" y="w"/></a>'
+
+    def texts(self, scanner, token_class):
+        return [
+            scanner.get_text(token).literal() for token in scanner
+            if isinstance(token, token_class)]
+
+    def test_name_cache(self):
+        for source in (
+                lex.TokenScanner.from_strings([self.xml], name_cache=16),
+                lex.TokenScanner.from_bytes(
+                    [self.xml.encode('utf-8')], name_cache=16)):
+            names = self.texts(source, tokens.MarkupName)
+            self.assertEqual(
+                names, ['a', 'x', 'y', 'a', 'x', 'a', 'x', 'y', 'a'])
+            self.assertIs(names[0], names[3])
+            self.assertIs(names[1], names[6])
+
+    def test_name_cache_full(self):
+        scanner = lex.TokenScanner.from_strings([self.xml], name_cache=1)
+        self.assertEqual(
+            self.texts(scanner, tokens.MarkupName),
+            ['a', 'x', 'y', 'a', 'x', 'a', 'x', 'y', 'a'])
+        self.assertEqual(len(scanner.name_cache.entries), 1)
+
+    def test_value_cache(self):
+        scanner = lex.TokenScanner.from_bytes(
+            [self.xml.encode('utf-8')], value_cache=2)
+        values = self.texts(scanner, tokens.AttributeValue)
+        self.assertEqual(values, ['v', 'w', 'v', 'u', 'w'])
+        self.assertIs(values[0], values[2])
+        # 'w' was evicted by 'u'
+        self.assertEqual(list(scanner.value_cache.entries), [b'u', b'w'])
+
+    def test_split_names(self):
+        scanner = lex.TokenScanner.from_strings(
+            ['<ab', 'c/><abc/>'], name_cache=16)
+        self.assertEqual(
+            self.texts(scanner, tokens.TagName), ['ab', 'c', 'abc'])
+
+    def test_iter_tags(self):
+        scanner = lex.TokenScanner.from_bytes(
+            [self.xml.encode('utf-8')], name_cache=16, value_cache=16)
+        events = list(scanner.iter_tags())
+        self.assertEqual(events[0], ('start', 'a', {'x': 'v', 'y': 'w'}))
+        self.assertIs(events[0][1], events[-1][1])
+        self.assertIs(events[0][2]['x'], events[1][2]['x'])
+
+
+class ReferenceContentTests(unittest.TestCase):
+
+    xml = (
+        '<a x="&lt;&#65;&amp;&amp" y=\'&#x263A;\'>caf&#233; &amp;&amp; '
+        '&lt;b&gt; &unknown; & done&amp;</a>&#66;')
+
+    def contents(self, scanner):
+        result = {}
+        for token in scanner:
+            if isinstance(token, (tokens.Content, tokens.AttributeValue)):
+                name = token.__class__.__name__
+                content = scanner.get_text(token).content()
+                result[name] = result.get(name, '') + content
+        return result
+
+    def test_split_references(self):
+        expected = {
+            'AttributeValue': '<A&&amp\u263a',
+            'PCData': 'caf\xe9 && <b> &unknown; & done&B',
+            'WhitespaceContent': '',
+            }
+        for size in (1, 2, 3, 5, len(self.xml)):
+            chunks = [
+                self.xml[i:i + size] for i in range(0, len(self.xml), size)]
+            result = self.contents(lex.TokenScanner.from_strings(chunks))
+            result.setdefault('WhitespaceContent', '')
+            self.assertEqual(result, expected, size)
+            data = self.xml.encode('utf-8')
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            result = self.contents(lex.TokenScanner.from_bytes(chunks))
+            result.setdefault('WhitespaceContent', '')
+            self.assertEqual(result, expected, size)
+
+    def test_get_text_twice(self):
+        scanner = lex.TokenScanner.from_strings(
+            ['<a>x &a', 'mp; y &#', '65;</a>'])
+        contents = []
+        for token in scanner:
+            if isinstance(token, tokens.PCData):
+                scanner.get_text(token)
+                contents.append(scanner.get_text(token).content())
+        self.assertEqual(contents, ['x ', '& y ', 'A'])
+
+    def test_part_skipped(self):
+        scanner = lex.TokenScanner.from_strings(
+            ['<a>x &a', 'mp; y ', 'z &#', '65;</a>'])
+        contents = []
+        for i, token in enumerate(
+                token for token in scanner
+                if isinstance(token, tokens.PCData)):
+            if i != 1:
+                contents.append(scanner.get_text(token).content())
+        # The held ``&a`` is not added to the part after the skipped part
+        self.assertEqual(contents, ['x ', 'z ', 'A'])
+
+    def test_literal_unchanged(self):
+        scanner = lex.TokenScanner.from_strings(['a&amp;b'])
+        self.assertEqual(
+            ''.join(
+                scanner.get_text(token).literal() for token in scanner),
+            'a&amp;b')
+
+
+class CoalesceTests(unittest.TestCase):
+
+    xml = (
+        '<doc a="a long &amp; split value">\n  text &amp; more text'
+        '<!-- a comment --><![CDATA[some cdata]]>\n<b/>tail</doc>')
+
+    def texts(self, scanner):
+        result = []
+        for token in scanner:
+            text = scanner.get_text(token)
+            cls = token.__class__
+            if issubclass(cls, tokens.StartOrEmptyTagOpen):
+                # Refinement depends on the buffers
+                cls = tokens.StartOrEmptyTagOpen
+            result.append((
+                cls, text.literal(), text.content(), text.is_initial,
+                text.is_final))
+        return result
+
+    def test_whole_nodes(self):
+        expected = self.texts(
+            lex.TokenScanner.from_strings([self.xml], coalesce=1000))
+        self.assertIn(
+            (tokens.PCData, '\n  text &amp; more text', '\n  text & more text',
+             True, True),
+            expected)
+        for size in (1, 2, 3, 7):
+            chunks = [
+                self.xml[i:i + size] for i in range(0, len(self.xml), size)]
+            self.assertEqual(
+                self.texts(lex.TokenScanner.from_strings(
+                    chunks, coalesce=1000)),
+                expected, size)
+
+    def test_unsplit_tokens_unchanged(self):
+        plain = lex.TokenScanner.from_strings([self.xml])
+        joined = lex.TokenScanner.from_strings([self.xml], coalesce=1000)
+        self.assertEqual(
+            [token for token in plain
+             if not isinstance(token, tokens.Content)],
+            [token for token in joined
+             if not isinstance(token, tokens.Content)])
+
+    def test_limit(self):
+        xml = '<a>' + 'x &amp; y ' * 10 + '</a>'
+        for size in (3, 7, 55):
+            chunks = [xml[i:i + size] for i in range(0, len(xml), size)]
+            result = [
+                (text, content, initial, final)
+                for cls, text, content, initial, final in self.texts(
+                    lex.TokenScanner.from_strings(chunks, coalesce=8))
+                if cls is tokens.PCData]
+            self.assertGreater(len(result), 1)
+            for text, content, initial, final in result:
+                self.assertLessEqual(len(text), 8)
+            self.assertEqual(
+                ''.join(item[0] for item in result), 'x &amp; y ' * 10)
+            self.assertEqual(
+                ''.join(item[1] for item in result), 'x & y ' * 10)
+            self.assertEqual(
+                [item[2] for item in result],
+                [True] + [False] * (len(result) - 1))
+            self.assertEqual(
+                [item[3] for item in result],
+                [False] * (len(result) - 1) + [True])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            lex.TokenScanner.from_strings([], coalesce=10, positions=True)
+        with self.assertRaises(ValueError):
+            lex.TokenScanner.from_feed(coalesce=10)
+
+
+class TagLookaheadTests(unittest.TestCase):
+
+    xml = '<doc><a x="1" y="2">text</a><b x="3"/><c/></doc>'
+
+    def tokens(self, scanner):
+        return [
+            (token.__class__, scanner.get_text(token).literal())
+            for token in scanner]
+
+    def tags(self, scanner):
+        # The tag open and close tokens, since other tokens may be split
+        # differently
+        return [
+            token.__class__ for token in scanner
+            if isinstance(token, (
+                tokens.StartOrEmptyTagOpen, tokens.StartTagClose,
+                tokens.EmptyTagClose))]
+
+    def test_refined_across_chunks(self):
+        expected = self.tags(lex.TokenScanner.from_strings([self.xml]))
+        self.assertNotIn(tokens.StartOrEmptyTagOpen, expected)
+        for size in (1, 2, 3, 5):
+            chunks = [
+                self.xml[i:i + size] for i in range(0, len(self.xml), size)]
+            self.assertEqual(
+                self.tags(lex.TokenScanner.from_strings(
+                    chunks, tag_lookahead=32)),
+                expected, size)
+            data = self.xml.encode('utf-8')
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertEqual(
+                self.tags(lex.TokenScanner.from_bytes(
+                    chunks, tag_lookahead=32, bulk=True)),
+                expected, size)
+
+    def test_long_tag_ambiguous(self):
+        chunks = ['<a x="1"', ' y="2"/>']
+        classes = [
+            token.__class__ for token in lex.TokenScanner.from_strings(
+                chunks, tag_lookahead=4)]
+        self.assertEqual(classes[0], tokens.StartOrEmptyTagOpen)
+        self.assertEqual(classes[-1], tokens.EmptyTagClose)
+
+    def test_greater_than_in_value(self):
+        # The tag does not end at the > in the quoted value
+        self.assertEqual(
+            self.tokens(lex.TokenScanner.from_strings(
+                ['<a b="x>y"', ' c="2"', '>x'], tag_lookahead=50))[:15], [
+                (tokens.StartTagOpen, '<'), (tokens.TagName, 'a'),
+                (tokens.MarkupWhitespace, ' '), (tokens.AttributeName, 'b'),
+                (tokens.AttributeEquals, '='),
+                (tokens.AttributeValueDoubleOpen, '"'),
+                (tokens.AttributeValue, 'x>y'),
+                (tokens.AttributeValueDoubleClose, '"'),
+                (tokens.MarkupWhitespace, ' '), (tokens.AttributeName, 'c'),
+                (tokens.AttributeEquals, '='),
+                (tokens.AttributeValueDoubleOpen, '"'),
+                (tokens.AttributeValue, '2'),
+                (tokens.AttributeValueDoubleClose, '"'),
+                (tokens.StartTagClose, '>')])
+
+    def test_end_of_stream(self):
+        self.assertEqual(
+            self.tokens(lex.TokenScanner.from_strings(
+                ['<a', ' x'], tag_lookahead=32)), [
+                (tokens.StartOrEmptyTagOpen, '<'), (tokens.TagName, 'a'),
+                (tokens.MarkupWhitespace, ' '), (tokens.AttributeName, 'x'),
+                (tokens.AttributeName, ''),
+                (tokens.BadlyFormedEndOfStream, '')])
+
+    def test_fed_each_feed(self):
+        chunks = ['<r><a x="1"', '>', 'hi', '<b', '/>', '</r>']
+        results = []
+        for kw in ({}, {'tag_lookahead': 32}):
+            scanner = lex.TokenScanner.from_feed(**kw)
+            results.append([
+                [(token.__class__, token.text.literal())
+                 for token in scanner.feed(chunk)]
+                for chunk in chunks])
+        # Each feed generates the same tokens as without lookahead, so
+        # the scanner never waits for more data to refine a tag
+        self.assertEqual(results[1], results[0])
+        self.assertTrue(all(results[1][:5]))
+
+    def test_reads_only_needed_chunks(self):
+        read = []
+
+        def chunks():
+            for chunk in ['<a', ' x="1"', '>', 'text', '<b/>']:
+                read.append(chunk)
+                yield chunk
+
+        scanner = lex.TokenScanner.from_strings(chunks(), tag_lookahead=64)
+        self.assertIs(next(iter(scanner)).__class__, tokens.StartTagOpen)
+        self.assertEqual(read, ['<a', ' x="1"', '>'])
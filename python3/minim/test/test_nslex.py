@@ -271,3 +271,26 @@ class NamespaceTokenScannerMarkupTests(unittest.TestCase):
         self.assertIsInstance(token, nslex.NamespaceUri, token)
         text = scanner.get_text(token)
         self.assertEqual(text.content(), 'bar')
+
+
+class NamespaceTokenScannerCheckpointTests(unittest.TestCase):
+
+    def test_checkpoint(self):
+        import io
+        xml = '<a xmlns:p="urn:p"><p:b/>text</a>'
+        scanner = nslex.NamespaceTokenScanner.from_strings([xml])
+        checkpoint = None
+        for token in scanner:
+            scanner.get_text(token)
+            if isinstance(token, nslex.NamespaceUri):
+                with self.assertRaises(ValueError):
+                    scanner.checkpoint()
+            elif isinstance(token, tokens.StartOrEmptyTagClose):
+                checkpoint = scanner.checkpoint()
+                break
+        self.assertEqual(checkpoint['offset'], xml.index('<p:b'))
+        resumed = nslex.NamespaceTokenScanner.resume(
+            io.StringIO(xml), checkpoint)
+        literal = ''.join(
+            resumed.get_text(token).literal() for token in resumed)
+        self.assertEqual(literal, '<p:b/>text</a>')
@@ -0,0 +1,122 @@
+import io
+import operator
+import os
+import tempfile
+import unittest
+
+from minim import lex, parallel, tokens
+
+
+def count_start_tags(scanner):
+    return sum(
+        1 for token in scanner
+        if isinstance(token, tokens.StartOrEmptyTagOpen))
+
+
+def literal(scanner):
+    return ''.join(scanner.get_text(token).literal() for token in scanner)
+
+
+def token_classes(scanner):
+    return [token.__class__ for token in scanner]
+
+
+def first_token(scanner):
+    return next(iter(scanner)).__class__
+
+
+class ResyncTests(unittest.TestCase):
+
+    def test_resync(self):
+        f = io.BytesIO(b'a < b <!-- c --> <d/> </e>')
+        self.assertEqual(parallel.resync(f, 0), 0)
+        self.assertEqual(parallel.resync(f, 1), 17)
+        self.assertEqual(parallel.resync(f, 18), 22)
+        self.assertEqual(parallel.resync(f, 23), 26)
+
+    def test_resync_across_blocks(self):
+        f = io.BytesIO(b'xxx<a>')
+        self.assertEqual(parallel.resync(f, 1, block_size=2), 3)
+
+
+class ScanFileTests(unittest.TestCase):
+
+    # Comments, CDATA sections, and attribute values containing text
+    # that looks like a tag, so that some ranges start inside them.
+    xml = (
+        '<?xml version="1.0"?>\n<doc>\n' +
+        ''.join(
+            '  <r n="%d" a="<b>&lt;"><!-- <c/> <c/> --><![CDATA[<d>]]>'
+            'caf\xe9</r>\n' % i
+            for i in range(50)) +
+        '</doc>\n')
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.xml.encode('utf-8'))
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_count(self):
+        expected = count_start_tags(
+            lex.TokenScanner.from_strings([self.xml]))
+        for workers in (1, 2, 7, 40):
+            self.assertEqual(
+                parallel.scan_file(
+                    self.path, count_start_tags, workers=workers,
+                    reducer=operator.add),
+                expected, workers)
+
+    def test_ranges_in_order(self):
+        for workers in (3, 40):
+            self.assertEqual(
+                ''.join(parallel.scan_file(
+                    self.path, literal, workers=workers)),
+                self.xml, workers)
+
+    def test_range_blocks(self):
+        data = self.xml.encode('utf-8')
+        start = parallel.resync(io.BytesIO(data), len(data) // 2)
+        self.assertEqual(
+            b''.join(parallel.read_range(self.path, start, len(data), 7)),
+            data[start:])
+        result, truncated = parallel.scan_range(
+            self.path, start, len(data), literal, block_size=7)
+        self.assertEqual(result, data[start:].decode('utf-8'))
+        self.assertIs(truncated, False)
+        self.assertEqual(
+            parallel.scan_file(
+                self.path, count_start_tags, workers=7, block_size=7,
+                reducer=operator.add),
+            count_start_tags(lex.TokenScanner.from_strings([self.xml])))
+
+    def test_unread_tokens(self):
+        results = parallel.scan_file(self.path, first_token, workers=40)
+        self.assertEqual(results[0], tokens.ProcessingInstructionOpen)
+        self.assertEqual(
+            set(results[1:]), {tokens.StartTagOpen, tokens.EndTagOpen})
+
+    def test_interest(self):
+        self.assertEqual(
+            parallel.scan_file(
+                self.path, count_start_tags, workers=40,
+                reducer=operator.add,
+                interest={tokens.StartOrEmptyTagOpen}),
+            51)
+
+    def test_interest_end_hidden(self):
+        data = self.xml.encode('utf-8')
+        # End the range inside the first comment
+        end = data.index(b'<c/>')
+        result, truncated = parallel.scan_range(
+            self.path, 0, end, token_classes,
+            interest={tokens.StartOrEmptyTagOpen})
+        self.assertIs(truncated, True)
+        self.assertEqual(result, [tokens.StartTagOpen, tokens.StartTagOpen])
+        result, truncated = parallel.scan_range(
+            self.path, 0, end, token_classes,
+            interest={tokens.StartOrEmptyTagOpen, tokens.Markup})
+        self.assertIs(truncated, True)
+        self.assertEqual(result[-1], tokens.BadlyFormedEndOfStream)
@@ -43,3 +43,172 @@ class TestContent(unittest.TestCase):
         self.assertIsInstance(c, tokens.Content)
         self.assertIs(t.text, None)
         self.assertIs(c.text, th)
+
+
+class TestSpanTextHolder(unittest.TestCase):
+
+    def test_literal_is_span(self):
+        c = tokens.SpanTextHolder()
+        c.set_span('<a>hello</a>', 3, 8)
+        self.assertEqual(c.literal(), 'hello')
+        self.assertEqual(c.content(), 'hello')
+        self.assertIsNone(c.buffer)
+
+    def test_encoded_span(self):
+        buffer = '<a>hel€o</a>'.encode('utf-8')
+        c = tokens.SpanTextHolder()
+        c.set_span(buffer, 3, 10, 'utf-8')
+        self.assertTrue(c.startswith('hel€'))
+        self.assertFalse(c.startswith('help'))
+        self.assertEqual(c, 'hel€o')
+        self.assertNotEqual(c, 'hel€')
+        self.assertEqual(c.literal(), 'hel€o')
+
+    def test_compare_without_slicing(self):
+        buffer = '<a>hello</a>'
+        c = tokens.SpanTextHolder()
+        c.set_span(buffer, 3, 8)
+        self.assertTrue(c.startswith('hell'))
+        self.assertFalse(c.startswith('hello</a>'))
+        self.assertEqual(c, 'hello')
+        self.assertNotEqual(c, 'hell')
+        self.assertEqual(c, tokens.TextHolder('hello'))
+        self.assertIs(c.buffer, buffer)
+
+    def test_write_to(self):
+        import io
+        c = tokens.SpanTextHolder()
+        c.set_span(b'<a>hello</a>', 3, 8, 'utf-8')
+        f = io.BytesIO()
+        c.write_to(f)
+        self.assertEqual(f.getvalue(), b'hello')
+        c.set_span('<a>hello</a>', 3, 8)
+        f = io.StringIO()
+        c.write_to(f)
+        self.assertEqual(f.getvalue(), 'hello')
+
+    def test_text_holder_unchanged(self):
+        h = tokens.TextHolder('a')
+        self.assertEqual(hash(h), hash(h))
+        self.assertNotEqual(tokens.TextHolder(), 'x')
+        self.assertIn(h, [tokens.TextHolder(), h])
+        self.assertEqual(tokens.TextHolder('a'), tokens.SpanTextHolder('a'))
+        self.assertNotEqual(tokens.SpanTextHolder(), 'x')
+        self.assertNotEqual(tokens.SpanTextHolder(), tokens.TextHolder())
+
+    def test_set_releases_buffer(self):
+        c = tokens.SpanTextHolder()
+        c.set_span('<a>hello</a>', 3, 8)
+        c.set('world')
+        self.assertIsNone(c.buffer)
+        self.assertEqual(c, 'world')
+
+
+class TestReferences(unittest.TestCase):
+
+    def test_decode(self):
+        self.assertEqual(
+            tokens.decode_references(
+                'a &amp; b &lt;&gt;&quot;&apos; &#233;&#xE9;&#XE9;'),
+            'a & b <>"\' \xe9\xe9&#XE9;')
+
+    def test_no_references_not_copied(self):
+        s = 'no references here'
+        self.assertIs(tokens.decode_references(s), s)
+
+    def test_unknown_and_invalid(self):
+        s = '&nbsp; & &; &#xFFFFFFFFFF; &#1114112;'
+        self.assertEqual(tokens.decode_references(s), s)
+
+    def test_content_only_when_set(self):
+        c = tokens.TextHolder('&amp;')
+        self.assertEqual(c.content(), '&amp;')
+        c.set('&amp;')
+        c.set_references()
+        self.assertEqual(c.content(), '&')
+        self.assertEqual(c.literal(), '&amp;')
+
+    def test_prefix_and_hold(self):
+        c = tokens.TextHolder('p; x &l')
+        c.set_references('&am', 2)
+        self.assertEqual(c.content(), '& x ')
+
+
+class TestSlots(unittest.TestCase):
+
+    def test_no_instance_dict(self):
+        from minim import nslex
+        objects = [tokens.TextHolder('x'), tokens.SpanTextHolder()]
+        for cls in (
+                tokens.PCData, tokens.WhitespaceContent, tokens.TagName,
+                tokens.StartOrEmptyTagOpen, tokens.BadlyFormedEndOfStream,
+                nslex.NamespacePrefix, nslex.NamespaceUri):
+            objects.append(cls())
+        for obj in objects:
+            self.assertFalse(hasattr(obj, '__dict__'), obj)
+
+    def test_is_token(self):
+        self.assertIs(tokens.PCData().is_token, True)
+
+
+class TestCategoryFlags(unittest.TestCase):
+
+    def test_flags_match_classes(self):
+        from minim import nslex
+        categories = (
+            ('is_content', tokens.CONTENT, tokens.Content),
+            ('is_markup', tokens.MARKUP, tokens.Markup),
+            ('is_well_formed', tokens.WELL_FORMED, tokens.WellFormed),
+            ('is_name', tokens.NAME, tokens.MarkupName),
+            ('is_data', tokens.DATA, tokens.MarkupData),
+            )
+        classes = [
+            cls for cls in vars(tokens).values()
+            if isinstance(cls, type) and issubclass(cls, tokens.Token)]
+        classes += [nslex.NamespacePrefix, nslex.NamespaceUri]
+        for cls in classes:
+            token = cls()
+            for name, bit, base in categories:
+                expected = isinstance(token, base)
+                self.assertIs(getattr(token, name), expected, (cls, name))
+                self.assertEqual(bool(token.flags & bit), expected, cls)
+
+    def test_badly_formed_content(self):
+        token = tokens.BadlyFormedLessThanToken
+        self.assertTrue(token.is_content)
+        self.assertFalse(token.is_well_formed)
+
+
+class TestKinds(unittest.TestCase):
+
+    def test_kinds(self):
+        for kind, cls in enumerate(tokens.kinds):
+            self.assertIs(cls.kind, kind)
+        self.assertEqual(tokens.Token.kind, 0)
+        self.assertNotEqual(tokens.PCData.kind, tokens.Content.kind)
+
+    def test_dispatch_table(self):
+        table = tokens.dispatch_table({
+            tokens.Content: 'content',
+            tokens.WhitespaceContent: 'space',
+            tokens.MarkupName: 'name',
+            tokens.Markup: 'markup',
+            }, default='other')
+        self.assertEqual(len(table), len(tokens.kinds))
+        self.assertEqual(table[tokens.PCData.kind], 'content')
+        self.assertEqual(table[tokens.WhitespaceContent().kind], 'space')
+        self.assertEqual(table[tokens.TagName.kind], 'name')
+        self.assertEqual(table[tokens.StartTagClose.kind], 'markup')
+        self.assertEqual(table[tokens.Token.kind], 'other')
+
+    def test_later_subclass(self):
+        n = len(tokens.kinds)
+
+        class Special(tokens.PCData):
+            __slots__ = ()
+        # Classes outside the package are not added to the kinds
+        self.assertEqual(len(tokens.kinds), n)
+        self.assertEqual(Special.kind, tokens.PCData.kind)
+        table = tokens.dispatch_table({tokens.Content: 'content'})
+        self.assertEqual(table[Special.kind], 'content')
+        self.assertIsNone(table[tokens.Markup.kind])
@@ -1,9 +1,43 @@
+import re
+
 
 class EmptyTextHolderException(Exception):
 
     pass
 
 
+# Entities defined by XML
+entities = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+_reference_pattern = re.compile(
+    r'&(?:#(?P<decimal>[0-9]+)|#x(?P<hex>[0-9a-fA-F]+)|(?P<name>[\w:.-]+));')
+
+
+def _replace_reference(m):
+    name = m.group('name')
+    if name is not None:
+        return entities.get(name, m.group())
+    decimal = m.group('decimal')
+    try:
+        if decimal is not None:
+            return chr(int(decimal))
+        return chr(int(m.group('hex'), 16))
+    except (ValueError, OverflowError):
+        return m.group()
+
+
+def decode_references(s):
+    """Replace the character and entity references in a string.
+
+    A string without an ``&`` is returned unchanged.  Otherwise, the
+    references are replaced in a single pass.  References to unknown
+    entities, and invalid character references, are left unchanged.
+    """
+    if '&' not in s:
+        return s
+    return _reference_pattern.sub(_replace_reference, s)
+
+
 class UndefinedValue:
     pass
 
@@ -13,6 +47,10 @@ Undefined = UndefinedValue()
 
 class TextHolder:
 
+    __slots__ = (
+        'encoded', 'encoding', '_content', 'is_initial', 'is_final',
+        'references', 'reference_prefix', 'reference_hold')
+
     def __init__(
             self, encoded=Undefined, encoding=None, content=Undefined,
             is_initial=True, is_final=True):
@@ -27,6 +65,15 @@ class TextHolder:
         # and final blocks
         self.is_initial = is_initial
         self.is_final = is_final
+        self.references = False
+        self.reference_prefix = ''
+        self.reference_hold = 0
+
+    def set_span(self, buffer, start, end, encoding=None, content=Undefined,
+                 is_initial=True, is_final=True):
+        """Set the text to the characters ``buffer[start:end]``."""
+        self.set(
+            buffer[start:end], encoding, content, is_initial, is_final)
 
     def literal(self):
         if self.encoded is Undefined:
@@ -52,14 +99,207 @@ class TextHolder:
             self._content = self.make_content()
         return self._content
 
+    def set_references(self, prefix='', hold=0):
+        """Decode references in the content of the text.
+
+        For text split over several holders, a reference may be split
+        between holders.  ``prefix`` is the start of a reference held
+        back from the previous holders, and is added to the start of
+        the text.  ``hold`` is the number of characters at the end of
+        the prefixed text that may start a reference, and are left for
+        the next holder.
+        """
+        self.references = True
+        self.reference_prefix = prefix
+        self.reference_hold = hold
+
     def make_content(self):
-        return self.literal()
+        literal = self.literal()
+        if not self.references:
+            return literal
+        if self.reference_prefix:
+            literal = self.reference_prefix + literal
+        if self.reference_hold:
+            literal = literal[:-self.reference_hold]
+        return decode_references(literal)
+
+    def startswith(self, prefix):
+        """Return whether the literal text starts with a string."""
+        return self.literal().startswith(prefix)
+
+    def write_to(self, fileobj):
+        """Write the literal text to a file object.
+
+        Encoded text that has not been decoded by ``literal`` is written
+        as bytes, so ``fileobj`` must be a binary file.  Otherwise,
+        ``fileobj`` must be a text file.
+        """
+        fileobj.write(self.literal() if self.encoding is None else
+                      self.encoded)
+
+
+class SpanTextHolder(TextHolder):
 
+    """A text holder that refers to the text in the source buffer.
 
-class Token:
+    The text is only sliced from the buffer when ``literal`` or
+    ``content`` is called, so a token that is never materialised costs
+    no allocation.  ``startswith``, ``write_to``, and comparison with a
+    string use the buffer directly.  The holder is compared by its
+    text, with a string or another holder, so it is not hashable.
+
+    The holder keeps a reference to the buffer until the text is
+    sliced, or the holder is set to other text.
+    """
+
+    __slots__ = ('buffer', 'start', 'end')
+
+    def set(self, encoded=Undefined, encoding=None, content=Undefined,
+            is_initial=True, is_final=True):
+        super().set(encoded, encoding, content, is_initial, is_final)
+        self.buffer = None
+
+    def set_span(self, buffer, start, end, encoding=None, content=Undefined,
+                 is_initial=True, is_final=True):
+        super().set(Undefined, encoding, content, is_initial, is_final)
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+
+    def _slice(self):
+        if self.buffer is not None:
+            self.encoded = self.buffer[self.start:self.end]
+            self.buffer = None
+
+    def literal(self):
+        self._slice()
+        return super().literal()
+
+    def literal_bytes(self, encoding):
+        self._slice()
+        return super().literal_bytes(encoding)
+
+    def _encode(self, s):
+        # Return the string in the same form as the buffer, or None if
+        # it cannot be encoded.
+        if self.encoding is None:
+            return s
+        try:
+            return s.encode(self.encoding)
+        except UnicodeEncodeError:
+            return None
+
+    def startswith(self, prefix):
+        if self.buffer is None:
+            return super().startswith(prefix)
+        prefix = self._encode(prefix)
+        return (
+            prefix is not None and len(prefix) <= self.end - self.start and
+            self._buffer_startswith(prefix))
+
+    def _buffer_startswith(self, prefix):
+        # ``find`` is also supported by ``mmap``, which has no
+        # ``startswith``
+        start = self.start
+        return self.buffer.find(prefix, start, start + len(prefix)) == start
+
+    def write_to(self, fileobj):
+        if self.buffer is None:
+            super().write_to(fileobj)
+        elif self.encoding is None:
+            fileobj.write(self.buffer[self.start:self.end])
+        else:
+            fileobj.write(memoryview(self.buffer)[self.start:self.end])
+
+    def __eq__(self, other):
+        if isinstance(other, TextHolder):
+            if (other.encoded is Undefined and
+                    getattr(other, 'buffer', None) is None):
+                return False
+            other = other.literal()
+        elif not isinstance(other, str):
+            return NotImplemented
+        if self.buffer is None:
+            return self.encoded is not Undefined and self.literal() == other
+        other = self._encode(other)
+        return (
+            other is not None and len(other) == self.end - self.start and
+            self._buffer_startswith(other))
+
+    # The holder is mutable, and is compared by its text
+    __hash__ = None
+
+
+# Bits of ``Token.flags``, one for each category of token
+CONTENT = 1
+MARKUP = 2
+WELL_FORMED = 4
+NAME = 8
+DATA = 16
+
+
+# The token classes, indexed by their ``kind``.  Classes are added as
+# they are defined, so the kinds of the classes in this module do not
+# change, and classes defined in other modules of the package take the
+# following kinds.
+kinds = []
+
+
+def _is_package_module(name):
+    """Return whether a module is a top-level module of this package."""
+    package, dot, module = name.partition('.')
+    return package == __name__.partition('.')[0] and '.' not in module
+
+
+class TokenType(type):
+
+    """The metaclass of tokens, which sets the flags and kind of a class."""
+
+    def __init__(cls, name, bases, namespace, **kw):
+        super().__init__(name, bases, namespace, **kw)
+        if _is_package_module(cls.__module__):
+            cls.kind = len(kinds)
+            kinds.append(cls)
+        flags = 0
+        for base in cls.__mro__:
+            flags |= base.__dict__.get('category', 0)
+        cls.flags = flags
+        cls.is_content = bool(flags & CONTENT)
+        cls.is_markup = bool(flags & MARKUP)
+        cls.is_well_formed = bool(flags & WELL_FORMED)
+        cls.is_name = bool(flags & NAME)
+        cls.is_data = bool(flags & DATA)
+
+
+class Token(metaclass=TokenType):
+
+    """A token generated by a scanner.
+
+    Each token class has a ``flags`` bitmask of the categories that the
+    class is in, and a boolean flag for each category: ``is_content``,
+    ``is_markup``, ``is_well_formed``, ``is_name`` and ``is_data``.
+    These are computed by the metaclass ``TokenType`` when the class is
+    defined, from the ``category`` of the class and its bases, and
+    stored on the class itself, so testing a category is a single
+    attribute lookup, rather than an ``isinstance`` check against the
+    class hierarchy.
+
+    Each token class defined in a module of this package also has a
+    ``kind``, a small integer that is its index in ``kinds``.  Other
+    subclasses are not added to ``kinds``, so defining classes does not
+    grow it, and they have the ``kind`` of their nearest base class.
+    See ``dispatch_table``.
+    """
+
+    __slots__ = ('text',)
+
+    is_token = True
+    kind = 0
+    category = 0
+    flags = 0
+    is_content = is_markup = is_well_formed = is_name = is_data = False
 
     def __init__(self, text=None):
-        self.is_token = True
         self.text = text
 
     def clone(self, text):
@@ -77,20 +317,46 @@ class Token:
         return issubclass(cls, token)
 
 
+def dispatch_table(handlers, default=None):
+    """Build a list of handlers indexed by token kind.
+
+    :param dict handlers: Handlers keyed by token class.  A class
+        without a handler uses the handler of its nearest base class in
+        ``handlers``, found once when the table is built.
+    :param default: The handler for classes with no base class in
+        ``handlers``.
+    :return list: The handlers, so that the handler for a token is
+        ``table[token.kind]``.  The table only covers the classes
+        defined when it is built.  A class outside the package uses the
+        handler of the base class whose ``kind`` it has.
+    """
+    table = []
+    for cls in kinds:
+        for base in cls.__mro__:
+            if base in handlers:
+                table.append(handlers[base])
+                break
+        else:
+            table.append(default)
+    return table
+
+
 class WellFormed:
-    pass
+    __slots__ = ()
+    category = WELL_FORMED
 
 
 class Content(Token):
-    pass
+    __slots__ = ()
+    category = CONTENT
 
 
 class CData(WellFormed, Content):
-    pass
+    __slots__ = ()
 
 
 class PCData(WellFormed, Content):
-    pass
+    __slots__ = ()
 
 
 class WhitespaceContent(PCData):
@@ -102,6 +368,8 @@ class WhitespaceContent(PCData):
     to scan content.
     """
 
+    __slots__ = ()
+
 
 # Non well-formed content is used to recover from invalid markup, which
 # can be interpreted as badly-formatted content.  For example, any '<'
@@ -112,51 +380,56 @@ BadlyFormedLessThanToken = Content(TextHolder(encoded='<', content='<'))
 
 
 class Markup(Token):
-    pass
+    __slots__ = ()
+    category = MARKUP
 
 
 class MarkupStructure(WellFormed, Markup):
-    pass
+    __slots__ = ()
 
 
 class MarkupName(WellFormed, Markup):
-    pass
+    __slots__ = ()
+    category = NAME
 
 
 class MarkupData(WellFormed, Markup):
-    pass
+    __slots__ = ()
+    category = DATA
 
 
 class MarkupWhitespace(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class TagName(MarkupName):
-    pass
+    __slots__ = ()
 
 
 class AttributeName(MarkupName):
-    pass
+    __slots__ = ()
 
 
 class AttributeValue(MarkupData):
-    pass
+    __slots__ = ()
 
 
 class ProcessingInstructionTarget(MarkupName):
-    pass
+    __slots__ = ()
 
 
 class ProcessingInstructionData(MarkupData):
-    pass
+    __slots__ = ()
 
 
 class CommentData(MarkupData):
-    pass
+    __slots__ = ()
 
 
 class StartOrEmptyTagOpen(MarkupStructure):
 
+    __slots__ = ()
+
     def refine(self, close_tag_token):
         """Change an ambiguous tag into a specific tag."""
         if isinstance(close_tag_token, StartOrEmptyTagClose):
@@ -169,94 +442,106 @@ class StartOrEmptyTagOpen(MarkupStructure):
 
 class StartTagOpen(StartOrEmptyTagOpen):
 
+    __slots__ = ()
+
     def refine(self, close_tag_token):
         return self
 
 
 class EmptyTagOpen(StartOrEmptyTagOpen):
 
+    __slots__ = ()
+
     def refine(self, close_tag_token):
         return self
 
 
 class EndTagOpen(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class AttributeEquals(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class AttributeValueOpen(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class AttributeValueDoubleOpen(AttributeValueOpen):
-    pass
+    __slots__ = ()
 
 
 class AttributeValueSingleOpen(AttributeValueOpen):
-    pass
+    __slots__ = ()
 
 
 class AttributeValueClose(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class AttributeValueDoubleClose(AttributeValueClose):
-    pass
+    __slots__ = ()
 
 
 class AttributeValueSingleClose(AttributeValueClose):
-    pass
+    __slots__ = ()
 
 
 class StartOrEmptyTagClose(MarkupStructure):
 
+    __slots__ = ()
+
     def get_tag_open_class(self):
         raise NotImplementedError()
 
 
 class StartTagClose(StartOrEmptyTagClose):
 
+    __slots__ = ()
+
     def get_tag_open_class(self):
         return StartTagOpen
 
 
 class EmptyTagClose(StartOrEmptyTagClose):
 
+    __slots__ = ()
+
     def get_tag_open_class(self):
         return EmptyTagOpen
 
 
 class EndTagClose(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class ProcessingInstructionOpen(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class ProcessingInstructionClose(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class CommentOpen(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class CommentClose(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class CDataOpen(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class CDataClose(MarkupStructure):
-    pass
+    __slots__ = ()
 
 
 class BadlyFormedEndOfStream(Markup):
 
     """Class to represent markup that is not terminated properly."""
+
+    __slots__ = ()
@@ -4,10 +4,10 @@ import minim.lex
 import minim.tokens
 
 
-def run(doc):
+def run(filename):
     start_element = minim.tokens.StartOrEmptyTagOpen
     count = 0
-    scanner = minim.lex.TokenScanner.from_strings(doc)
+    scanner = minim.lex.TokenScanner.from_file(filename)
     for token in scanner:
         if isinstance(token, start_element):
             count += 1
@@ -16,15 +16,7 @@ def run(doc):
 
 def main():
     filename = sys.argv[1]
-    if filename.endswith('.gz'):
-        import gzip
-        f = gzip.open(filename, 'rt', encoding='utf-8')
-    else:
-        f = open(filename, 'rt', encoding='utf-8')
-    try:
-        count = run(f)
-    finally:
-        f.close()
+    count = run(filename)
     print(count)
 
 if __name__ == '__main__':
@@ -0,0 +1,23 @@
+import sys
+
+import minim.lex
+import minim.tokens
+
+
+def run(filename):
+    start_element = minim.tokens.StartOrEmptyTagOpen
+    count = 0
+    scanner = minim.lex.TokenScanner.from_file(
+        filename, interest={start_element})
+    for token in scanner:
+        count += 1
+    return count
+
+
+def main():
+    filename = sys.argv[1]
+    count = run(filename)
+    print(count)
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,10 @@ import sys
 from minim import nslex, tokens
 
 
-def run(doc):
+def run(filename):
     start_element = tokens.StartOrEmptyTagOpen
     count = 0
-    scanner = nslex.NamespaceTokenScanner.from_strings(doc)
+    scanner = nslex.NamespaceTokenScanner.from_file(filename)
     for token in scanner:
         if isinstance(token, start_element):
             count += 1
@@ -15,15 +15,7 @@ def run(doc):
 
 def main():
     filename = sys.argv[1]
-    if filename.endswith('.gz'):
-        import gzip
-        f = gzip.open(filename, 'rt', encoding='utf-8')
-    else:
-        f = open(filename, 'rt', encoding='utf-8')
-    try:
-        count = run(f)
-    finally:
-        f.close()
+    count = run(filename)
     print(count)
 
 if __name__ == '__main__':
@@ -0,0 +1,28 @@
+import operator
+import sys
+
+import minim.parallel
+import minim.tokens
+
+
+def count(scanner):
+    start_element = minim.tokens.StartOrEmptyTagOpen
+    count = 0
+    for token in scanner:
+        if isinstance(token, start_element):
+            count += 1
+    return count
+
+
+def run(filename, workers=None):
+    return minim.parallel.scan_file(
+        filename, count, workers=workers, reducer=operator.add)
+
+
+def main():
+    filename = sys.argv[1]
+    count = run(filename)
+    print(count)
+
+if __name__ == '__main__':
+    main()